@@ -0,0 +1,133 @@
+"""
+Alternative routes between two stations, besides the cheapest one.
+
+Via-station method: one search tree from each end gives, for every station
+v, the cheapest trip that passes through v (source -> v joined to v ->
+target). Those trips are tried cheapest first. A trip is kept if it is
+within ALTERNATIVES_MAX_STRETCH of the best cost, visits no station twice,
+and does not mostly ride the same corridors as a trip already kept.
+"""
+import time
+
+from django.conf import settings
+
+from dijkstras import _compact_path, astar, join_paths, path_cost, reverse_path, shortest_path_tree
+
+# Alternatives may cost at most this much more than the best trip (0.4 = 40%)
+ALTERNATIVES_MAX_STRETCH = getattr(settings, "ALTERNATIVES_MAX_STRETCH", 0.4)
+
+# ... and share at most this fraction of their kilometres with any trip
+# already chosen. Corridors are compared by station pair, so riding EV1
+# instead of EV4 along the same stops counts as shared.
+ALTERNATIVES_MAX_OVERLAP = getattr(settings, "ALTERNATIVES_MAX_OVERLAP", 0.6)
+
+# Stop looking once this much time (ms) has gone, returning what was found
+ALTERNATIVES_BUDGET_MS = getattr(settings, "ALTERNATIVES_BUDGET_MS", 50)
+
+
+def _corridors(path):
+    """{frozenset({a, b}): km} for each leg of a path."""
+    return {frozenset((prev.station, step.station)): step.distance_from_prev
+            for prev, step in zip(path, path[1:])}
+
+
+def _overlap(corridors, other):
+    total = sum(corridors.values())
+    if total <= 0:
+        return 1.0
+    return sum(km for leg, km in corridors.items() if leg in other) / total
+
+
+def alternative_routes(compact_graph, source_node, target_node, max_alternatives=2, trees=None,
+                       budget_ms=None, stats=None):
+    """
+    Returns [(cost, path_with_routes, via)] - the cheapest trip first
+    (via None), then up to max_alternatives different ones by increasing
+    cost, each with the station it was routed through. [] if the target
+    is unreachable.
+
+    trees (a RouteTable or SourceTreeCache) supplies the two search trees
+    when it has them; otherwise both are searched, bounded by the stretch
+    and the time budget.
+    stats receives 'candidates' tried and whether the budget ran out.
+    """
+    cg = compact_graph
+    started = time.perf_counter()
+    deadline = started + (ALTERNATIVES_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+
+    best_path = None
+    if trees is not None:
+        forward = trees.tree(source_node)
+        backward = trees.tree(target_node)
+    else:
+        best_cost, best_path = astar(cg, source_node, target_node)
+        if best_cost == float("inf"):
+            return []
+        # Only stations inside the stretch "ellipse" around the two ends can
+        # be via stations, so neither tree needs to look further than that
+        bound = best_cost * (1 + ALTERNATIVES_MAX_STRETCH)
+        forward = shortest_path_tree(cg, source_node, max_cost=bound, toward=target_node, deadline=deadline)
+        backward = shortest_path_tree(cg, target_node, max_cost=bound, toward=source_node, deadline=deadline)
+
+    forward_state, forward_cost, forward_parent, forward_edge = forward
+    backward_state, backward_cost, backward_parent, backward_edge = backward
+    source = cg.station_index[source_node]
+    target = cg.station_index[target_node]
+    if best_path is None:
+        if forward_state[target] < 0:
+            return []
+        best_cost = forward_cost[target]
+        best_path = _compact_path(cg, forward_parent, forward_edge, forward_state[target])
+    routes = [(best_cost, best_path, None)]
+    limit = best_cost * (1 + ALTERNATIVES_MAX_STRETCH)
+
+    # Cost through each station, not counting a transfer where the halves meet
+    candidates = []
+    for v in range(len(cg.station_names)):
+        if v == source or v == target or forward_state[v] < 0 or backward_state[v] < 0:
+            continue
+        cost = forward_cost[v] + backward_cost[v]
+        if cost <= limit:
+            candidates.append((cost, v))
+    candidates.sort()
+
+    chosen = [_corridors(best_path)]
+    # A via station on a kept trip would mostly give that trip back
+    covered = {step.station for step in best_path}
+    tried = 0
+    out_of_time = False
+    for cost, v in candidates:
+        if len(routes) > max_alternatives:
+            break
+        if time.perf_counter() > deadline:
+            out_of_time = True
+            break
+        name = cg.station_names[v]
+        if name in covered:
+            continue
+        tried += 1
+
+        first = _compact_path(cg, forward_parent, forward_edge, forward_state[v])
+        second = reverse_path(_compact_path(cg, backward_parent, backward_edge, backward_state[v]))
+        path = join_paths(first, second)
+        stations = [step.station for step in path]
+        if len(set(stations)) != len(stations):
+            continue
+        total = path_cost(path)
+        if total > limit:
+            continue
+        corridors = _corridors(path)
+        if any(_overlap(corridors, other) > ALTERNATIVES_MAX_OVERLAP for other in chosen):
+            continue
+
+        routes.append((total, path, name))
+        chosen.append(corridors)
+        covered.update(stations)
+
+    if stats is not None:
+        stats['candidates'] = tried
+        stats['out_of_time'] = out_of_time
+        stats['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    # Junction transfers can reorder costs slightly
+    routes[1:] = sorted(routes[1:], key=lambda route: route[0])
+    return routes
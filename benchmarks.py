@@ -0,0 +1,336 @@
+import csv
+import json
+import math
+import os
+import platform
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+
+from contraction import build_contraction_hierarchy
+from dijkstras import CompactGraph, analyze_route_path, dijkstra
+from routefinder import route_cache
+from timetable import raptor
+from transit import GraphSnapshot, graph_from_rows, normalize
+
+# Where `benchmark_routing --save-baseline` writes and comparisons read.
+# The baseline holds only COUNT_METRICS, which are the same on every
+# machine for a given seed and query count, so it is committed and
+# benchmark_routing fails without it. Timings are machine-specific and go
+# to a separate, uncommitted file per machine/CI runner.
+BENCHMARK_BASELINE = getattr(settings, "BENCHMARK_BASELINE",
+                             os.path.join(settings.BASE_DIR, "benchmark_baseline.json"))
+BENCHMARK_TIMINGS = getattr(settings, "BENCHMARK_TIMINGS",
+                            os.path.join(settings.BASE_DIR, "benchmark_timings.json"))
+
+# Search work per query: states expanded and heap pushes
+COUNT_METRICS = ('expanded', 'pushed')
+
+# A metric regresses when it exceeds baseline * threshold. Counts are
+# deterministic for a fixed seed, so any real growth there is flagged.
+REGRESSION_THRESHOLD = getattr(settings, "BENCHMARK_REGRESSION_THRESHOLD", 1.3)
+COUNT_THRESHOLD = 1.01
+# Timing differences below this are noise, whatever the ratio
+MIN_REGRESSION_MS = 0.05
+
+SYNTHETIC_SIZES = (1000, 10000, 50000)
+
+# Calls traced for allocations; tracemalloc slows everything down
+ALLOC_SAMPLES = 5
+
+# Graph builds are timed this many times per network
+BUILD_REPEATS = 3
+
+# "Leave at" time for the RAPTOR case: 08:00, inside the default service hours
+RAPTOR_DEPARTURE = 8 * 60
+
+# Contraction takes minutes from ~10k stations, so bigger networks skip
+# the contraction cases
+CONTRACTION_MAX_STATIONS = 3000
+
+
+class Network:
+    """A network as stations.txt/routes.txt rows, independent of the database."""
+
+    def __init__(self, name, stations, routes):
+        self.name = name
+        self.stations = stations
+        self.routes = routes
+
+    def route_rows(self):
+        names = {station_id: station_name for station_id, station_name, _, _ in self.stations}
+        return [(route_id, names[from_id], names[to_id], km)
+                for route_id, from_id, to_id, km in self.routes]
+
+    def snapshot(self):
+        graph, route_info, routes_per_station = graph_from_rows(
+            (station_name for _, station_name, _, _ in self.stations), self.route_rows())
+        stations = [{
+            'station_id': station_id,
+            'station_name': station_name,
+            'normalized_name': normalize(station_name),
+            'lat': float(lat),
+            'lng': float(lng),
+        } for station_id, station_name, lat, lng in self.stations if lat is not None and lng is not None]
+        return GraphSnapshot(0, graph, route_info, routes_per_station, stations, [],
+                             [station_name for _, station_name, _, _ in self.stations])
+
+
+def read_network_files(stations_path, routes_path, name="routes.txt"):
+    """Reads the stations.txt/routes.txt CSV pair shipped with the repo."""
+    with open(stations_path, newline="", encoding="utf-8") as f:
+        stations = [(int(row['station_id']), row['station_name'],
+                     float(row['lat']) if row['lat'] else None,
+                     float(row['lng']) if row['lng'] else None)
+                    for row in csv.DictReader(f)]
+    with open(routes_path, newline="", encoding="utf-8") as f:
+        routes = [(row['route_id'], int(row['from_station_id']), int(row['to_station_id']),
+                   float(row['distance_kms']))
+                  for row in csv.DictReader(f)]
+    return Network(name, stations, routes)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def measure(func, args_list, warmup=True):
+    """
+    Times func(*args) for every args tuple. Returns the latency summary
+    (milliseconds) and the return values, in order.
+    """
+    if warmup and args_list:
+        func(*args_list[0])
+    timings = []
+    results = []
+    for args in args_list:
+        started = time.perf_counter()
+        results.append(func(*args))
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'calls': len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p99_ms': percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings) if timings else float("nan"),
+    }, results
+
+
+def peak_allocations(func, args_list):
+    """Mean peak traced memory (KB) of one func(*args) call over a few calls."""
+    samples = args_list[:ALLOC_SAMPLES]
+    if not samples:
+        return float("nan")
+    peaks = []
+    tracemalloc.start()
+    try:
+        for args in samples:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024
+
+
+def run_case(results, network, case, func, args_list):
+    summary, values = measure(func, args_list)
+    summary['alloc_kb'] = peak_allocations(func, args_list)
+    results[f"{network}/{case}"] = summary
+    return values
+
+
+def od_pairs(names, count, seed):
+    rng = random.Random(seed)
+    return [tuple(rng.sample(names, 2)) for _ in range(count)] if len(names) >= 2 else []
+
+
+def queries_for(num_stations, queries):
+    # Keep the slow reference dijkstra() affordable on the big networks
+    return min(queries, max(10, 500_000 // max(1, num_stations)))
+
+
+def run_network(network, queries=100, seed=0, contraction_max_stations=CONTRACTION_MAX_STATIONS):
+    """Benchmarks graph building and routing on one in-memory network."""
+    results = {}
+    name = network.name
+    station_names = [station_name for _, station_name, _, _ in network.stations]
+    route_rows = network.route_rows()
+
+    run_case(results, name, "graph_from_rows", graph_from_rows,
+             [(station_names, route_rows)] * BUILD_REPEATS)
+    snapshot = network.snapshot()
+    graph, route_info = snapshot.graph, snapshot.route_info
+    run_case(results, name, "compact_graph", CompactGraph,
+             [(graph, route_info, snapshot.coords)] * BUILD_REPEATS)
+
+    connected = [station for station, neighbors in graph.items() if neighbors]
+    pairs = od_pairs(connected, queries_for(len(graph), queries), seed)
+
+    run_case(results, name, "dijkstra", dijkstra,
+             [(graph, route_info, s, t) for s, t in pairs])
+
+    counts = []
+
+    def search(s, t):
+        stats = {}
+        cost, path = snapshot.search(s, t, stats=stats)
+        counts.append(stats)
+        return path
+
+    paths = run_case(results, name, "search", search, pairs)
+    add_counts(results[f"{name}/search"], counts, len(pairs))
+
+    run_case(results, name, "analyze_route_path", analyze_route_path,
+             [(path,) for path in paths if path])
+
+    timetable = snapshot.timetable
+    run_case(results, name, "raptor", raptor,
+             [(timetable, {s: 0}, {t: 0}, RAPTOR_DEPARTURE) for s, t in pairs])
+
+    if len(graph) <= contraction_max_stations:
+        compact = snapshot.compact
+        # Built once (plus once traced), not BUILD_REPEATS times
+        summary, (hierarchy,) = measure(build_contraction_hierarchy, [(compact,)], warmup=False)
+        summary['alloc_kb'] = peak_allocations(build_contraction_hierarchy, [(compact,)])
+        results[f"{name}/contraction_build"] = summary
+
+        counts = []
+
+        def contraction_search(s, t):
+            stats = {}
+            cost, path = hierarchy.search(compact, s, t, stats=stats)
+            counts.append(stats)
+            return path
+
+        run_case(results, name, "contraction", contraction_search, pairs)
+        add_counts(results[f"{name}/contraction"], counts, len(pairs))
+    return results
+
+
+def add_counts(summary, stats_list, calls):
+    """
+    Adds the mean COUNT_METRICS of the timed calls to a case's summary.
+    stats_list holds one stats dict per call: the warmup, the timed calls,
+    then the traced ones.
+    """
+    timed = stats_list[1:1 + calls]
+    for metric in COUNT_METRICS:
+        summary[metric] = sum(stats.get(metric, 0) for stats in timed) / len(timed) if timed else 0
+
+
+def run_database(queries=100, seed=0):
+    """
+    Benchmarks transit_map() and the find_route view against the loaded
+    database. Returns {} when there are no stations to route between.
+    """
+    from django.test import Client
+    from django.test.utils import override_settings
+    from django.urls import reverse
+
+    from routefinder.models import Station
+    from transit import get_snapshot, transit_map
+
+    if not Station.objects.exists():
+        return {}
+
+    results = {}
+    run_case(results, "db", "transit_map", transit_map, [()] * BUILD_REPEATS)
+
+    snapshot = get_snapshot()
+    names = [s['station_name'] for s in snapshot.stations
+             if snapshot.graph.get(s['normalized_name'])]
+    pairs = od_pairs(names, queries_for(len(names), queries), seed)
+    client = Client()
+    url = reverse('find_route')
+
+    def find_route(from_station, to_station):
+        # secure=True: SECURE_SSL_REDIRECT would answer plain requests with a 301
+        response = client.post(url, {'fromStation': from_station, 'toStation': to_station}, secure=True)
+        if response.status_code != 200:
+            raise RuntimeError(f"find_route answered {response.status_code} for "
+                               f"{from_station!r} -> {to_station!r}")
+        return response
+
+    # The client sends Host: testserver, which production ALLOWED_HOSTS
+    # would refuse with a 400. Benchmark queries are not real demand, so
+    # they are kept out of RoutePopularity.
+    with override_settings(RATELIMIT_ENABLE=False, ALLOWED_HOSTS=["testserver"]), \
+            route_cache.popularity_paused():
+        run_case(results, "db", "find_route", find_route, pairs)
+    return results
+
+
+def environment():
+    return {
+        'machine': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def counts_only(results):
+    """The COUNT_METRICS of each case that has any."""
+    counts = {}
+    for key, summary in results.items():
+        case_counts = {metric: summary[metric] for metric in COUNT_METRICS if metric in summary}
+        if case_counts:
+            counts[key] = case_counts
+    return counts
+
+
+def save_baseline(results, params, path=BENCHMARK_BASELINE):
+    """
+    Writes the committed baseline: the counts in results and the run
+    params (seed, query count, ...) they depend on.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'params': params, 'results': counts_only(results)}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def save_timings(results, path=BENCHMARK_TIMINGS):
+    """Writes this machine's baseline: results without the counts, which the committed one holds."""
+    timings = {key: {metric: value for metric, value in summary.items() if metric not in COUNT_METRICS}
+               for key, summary in results.items()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'environment': environment(), 'results': timings}, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path=BENCHMARK_BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Lists regressions against a saved baseline as human-readable strings.
+    Cases missing from either side are skipped.
+    """
+    regressions = []
+    for key, summary in sorted(results.items()):
+        base = baseline.get('results', {}).get(key)
+        if base is None:
+            continue
+        limits = [('p50_ms', threshold), ('alloc_kb', threshold)]
+        limits += [(metric, COUNT_THRESHOLD) for metric in COUNT_METRICS]
+        for metric, limit in limits:
+            if metric not in summary or metric not in base:
+                continue
+            new, old = summary[metric], base[metric]
+            if not old or new <= old * limit:
+                continue
+            if metric == 'p50_ms' and new - old < MIN_REGRESSION_MS:
+                continue
+            regressions.append(f"{key} {metric}: {old:.3f} -> {new:.3f} ({new / old:.2f}x, limit {limit:.2f}x)")
+    return regressions
@@ -1,2 +1,5 @@
 #!/bin/bash
-python manage.py collectstatic --no-input --settings=manzilproject.settings_production
+set -o errexit
+python manage.py collectstatic --no-input --settings=manzilproject.settings_prod
+# Prebuilt graph for workers to load at startup
+python manage.py build_graph_snapshot --settings=manzilproject.settings_prod
@@ -0,0 +1,333 @@
+"""
+Contraction hierarchy over a CompactGraph's (station, route) states.
+
+The states are linked more sparsely than the CompactGraph does it:
+riding an edge keeps the route, and changing route is an edge of its own
+at the station, costing the transfer penalty (boarding from the start
+state is free). Costs are the same as compact_dijkstra()'s, but lines
+become simple chains, which contract well.
+
+Preprocessing contracts the states one at a time, least important first,
+adding a shortcut u -> w around each contracted state v wherever u -> v -> w
+was the only shortest way between them. A query then only ever climbs the
+hierarchy: a forward search from the source and a backward search from
+the target, each following edges to states contracted later, meet at the
+top.
+"""
+import heapq
+from array import array
+
+import dijkstras
+from dijkstras import PathStep, _require_stations
+from route_table import graph_fingerprint
+
+# A witness search gives up (and a shortcut is added, which is always
+# safe) after settling this many states
+WITNESS_SETTLED_LIMIT = 500
+
+
+def _state_edges(cg):
+    """
+    [{next_state: (cost, -1, edge)}] per state: rides along compact graph
+    edge edge, or boardings and transfers at a station (edge -1).
+    """
+    penalty = dijkstras.TRANSFER_PENALTY
+    out = [{} for _ in range(cg.num_states)]
+    state = 0
+    for u in range(len(cg.station_names)):
+        start = state
+        state += 1
+        while state < cg.num_states and cg.state_station[state] == u:
+            state += 1
+        route_state = {cg.state_route[x]: x for x in range(start + 1, state)}
+        for x in route_state.values():
+            out[start][x] = (0.0, -1, -1)
+            for y in route_state.values():
+                if y != x:
+                    out[x][y] = (penalty, -1, -1)
+        for e in range(cg.edge_offset[u], cg.edge_offset[u + 1]):
+            out[route_state[cg.edge_route[e]]][cg.edge_state[e]] = (cg.edge_distance[e], -1, e)
+    return out
+
+
+def _witness_search(out, source, skip, max_cost, targets):
+    """
+    Costs from source to targets without passing through skip, as far as a
+    search bounded by max_cost and WITNESS_SETTLED_LIMIT gets. {state: cost}.
+    """
+    inf = float("inf")
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    best = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = 0
+    remaining = len(targets)
+    while queue and settled < WITNESS_SETTLED_LIMIT and remaining:
+        cost, x = heappop(queue)
+        if cost > best[x]:
+            continue
+        if cost > max_cost:
+            break
+        settled += 1
+        if x in targets:
+            remaining -= 1
+        for y, edge in out[x].items():
+            new_cost = cost + edge[0]
+            if new_cost < best.get(y, inf) and y != skip:
+                best[y] = new_cost
+                heappush(queue, (new_cost, y))
+    return best
+
+
+class ContractionHierarchy:
+    """
+    Upward edges of a contracted CompactGraph in CSR layout: up_* holds the
+    edges x -> y to states contracted after x (forward search), down_*
+    the edges x -> y stored at y for x contracted after y (backward
+    search). Each edge is a ride along a compact graph edge (edge >= 0), a
+    shortcut through the state mid (mid >= 0), or a boarding or transfer
+    (both -1).
+    """
+
+    def __init__(self, fingerprint, transfer_penalty, num_states, rank, up, down):
+        self.fingerprint = fingerprint
+        self.transfer_penalty = transfer_penalty
+        self.num_states = num_states
+        self.rank = rank
+        self.up_offset, self.up_state, self.up_cost, self.up_mid, self.up_edge = up
+        self.down_offset, self.down_state, self.down_cost, self.down_mid, self.down_edge = down
+
+    def matches(self, compact_graph):
+        """True if this hierarchy was built from compact_graph, at the current transfer penalty."""
+        return (self.transfer_penalty == dijkstras.TRANSFER_PENALTY
+                and self.num_states == compact_graph.num_states
+                and self.fingerprint == graph_fingerprint(compact_graph))
+
+    def _edge(self, x, y):
+        """(mid, edge) of the edge x -> y."""
+        if self.rank[x] < self.rank[y]:
+            for i in range(self.up_offset[x], self.up_offset[x + 1]):
+                if self.up_state[i] == y:
+                    return self.up_mid[i], self.up_edge[i]
+        else:
+            for i in range(self.down_offset[y], self.down_offset[y + 1]):
+                if self.down_state[i] == x:
+                    return self.down_mid[i], self.down_edge[i]
+        raise KeyError((x, y))
+
+    def _unpack(self, states):
+        """Compact graph edges ridden along a path of states, shortcuts expanded."""
+        edges = []
+        stack = [(x, y) for x, y in zip(states[-2::-1], states[:0:-1])]
+        while stack:
+            x, y = stack.pop()
+            mid, edge = self._edge(x, y)
+            if edge >= 0:
+                edges.append(edge)
+            elif mid >= 0:
+                stack.append((mid, y))
+                stack.append((x, mid))
+        return edges
+
+    def search(self, compact_graph, source_node, target_node, stats=None):
+        """
+        Bidirectional upward search. Returns (cost, path_with_routes) like
+        compact_dijkstra(). stats receives the states expanded, stalled and pushed.
+        """
+        cg = compact_graph
+        _require_stations(cg, source_node, target_node)
+        inf = float("inf")
+        source = cg.state_offset[cg.station_index[source_node]]
+        target_station = cg.station_index[target_node]
+        if source_node == target_node:
+            return (0, [PathStep(source_node, None, False)])
+
+        # Both directions: costs, parents, queue, the edges searched, and
+        # the edges from higher states that can stall it
+        forward = ({source: 0.0}, {source: -1}, [(0.0, source)],
+                   self.up_offset, self.up_state, self.up_cost,
+                   self.down_offset, self.down_state, self.down_cost)
+        # Any state of the target station will do
+        first_state = end = cg.state_offset[target_station]
+        while end < cg.num_states and cg.state_station[end] == target_station:
+            end += 1
+        targets = range(first_state, end)
+        backward = ({state: 0.0 for state in targets}, {state: -1 for state in targets},
+                    [(0.0, state) for state in targets],
+                    self.down_offset, self.down_state, self.down_cost,
+                    self.up_offset, self.up_state, self.up_cost)
+        heapq.heapify(backward[2])
+
+        best = inf
+        meeting = -1
+        expanded = 0
+        stalled = 0
+        pushed = 1 + len(targets)
+        while forward[2] or backward[2]:
+            # Both frontiers have passed the best meeting point
+            if min(forward[2][0][0] if forward[2] else inf,
+                   backward[2][0][0] if backward[2] else inf) >= best:
+                break
+            for side, (costs, parents, queue, offset, states, edge_costs,
+                       stall_offset, stall_states, stall_costs) in enumerate((forward, backward)):
+                if not queue:
+                    continue
+                cost, x = heapq.heappop(queue)
+                if cost > costs[x]:
+                    continue
+                other = backward[0] if side == 0 else forward[0]
+                if x in other and cost + other[x] < best:
+                    best = cost + other[x]
+                    meeting = x
+                # Stall-on-demand: x is reached more cheaply through a
+                # higher state, so no shortest path continues from here
+                is_stalled = False
+                for i in range(stall_offset[x], stall_offset[x + 1]):
+                    y = stall_states[i]
+                    if y in costs and costs[y] + stall_costs[i] < cost:
+                        is_stalled = True
+                        break
+                if is_stalled:
+                    stalled += 1
+                    continue
+                expanded += 1
+                for i in range(offset[x], offset[x + 1]):
+                    y = states[i]
+                    new_cost = cost + edge_costs[i]
+                    if new_cost < costs.get(y, inf):
+                        costs[y] = new_cost
+                        parents[y] = x
+                        heapq.heappush(queue, (new_cost, y))
+                        pushed += 1
+
+        if stats is not None:
+            stats['expanded'] = expanded
+            stats['stalled'] = stalled
+            stats['pushed'] = pushed
+            stats['heap_max'] = max(len(forward[2]), len(backward[2]))
+        if meeting < 0:
+            return (inf, [])
+
+        # States source .. meeting .. target, then the compact edges between them
+        states = []
+        x = meeting
+        while x >= 0:
+            states.append(x)
+            x = forward[1][x]
+        states.reverse()
+        x = backward[1][meeting]
+        while x >= 0:
+            states.append(x)
+            x = backward[1][x]
+
+        steps = [PathStep(source_node, None, False)]
+        state = source
+        for e in self._unpack(states):
+            prev_route = cg.state_route[state]
+            is_transfer = prev_route >= 0 and prev_route != cg.edge_route[e]
+            steps.append(PathStep(
+                cg.station_names[cg.state_station[cg.edge_state[e]]],
+                cg.route_ids[cg.edge_route[e]],
+                is_transfer,
+                cg.edge_distance[e],
+                dijkstras.TRANSFER_PENALTY if is_transfer else 0
+            ))
+            state = cg.edge_state[e]
+        return (best, steps)
+
+
+def build_contraction_hierarchy(compact_graph, stats=None):
+    """
+    Contracts every state of compact_graph, ordered lazily by edge
+    difference (shortcuts added minus edges removed, doubled) plus the
+    number of neighbours already contracted and the depth of the hierarchy
+    below the state. stats receives the shortcuts added. Superlinear: about
+    0.16s on routes.txt, 21s at 1,000 synthetic stops and 96s at 2,000.
+    """
+    cg = compact_graph
+    n = cg.num_states
+    out = _state_edges(cg)
+    # out[x][y] = (cost, mid, edge), mid >= 0 for shortcuts; ins mirrors
+    # out for walking edges backwards.
+    # Contracted states are removed from both as they go.
+    ins = [set() for _ in range(n)]
+    for x, edges in enumerate(out):
+        for y in edges:
+            ins[y].add(x)
+
+    deleted_neighbors = [0] * n
+    level = [0] * n
+    rank = array('l', [0]) * n
+    up = [[] for _ in range(n)]
+    down = [[] for _ in range(n)]
+
+    def shortcuts_for(v):
+        """Shortcuts (u, w, cost) needed if v were contracted now."""
+        shortcuts = []
+        outgoing = [(w, edge[0]) for w, edge in out[v].items()]
+        if not outgoing:
+            return shortcuts
+        max_out = max(cost for _, cost in outgoing)
+        for u in ins[v]:
+            to_v = out[u][v][0]
+            targets = {w for w, _ in outgoing if w != u}
+            if not targets:
+                continue
+            witness = _witness_search(out, u, v, to_v + max_out, targets)
+            for w, cost in outgoing:
+                if w != u and witness.get(w, float("inf")) > to_v + cost:
+                    shortcuts.append((u, w, to_v + cost))
+        return shortcuts
+
+    def priority(v, shortcuts):
+        return 2 * (len(shortcuts) - len(out[v]) - len(ins[v])) + deleted_neighbors[v] + level[v]
+
+    queue = [(priority(v, shortcuts_for(v)), v) for v in range(n)]
+    heapq.heapify(queue)
+    added = 0
+    order = 0
+    while queue:
+        _, v = heapq.heappop(queue)
+        shortcuts = shortcuts_for(v)
+        current = priority(v, shortcuts)
+        # Lazy update: contract v only if it is still the least important
+        if queue and current > queue[0][0]:
+            heapq.heappush(queue, (current, v))
+            continue
+
+        for u, w, cost in shortcuts:
+            edge = out[u].get(w)
+            if edge is None or cost < edge[0]:
+                out[u][w] = (cost, v, -1)
+                ins[w].add(u)
+                added += 1
+
+        rank[v] = order
+        order += 1
+        for w, edge in out[v].items():
+            up[v].append((w, edge))
+            ins[w].discard(v)
+            deleted_neighbors[w] += 1
+            level[w] = max(level[w], level[v] + 1)
+        for u in ins[v]:
+            down[v].append((u, out[u].pop(v)))
+            deleted_neighbors[u] += 1
+            level[u] = max(level[u], level[v] + 1)
+        out[v] = {}
+        ins[v] = set()
+
+    def pack(lists):
+        offset, states, costs, mids, edges = array('l', [0]), array('l'), array('d'), array('l'), array('l')
+        for entries in lists:
+            for state, (cost, mid, edge) in entries:
+                states.append(state)
+                costs.append(cost)
+                mids.append(mid)
+                edges.append(edge)
+            offset.append(len(states))
+        return offset, states, costs, mids, edges
+
+    if stats is not None:
+        stats['shortcuts'] = added
+    return ContractionHierarchy(graph_fingerprint(cg), dijkstras.TRANSFER_PENALTY, n, rank,
+                                pack(up), pack(down))
@@ -1,8 +1,42 @@
 import heapq
+import math
+import time
+from array import array
+from collections import namedtuple
+
+from spatial import EARTH_RADIUS_KM, haversine
 
 #transfer penalty in kilometers(equivalent to 5-10 minutes of travel time)
 TRANSFER_PENALTY = 5.0
 
+# One step of path_with_routes. The first step has route None and no distance.
+PathStep = namedtuple(
+    'PathStep',
+    ['station', 'route', 'is_transfer', 'distance_from_prev', 'transfer_penalty'],
+    defaults=(0, 0)
+)
+
+
+def build_path(parent, target_state):
+    """
+    Rebuilds path_with_routes from predecessor pointers.
+    parent maps (station, route) -> ((prev_station, prev_route), distance),
+    with the source state mapped to None.
+    """
+    steps = []
+    state = target_state
+    while parent[state] is not None:
+        prev_state, distance = parent[state]
+        station, route = state
+        is_transfer = prev_state[1] is not None and prev_state[1] != route
+        steps.append(PathStep(station, route, is_transfer, distance,
+                              TRANSFER_PENALTY if is_transfer else 0))
+        state = prev_state
+    steps.append(PathStep(state[0], None, False))
+    steps.reverse()
+    return steps
+
+
 def dijkstra(transit_map, route_info, source_node, target_node, debug=False):
     
     if source_node not in transit_map:
@@ -21,19 +55,23 @@ def dijkstra(transit_map, route_info, source_node, target_node, debug=False):
         print(f"Target: '{target_node}'")
         print(f"Transfer penalty: {TRANSFER_PENALTY} km")
     
-    # Priority queue: (cost, counter, node, path, current_route)
+    # Priority queue: (cost, counter, node, current_route, prev_state, distance)
+    # Entries carry a pointer to the state they came from instead of a copy
+    # of the whole path; the path is rebuilt once the target is popped.
     # Start with NO route (none) so we can pick the best first route
-    queue = [(0, 0, source_node, [{'station': source_node, 'route': None, 'is_transfer': False}], None)]
+    queue = [(0, 0, source_node, None, None, 0)]
     
     # Track best cost to reach each (station, route) pair
     # Key: (station, route), Value: cost
     seen = {}
+    # Key: (station, route), Value: (previous state, edge distance) of the settled entry
+    parent = {}
     iterations = 0
     counter = 1  # Unique counter for tiebreaking
     
     while queue:
         iterations += 1
-        (cost, _, node, path, current_route) = heapq.heappop(queue)
+        (cost, _, node, current_route, prev_state, prev_distance) = heapq.heappop(queue)
         
         if debug and iterations <= 15:
             print(f"Iteration {iterations}: Processing '{node}' | Cost: {cost:.2f} | Route: {current_route}")
@@ -46,16 +84,18 @@ def dijkstra(transit_map, route_info, source_node, target_node, debug=False):
             continue
             
         seen[state] = cost
+        parent[state] = (prev_state, prev_distance) if prev_state is not None else None
         
         # Check if we've reached the target
         if node == target_node:
+            path = build_path(parent, state)
             if debug:
                 print(f"\n=== PATH FOUND ===")
                 print(f"Total cost: {cost:.2f} km")
                 print(f"Path length: {len(path)} stations")
                 
                 # Count transfers
-                transfers = sum(1 for p in path if p.get('is_transfer', False))
+                transfers = sum(1 for p in path if p.is_transfer)
                 print(f"Number of transfers: {transfers}")
             return (cost, path)
         
@@ -84,22 +124,12 @@ def dijkstra(transit_map, route_info, source_node, target_node, debug=False):
                     if debug and iterations <= 15:
                         print(f"  → Transfer at '{node}': {current_route} → {next_route} (penalty: +{TRANSFER_PENALTY} km)")
                 
-                # Create new path entry
-                new_path_entry = {
-                    'station': neighbor,
-                    'route': next_route,
-                    'is_transfer': is_transfer,
-                    'distance_from_prev': distance,  # Store actual distance, not penalized
-                    'transfer_penalty': TRANSFER_PENALTY if is_transfer else 0
-                }
-                
-                new_path = path + [new_path_entry]
                 new_cost = cost + edge_cost
                 
                 # Check if this path to (neighbor, next_route) is better
                 next_state = (neighbor, next_route)
                 if next_state not in seen or seen[next_state] > new_cost:
-                    heapq.heappush(queue, (new_cost, counter, neighbor, new_path, next_route))
+                    heapq.heappush(queue, (new_cost, counter, neighbor, next_route, state, distance))
                     counter += 1
     
     if debug:
@@ -109,6 +139,718 @@ def dijkstra(transit_map, route_info, source_node, target_node, debug=False):
     return (float("inf"), [])
 
 
+class CompactGraph:
+    """
+    Integer-indexed copy of transit_map/route_info for fast searching.
+
+    Stations and route ids are interned to small ints. Every (station, route)
+    search state gets its own int too: state_offset[u] is the "no route yet"
+    start state of station u, followed by one state per route serving u.
+    Adjacency is CSR-style - the edges of station u are
+    edge_offset[u]:edge_offset[u + 1] - with one entry per (neighbor, route)
+    pair, already pointing at the neighbor's state for that route.
+
+    coords (normalized name -> {'lat', 'lng'}) is optional and only feeds
+    the A* heuristic; stations without coordinates get NaN.
+    """
+
+    __slots__ = (
+        'station_names', 'station_index', 'route_ids', 'route_index',
+        'state_offset', 'state_station', 'state_route',
+        'edge_offset', 'edge_state', 'edge_distance', 'edge_route',
+        'station_lat', 'station_lng', 'heuristic_scale',
+    )
+
+    def __init__(self, transit_map, route_info, coords=None):
+        self.station_names = list(transit_map)
+        self.station_index = {name: i for i, name in enumerate(self.station_names)}
+        self.route_ids = sorted({
+            route_id
+            for neighbors in route_info.values()
+            for routes in neighbors.values()
+            for route_id in routes
+        })
+        self.route_index = {route_id: i for i, route_id in enumerate(self.route_ids)}
+
+        # Collect (neighbor, distance, route) edges and the routes serving each station
+        adjacency = []
+        station_routes = [set() for _ in self.station_names]
+        for name in self.station_names:
+            edges = []
+            for neighbor, distance in transit_map[name].items():
+                v = self.station_index[neighbor]
+                for route_id in route_info.get(name, {}).get(neighbor, []):
+                    r = self.route_index[route_id]
+                    edges.append((v, distance, r))
+                    station_routes[v].add(r)
+            adjacency.append(edges)
+
+        # Lay out the states: [start, route_a, route_b, ...] per station
+        self.state_offset = array('l')
+        self.state_station = array('l')
+        self.state_route = array('l')
+        route_state = []
+        for u, routes in enumerate(station_routes):
+            self.state_offset.append(len(self.state_station))
+            self.state_station.append(u)
+            self.state_route.append(-1)
+            lookup = {}
+            for r in sorted(routes):
+                lookup[r] = len(self.state_station)
+                self.state_station.append(u)
+                self.state_route.append(r)
+            route_state.append(lookup)
+
+        self.edge_offset = array('l', [0])
+        self.edge_state = array('l')
+        self.edge_distance = array('d')
+        self.edge_route = array('l')
+        for edges in adjacency:
+            for v, distance, r in edges:
+                self.edge_state.append(route_state[v][r])
+                self.edge_distance.append(distance)
+                self.edge_route.append(r)
+            self.edge_offset.append(len(self.edge_state))
+
+        coords = coords or {}
+        self.station_lat = array('d')
+        self.station_lng = array('d')
+        for name in self.station_names:
+            point = coords.get(name)
+            self.station_lat.append(point['lat'] if point else math.nan)
+            self.station_lng.append(point['lng'] if point else math.nan)
+        self.heuristic_scale = self._heuristic_scale()
+
+    def _heuristic_scale(self):
+        """
+        Largest k such that k * great-circle distance never exceeds an edge's
+        distance_kms. Scaling the A* heuristic by k keeps it admissible and
+        consistent even if some recorded distances are shorter than the
+        straight line between their stations.
+
+        0 (no usable bound) if any station on an edge has no coordinates:
+        a path through it can be far shorter than the straight line between
+        the located stations at its ends, and no edge bounds by how much.
+        """
+        scale = 1.0
+        for u in range(len(self.station_names)):
+            for e in range(self.edge_offset[u], self.edge_offset[u + 1]):
+                v = self.state_station[self.edge_state[e]]
+                straight = haversine(self.station_lat[u], self.station_lng[u],
+                                     self.station_lat[v], self.station_lng[v])
+                if math.isnan(straight):
+                    return 0.0
+                if straight > 0:
+                    scale = min(scale, self.edge_distance[e] / straight)
+        return max(scale, 0.0)
+
+    @property
+    def num_states(self):
+        return len(self.state_station)
+
+    def __contains__(self, station_name):
+        return station_name in self.station_index
+
+
+def _require_stations(cg, source_node, target_node):
+    if source_node not in cg.station_index:
+        available_stations = cg.station_names[:10]
+        raise ValueError(f"Source station '{source_node}' not found in graph. "
+                        f"Available stations include: {available_stations}")
+
+    if target_node not in cg.station_index:
+        available_stations = cg.station_names[:10]
+        raise ValueError(f"Target station '{target_node}' not found in graph. "
+                        f"Available stations include: {available_stations}")
+
+
+def _compact_path(cg, parent_state, parent_edge, found, base=0):
+    """
+    Walks CompactGraph parent pointers back from state found to the source.
+    base offsets into parent tables that hold several searches back to back.
+    """
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_route = cg.edge_route
+    steps = []
+    state = found
+    while parent_state[base + state] >= 0:
+        e = parent_edge[base + state]
+        prev = parent_state[base + state]
+        prev_route = state_route[prev]
+        is_transfer = prev_route >= 0 and prev_route != edge_route[e]
+        steps.append(PathStep(
+            cg.station_names[state_station[state]],
+            cg.route_ids[edge_route[e]],
+            is_transfer,
+            cg.edge_distance[e],
+            TRANSFER_PENALTY if is_transfer else 0
+        ))
+        state = prev
+    steps.append(PathStep(cg.station_names[state_station[state]], None, False))
+    steps.reverse()
+    return steps
+
+
+def compact_dijkstra(compact_graph, source_node, target_node, debug=False, stats=None):
+    """
+    Same search as dijkstra() over a CompactGraph, using flat per-state
+    cost/visited/parent tables instead of hashing (station, route) tuples.
+    Returns (cost, path_with_routes) in the same shape as dijkstra().
+    Pass a dict as stats to receive the number of states expanded/pushed
+    and the largest the heap got.
+    """
+    cg = compact_graph
+    _require_stations(cg, source_node, target_node)
+
+    target = cg.station_index[target_node]
+    start = cg.state_offset[cg.station_index[source_node]]
+
+    num_states = cg.num_states
+    best = [float("inf")] * num_states
+    visited = bytearray(num_states)
+    parent_state = [-1] * num_states
+    parent_edge = [-1] * num_states
+
+    # Local aliases keep attribute lookups out of the inner loop
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_offset = cg.edge_offset
+    edge_state = cg.edge_state
+    edge_distance = cg.edge_distance
+    edge_route = cg.edge_route
+    penalty = TRANSFER_PENALTY
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    # (cost, counter, state) - the counter keeps dijkstra()'s FIFO tie-breaking
+    best[start] = 0
+    queue = [(0, 0, start)]
+    expanded = 0
+    heap_max = len(queue)
+    pushed = 1
+    found = -1
+
+    while queue:
+        cost, _, state = heappop(queue)
+        if visited[state]:
+            continue
+        visited[state] = 1
+        expanded += 1
+
+        node = state_station[state]
+        if node == target:
+            found = state
+            break
+
+        current_route = state_route[state]
+        for e in range(edge_offset[node], edge_offset[node + 1]):
+            next_state = edge_state[e]
+            if visited[next_state]:
+                continue
+            edge_cost = edge_distance[e]
+            if current_route >= 0 and edge_route[e] != current_route:
+                edge_cost += penalty
+            new_cost = cost + edge_cost
+            if new_cost < best[next_state]:
+                best[next_state] = new_cost
+                parent_state[next_state] = state
+                parent_edge[next_state] = e
+                heappush(queue, (new_cost, pushed, next_state))
+                pushed += 1
+
+        if len(queue) > heap_max:
+            heap_max = len(queue)
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = pushed
+        stats['heap_max'] = heap_max
+
+    if found < 0:
+        if debug:
+            print(f"No path found after expanding {expanded} states")
+        return (float("inf"), [])
+
+    steps = _compact_path(cg, parent_state, parent_edge, found)
+
+    if debug:
+        print(f"Path found: cost {best[found]:.2f} km, {len(steps)} stations, "
+              f"{expanded} states expanded")
+
+    return (best[found], steps)
+
+
+
+def shortest_path_tree(compact_graph, source_node, max_cost=None, toward=None, deadline=None):
+    """
+    Runs compact_dijkstra() from source_node without a target and keeps the
+    whole search tree. Returns (station_state, cost, parent_state, parent_edge):
+    station_state[v] is the first state of station v to be settled (-1 if
+    unreachable) - the same state compact_dijkstra() would stop at - and
+    cost[v] its cost. Feed them to _compact_path() to rebuild any path.
+
+    Partial trees, where stations not reached count as unreachable:
+    max_cost stops the search at that cost, and with toward (a station
+    name) also skips stations that cannot lie on a trip to it within
+    max_cost, going by the A* bound. deadline (a time.perf_counter()
+    value) stops the search when it passes.
+    """
+    cg = compact_graph
+    _require_stations(cg, source_node, source_node)
+
+    num_states = cg.num_states
+    num_stations = len(cg.station_names)
+    best = [float("inf")] * num_states
+    visited = bytearray(num_states)
+    parent_state = array('l', [-1]) * num_states
+    parent_edge = array('l', [-1]) * num_states
+    station_state = array('l', [-1]) * num_stations
+    station_cost = array('d', [float("inf")]) * num_stations
+
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_offset = cg.edge_offset
+    edge_state = cg.edge_state
+    edge_distance = cg.edge_distance
+    edge_route = cg.edge_route
+    penalty = TRANSFER_PENALTY
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    # Lower bound (km) from each station to toward, filled in lazily
+    estimate = None
+    if max_cost is not None and toward is not None and cg.heuristic_scale > 0:
+        _require_stations(cg, toward, toward)
+        toward_index = cg.station_index[toward]
+        toward_lat = math.radians(cg.station_lat[toward_index])
+        toward_lng = math.radians(cg.station_lng[toward_index])
+        if not math.isnan(toward_lat):
+            estimate = [-1.0] * num_stations
+            cos_toward_lat = math.cos(toward_lat)
+            scale = cg.heuristic_scale * EARTH_RADIUS_KM * 2
+            station_lat = cg.station_lat
+            station_lng = cg.station_lng
+
+    start = cg.state_offset[cg.station_index[source_node]]
+    best[start] = 0
+    queue = [(0, 0, start)]
+    pushed = 1
+    popped = 0
+
+    while queue:
+        cost, _, state = heappop(queue)
+        if visited[state]:
+            continue
+        if max_cost is not None and cost > max_cost:
+            break
+        popped += 1
+        if deadline is not None and popped % 256 == 0 and time.perf_counter() > deadline:
+            break
+        visited[state] = 1
+
+        node = state_station[state]
+        if station_state[node] < 0:
+            station_state[node] = state
+            station_cost[node] = cost
+
+        current_route = state_route[state]
+        for e in range(edge_offset[node], edge_offset[node + 1]):
+            next_state = edge_state[e]
+            if visited[next_state]:
+                continue
+            edge_cost = edge_distance[e]
+            if current_route >= 0 and edge_route[e] != current_route:
+                edge_cost += penalty
+            new_cost = cost + edge_cost
+            if new_cost < best[next_state]:
+                if estimate is not None:
+                    v = state_station[next_state]
+                    h = estimate[v]
+                    if h < 0:
+                        h = 0.0
+                        lat = station_lat[v]
+                        if not math.isnan(lat):
+                            lat = math.radians(lat)
+                            a = (math.sin((lat - toward_lat) / 2) ** 2
+                                 + math.cos(lat) * cos_toward_lat
+                                 * math.sin((math.radians(station_lng[v]) - toward_lng) / 2) ** 2)
+                            h = scale * math.asin(math.sqrt(a))
+                        estimate[v] = h
+                    if new_cost + h > max_cost:
+                        continue
+                best[next_state] = new_cost
+                parent_state[next_state] = state
+                parent_edge[next_state] = e
+                heappush(queue, (new_cost, pushed, next_state))
+                pushed += 1
+
+    return station_state, station_cost, parent_state, parent_edge
+
+
+def multi_source_search(compact_graph, sources, targets, stats=None):
+    """
+    One search from several origin stations to any of several destination
+    stations. sources/targets map normalized station names to the cost of
+    getting to/from them (e.g. weighted walking distance). Every source is
+    seeded at its cost, and the answer minimizes
+    source cost + transit cost + target cost.
+
+    Returns (total_cost, path_with_routes, source_node, target_node), with
+    (inf, [], None, None) if no target is reachable.
+    """
+    cg = compact_graph
+    for name in list(sources) + list(targets):
+        _require_stations(cg, name, name)
+
+    num_states = cg.num_states
+    best = [float("inf")] * num_states
+    visited = bytearray(num_states)
+    parent_state = [-1] * num_states
+    parent_edge = [-1] * num_states
+    exit_cost = {cg.station_index[name]: cost for name, cost in targets.items()}
+
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_offset = cg.edge_offset
+    edge_state = cg.edge_state
+    edge_distance = cg.edge_distance
+    edge_route = cg.edge_route
+    penalty = TRANSFER_PENALTY
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    queue = []
+    pushed = 0
+    for name, cost in sources.items():
+        start = cg.state_offset[cg.station_index[name]]
+        if cost < best[start]:
+            best[start] = cost
+            queue.append((cost, pushed, start))
+            pushed += 1
+    heapq.heapify(queue)
+
+    expanded = 0
+    heap_max = len(queue)
+    found = -1
+    found_total = float("inf")
+
+    while queue:
+        cost, _, state = heappop(queue)
+        # Exit costs are never negative, so nothing left can beat found_total
+        if cost >= found_total:
+            break
+        if visited[state]:
+            continue
+        visited[state] = 1
+        expanded += 1
+
+        node = state_station[state]
+        if node in exit_cost and cost + exit_cost[node] < found_total:
+            found = state
+            found_total = cost + exit_cost[node]
+
+        current_route = state_route[state]
+        for e in range(edge_offset[node], edge_offset[node + 1]):
+            next_state = edge_state[e]
+            if visited[next_state]:
+                continue
+            edge_cost = edge_distance[e]
+            if current_route >= 0 and edge_route[e] != current_route:
+                edge_cost += penalty
+            new_cost = cost + edge_cost
+            if new_cost < best[next_state]:
+                best[next_state] = new_cost
+                parent_state[next_state] = state
+                parent_edge[next_state] = e
+                heappush(queue, (new_cost, pushed, next_state))
+                pushed += 1
+
+        if len(queue) > heap_max:
+            heap_max = len(queue)
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = pushed
+        stats['heap_max'] = heap_max
+
+    if found < 0:
+        return (float("inf"), [], None, None)
+
+    path = _compact_path(cg, parent_state, parent_edge, found)
+    return (found_total, path, path[0].station, path[-1].station)
+
+
+def astar(compact_graph, source_node, target_node, debug=False, stats=None):
+    """
+    A* over a CompactGraph using great-circle distance to the target
+    (times cg.heuristic_scale) as a lower bound on the remaining kilometres.
+    Returns the same (cost, path_with_routes) as compact_dijkstra(). If a
+    routed station has no coordinates cg.heuristic_scale is 0, and this is
+    Dijkstra with extra bookkeeping.
+    Pass a dict as stats to receive the number of states expanded/pushed
+    and the largest the heap got.
+    """
+    cg = compact_graph
+    _require_stations(cg, source_node, target_node)
+
+    target = cg.station_index[target_node]
+    start = cg.state_offset[cg.station_index[source_node]]
+
+    # Heuristic in km per station, filled in lazily (-1 = not computed yet)
+    scale = cg.heuristic_scale * EARTH_RADIUS_KM * 2
+    station_lat = cg.station_lat
+    station_lng = cg.station_lng
+    target_lat = math.radians(station_lat[target])
+    target_lng = math.radians(station_lng[target])
+    cos_target_lat = math.cos(target_lat)
+    use_heuristic = scale > 0 and not math.isnan(target_lat)
+    estimate = [-1.0] * len(cg.station_names)
+
+    num_states = cg.num_states
+    best = [float("inf")] * num_states
+    parent_state = [-1] * num_states
+    parent_edge = [-1] * num_states
+
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_offset = cg.edge_offset
+    edge_state = cg.edge_state
+    edge_distance = cg.edge_distance
+    edge_route = cg.edge_route
+    penalty = TRANSFER_PENALTY
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    sin = math.sin
+    cos = math.cos
+    asin = math.asin
+    sqrt = math.sqrt
+    radians = math.radians
+    isnan = math.isnan
+
+    # (cost + estimate, counter, cost, state). A state is expanded again if
+    # it is reached more cheaply later.
+    best[start] = 0
+    queue = [(0, 0, 0, start)]
+    expanded = 0
+    heap_max = len(queue)
+    pushed = 1
+    found = -1
+
+    while queue:
+        _, _, cost, state = heappop(queue)
+        if cost > best[state]:
+            continue
+        expanded += 1
+
+        node = state_station[state]
+        if node == target:
+            found = state
+            break
+
+        current_route = state_route[state]
+        for e in range(edge_offset[node], edge_offset[node + 1]):
+            next_state = edge_state[e]
+            edge_cost = edge_distance[e]
+            if current_route >= 0 and edge_route[e] != current_route:
+                edge_cost += penalty
+            new_cost = cost + edge_cost
+            if new_cost < best[next_state]:
+                best[next_state] = new_cost
+                parent_state[next_state] = state
+                parent_edge[next_state] = e
+
+                v = state_station[next_state]
+                h = estimate[v]
+                if h < 0:
+                    h = 0.0
+                    lat = station_lat[v]
+                    if use_heuristic and not isnan(lat):
+                        lat = radians(lat)
+                        a = (sin((lat - target_lat) / 2) ** 2
+                             + cos(lat) * cos_target_lat
+                             * sin((radians(station_lng[v]) - target_lng) / 2) ** 2)
+                        h = scale * asin(sqrt(a))
+                    estimate[v] = h
+
+                heappush(queue, (new_cost + h, pushed, new_cost, next_state))
+                pushed += 1
+
+        if len(queue) > heap_max:
+            heap_max = len(queue)
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = pushed
+        stats['heap_max'] = heap_max
+
+    if found < 0:
+        if debug:
+            print(f"No path found after expanding {expanded} states")
+        return (float("inf"), [])
+
+    steps = _compact_path(cg, parent_state, parent_edge, found)
+
+    if debug:
+        print(f"Path found: cost {best[found]:.2f} km, {len(steps)} stations, "
+              f"{expanded} states expanded")
+
+    return (best[found], steps)
+
+def pareto_search(compact_graph, source_node, target_node, max_transfers=None, stats=None):
+    """
+    Every trip between two stations that is best on (distance, transfers):
+    no other trip is both no longer and has no more transfers. One
+    label-setting search over the (station, route) states, with labels
+    popped in (distance, transfers) order - so a label survives only if it
+    has fewer transfers than every label already settled at its state, and
+    than every trip already found to the target.
+
+    Returns [(distance_km, transfers, path_with_routes)] by increasing
+    distance (so decreasing transfers), [] if the target is unreachable.
+    The cheapest trip under TRANSFER_PENALTY is always among them.
+    max_transfers drops trips with more transfers than that.
+    """
+    cg = compact_graph
+    _require_stations(cg, source_node, target_node)
+
+    target = cg.station_index[target_node]
+    start = cg.state_offset[cg.station_index[source_node]]
+
+    # Fewest transfers among the labels settled at each state
+    settled = [math.inf] * cg.num_states
+    # A new label must have fewer transfers than this to be worth keeping
+    bound = math.inf if max_transfers is None else max_transfers + 1
+
+    state_station = cg.state_station
+    state_route = cg.state_route
+    edge_offset = cg.edge_offset
+    edge_state = cg.edge_state
+    edge_distance = cg.edge_distance
+    edge_route = cg.edge_route
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    # Labels live in flat lists; the label index doubles as the FIFO tie-breaker
+    label_state = [start]
+    label_parent = [-1]
+    label_edge = [-1]
+    queue = [(0.0, 0, 0)]
+    found = []
+    expanded = 0
+    heap_max = 1
+
+    while queue:
+        distance, transfers, label = heappop(queue)
+        if transfers >= bound:
+            continue
+        state = label_state[label]
+        if transfers >= settled[state]:
+            continue
+        settled[state] = transfers
+        expanded += 1
+
+        node = state_station[state]
+        if node == target:
+            found.append((distance, transfers, label))
+            bound = transfers
+            if transfers == 0:
+                break
+            continue
+
+        current_route = state_route[state]
+        for e in range(edge_offset[node], edge_offset[node + 1]):
+            next_state = edge_state[e]
+            next_transfers = transfers
+            if current_route >= 0 and edge_route[e] != current_route:
+                next_transfers += 1
+            if next_transfers >= settled[next_state] or next_transfers >= bound:
+                continue
+            label_state.append(next_state)
+            label_parent.append(label)
+            label_edge.append(e)
+            heappush(queue, (distance + edge_distance[e], next_transfers, len(label_state) - 1))
+
+        if len(queue) > heap_max:
+            heap_max = len(queue)
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = len(label_state)
+        stats['heap_max'] = heap_max
+
+    results = []
+    for distance, transfers, label in found:
+        steps = []
+        while label_parent[label] >= 0:
+            e = label_edge[label]
+            prev = label_parent[label]
+            prev_route = state_route[label_state[prev]]
+            is_transfer = prev_route >= 0 and prev_route != edge_route[e]
+            steps.append(PathStep(
+                cg.station_names[state_station[label_state[label]]],
+                cg.route_ids[edge_route[e]],
+                is_transfer,
+                edge_distance[e],
+                TRANSFER_PENALTY if is_transfer else 0
+            ))
+            label = prev
+        steps.append(PathStep(source_node, None, False))
+        steps.reverse()
+        results.append((distance, transfers, steps))
+    return results
+
+
+def reverse_path(path_with_routes):
+    """
+    The same trip ridden the other way. Every edge runs both ways, so the
+    reversed path is a cheapest path from target to source at the same cost.
+    """
+    if not path_with_routes:
+        return []
+    steps = [PathStep(path_with_routes[-1].station, None, False)]
+    prev_route = None
+    for i in range(len(path_with_routes) - 1, 0, -1):
+        step = path_with_routes[i]
+        is_transfer = prev_route is not None and prev_route != step.route
+        steps.append(PathStep(
+            path_with_routes[i - 1].station,
+            step.route,
+            is_transfer,
+            step.distance_from_prev,
+            TRANSFER_PENALTY if is_transfer else 0
+        ))
+        prev_route = step.route
+    return steps
+
+
+def join_paths(first, second):
+    """
+    first followed by second, where second starts at the station first ends
+    at. The step onto second's first route becomes a transfer if the route
+    changes there.
+    """
+    if len(first) < 2:
+        return list(second)
+    steps = list(first)
+    last_route = first[-1].route
+    for i, step in enumerate(second[1:]):
+        if i == 0:
+            is_transfer = step.route != last_route
+            step = step._replace(is_transfer=is_transfer,
+                                 transfer_penalty=TRANSFER_PENALTY if is_transfer else 0)
+        steps.append(step)
+    return steps
+
+
+def path_cost(path_with_routes):
+    """
+    Transit cost of a path (distance plus transfer penalties), summed in the
+    same order as the search so it matches the cost the search reported.
+    """
+    return sum(step.distance_from_prev + step.transfer_penalty for step in path_with_routes[1:])
+
+
 def analyze_route_path(path_with_routes):
     """
     Analyzes a path and groups consecutive stations on the same route into segments.
@@ -129,15 +871,15 @@ def analyze_route_path(path_with_routes):
     first_station = path_with_routes[0]
     
     for i, station_info in enumerate(path_with_routes[1:], 1):
-        route_id = station_info['route']
-        station_name = station_info['station']
-        distance = station_info.get('distance_from_prev', 0)
+        route_id = station_info.route
+        station_name = station_info.station
+        distance = station_info.distance_from_prev
         
         if current_segment['route_id'] is None:
             # Start first segment
             current_segment['route_id'] = route_id
-            current_segment['stations'] = [path_with_routes[0]['station']]
-            current_segment['start_station'] = path_with_routes[0]['station']
+            current_segment['stations'] = [first_station.station]
+            current_segment['start_station'] = first_station.station
         
         if route_id == current_segment['route_id']:
             # Continue current segment
@@ -149,9 +891,9 @@ def analyze_route_path(path_with_routes):
             segments.append(current_segment.copy())
             current_segment = {
                 'route_id': route_id,
-                'stations': [path_with_routes[i-1]['station'], station_name],
+                'stations': [path_with_routes[i-1].station, station_name],
                 'distance': distance,
-                'start_station': path_with_routes[i-1]['station'],
+                'start_station': path_with_routes[i-1].station,
                 'end_station': station_name
             }
     
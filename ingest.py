@@ -0,0 +1,281 @@
+import csv
+import math
+from datetime import time
+
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+
+from routefinder.models import LineSchedule, Route, Station
+from transit import bump_graph_version
+
+STATION_COLUMNS = ("station_id", "station_name", "lat", "lng")
+ROUTE_COLUMNS = ("route_id", "from_station_id", "to_station_id", "distance_kms")
+# speed_kmh is optional
+SCHEDULE_COLUMNS = ("route_id", "headway_minutes", "first_departure", "last_departure")
+
+# Rows per INSERT; the backend may lower it (SQLite's variable limit)
+BATCH_SIZE = 5000
+
+# Ids per DELETE ... IN (...), under SQLite's old 999-variable limit
+DELETE_CHUNK = 500
+
+# Errors listed before the rest are just counted
+MAX_REPORTED_ERRORS = 20
+
+
+class NetworkImportError(Exception):
+    """The files did not validate; nothing was written."""
+
+    def __init__(self, errors, total):
+        self.errors = errors
+        self.total = total
+        more = f"\n... and {total - len(errors)} more" if total > len(errors) else ""
+        super().__init__("\n".join(errors) + more)
+
+
+class _Errors:
+    def __init__(self):
+        self.reported = []
+        self.total = 0
+
+    def add(self, path, line, message):
+        self.total += 1
+        if len(self.reported) < MAX_REPORTED_ERRORS:
+            self.reported.append(f"{path}:{line}: {message}")
+
+
+def _rows(path, columns, errors):
+    """Yields (line number, row dict) from a CSV file, checking its header."""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in columns if column not in (reader.fieldnames or ())]
+        if missing:
+            errors.add(path, 1, f"missing column(s) {', '.join(missing)}")
+            return
+        for row in reader:
+            yield reader.line_num, row
+
+
+def _coordinate(value, limit):
+    value = value.strip() if value else ""
+    if not value:
+        return None
+    number = float(value)
+    if not math.isfinite(number) or abs(number) > limit:
+        raise ValueError(value)
+    return number
+
+
+def read_stations(path, errors):
+    """Parses and validates stations.txt into {station_id: Station}."""
+    stations = {}
+    for line, row in _rows(path, STATION_COLUMNS, errors):
+        try:
+            station_id = int(row["station_id"])
+        except (TypeError, ValueError):
+            errors.add(path, line, f"station_id {row['station_id']!r} is not an integer")
+            continue
+        if station_id in stations:
+            errors.add(path, line, f"duplicate station_id {station_id}")
+            continue
+        name = (row["station_name"] or "").strip()
+        if not name:
+            errors.add(path, line, f"station {station_id} has no name")
+            continue
+        try:
+            lat = _coordinate(row["lat"], 90)
+            lng = _coordinate(row["lng"], 180)
+        except ValueError:
+            errors.add(path, line, f"station {station_id} has invalid coordinates {row['lat']!r}, {row['lng']!r}")
+            continue
+        if (lat is None) != (lng is None):
+            errors.add(path, line, f"station {station_id} has only one coordinate")
+            continue
+        # Primary key = station id, as in generated fixtures, so a reload
+        # updates rows in place and routes can point at ids directly
+        stations[station_id] = Station(pk=station_id, station_id=station_id, station_name=name, lat=lat, lng=lng)
+    return stations
+
+
+def read_routes(path, station_ids, errors):
+    """
+    Yields validated Route objects from routes.txt, numbered from 1 in file
+    order. Station references and distances are checked as the file streams.
+    """
+    max_length = Route._meta.get_field("route_id").max_length
+    pk = 0
+    for line, row in _rows(path, ROUTE_COLUMNS, errors):
+        route_id = (row["route_id"] or "").strip()
+        if not route_id or len(route_id) > max_length:
+            errors.add(path, line, f"route_id {route_id!r} must be 1-{max_length} characters")
+            continue
+        try:
+            from_id = int(row["from_station_id"])
+            to_id = int(row["to_station_id"])
+        except (TypeError, ValueError):
+            errors.add(path, line, "station ids must be integers")
+            continue
+        unknown = [station_id for station_id in (from_id, to_id) if station_id not in station_ids]
+        if unknown:
+            errors.add(path, line, f"unknown station id(s) {', '.join(map(str, unknown))}")
+            continue
+        if from_id == to_id:
+            errors.add(path, line, f"route {route_id} loops on station {from_id}")
+            continue
+        try:
+            distance = float(row["distance_kms"])
+        except (TypeError, ValueError):
+            distance = math.nan
+        if not math.isfinite(distance) or distance <= 0:
+            errors.add(path, line, f"distance {row['distance_kms']!r} must be a positive number")
+            continue
+        pk += 1
+        yield Route(pk=pk, route_id=route_id, from_station_id=from_id, to_station_id=to_id, distance_kms=distance)
+
+
+def _clock(value):
+    """'HH:MM' as a datetime.time, or ValueError."""
+    hours, _, minutes = (value or "").strip().partition(":")
+    return time(int(hours), int(minutes))
+
+
+def read_schedules(path, route_ids, errors):
+    """Parses and validates a schedules CSV into LineSchedule objects, one per route id."""
+    schedules = {}
+    for line, row in _rows(path, SCHEDULE_COLUMNS, errors):
+        route_id = (row["route_id"] or "").strip()
+        if route_id not in route_ids:
+            errors.add(path, line, f"unknown route_id {route_id!r}")
+            continue
+        if route_id in schedules:
+            errors.add(path, line, f"duplicate schedule for {route_id}")
+            continue
+        try:
+            headway = float(row["headway_minutes"])
+        except (TypeError, ValueError):
+            headway = math.nan
+        if not math.isfinite(headway) or headway <= 0:
+            errors.add(path, line, f"headway {row['headway_minutes']!r} must be a positive number")
+            continue
+        try:
+            first = _clock(row["first_departure"])
+            last = _clock(row["last_departure"])
+        except ValueError:
+            errors.add(path, line, f"departure times must be HH:MM, not {row['first_departure']!r}, "
+                                   f"{row['last_departure']!r}")
+            continue
+        if last < first:
+            errors.add(path, line, f"last departure {last:%H:%M} is before the first, {first:%H:%M}")
+            continue
+        speed = (row.get("speed_kmh") or "").strip()
+        try:
+            speed = float(speed) if speed else None
+        except ValueError:
+            speed = math.nan
+        if speed is not None and (not math.isfinite(speed) or speed <= 0):
+            errors.add(path, line, f"speed_kmh {row['speed_kmh']!r} must be a positive number")
+            continue
+        schedules[route_id] = LineSchedule(route_id=route_id, headway_minutes=headway, first_departure=first,
+                                           last_departure=last, speed_kmh=speed)
+    return list(schedules.values())
+
+
+def _batches(objects, size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _upsert(model, objects, fields, using):
+    """INSERT ... ON CONFLICT (id) DO UPDATE for a batch of objects with primary keys set."""
+    kwargs = {}
+    if connections[using].features.supports_update_conflicts_with_target:
+        kwargs["unique_fields"] = ["pk"]
+    model.objects.using(using).bulk_create(objects, update_conflicts=True, update_fields=fields, **kwargs)
+
+
+def _delete(model, condition, params, using):
+    """
+    DELETE FROM model WHERE pk <condition>. Raw SQL: the ORM would load
+    every row to send post_delete signals, each bumping the graph version.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} {condition}", params)
+        return cursor.rowcount
+
+
+def import_network(stations_path, routes_path, batch_size=BATCH_SIZE, dry_run=False, schedules_path=None):
+    """
+    Makes the Station/Route tables match the two files, in one transaction:
+    stations are upserted by id, routes replaced row for row, and anything
+    no longer in the files deleted. Re-running with the same files leaves
+    the tables unchanged. Bumps the graph version on success.
+    With schedules_path the LineSchedule table is replaced by that file too.
+
+    Raises NetworkImportError (and writes nothing) if any row is invalid.
+    Returns counts of what was written.
+    """
+    using = router.db_for_write(Station)
+    errors = _Errors()
+    stations = read_stations(stations_path, errors)
+    if errors.total:
+        raise NetworkImportError(errors.reported, errors.total)
+
+    with transaction.atomic(using=using):
+        for batch in _batches(stations.values(), batch_size):
+            _upsert(Station, batch, ["station_id", "station_name", "lat", "lng"], using)
+
+        route_count = 0
+        route_ids = set()
+        for batch in _batches(read_routes(routes_path, stations, errors), batch_size):
+            # Keep streaming to report every bad row, but stop writing
+            if not errors.total:
+                _upsert(Route, batch, ["route_id", "from_station", "to_station", "distance_kms"], using)
+            route_count += len(batch)
+            route_ids.update(route.route_id for route in batch)
+        schedules = read_schedules(schedules_path, route_ids, errors) if schedules_path else None
+        if errors.total:
+            raise NetworkImportError(errors.reported, errors.total)
+
+        routes_deleted = _delete(Route, "> %s", [route_count], using)
+        stale = sorted(set(Station.objects.using(using).values_list("pk", flat=True)) - stations.keys())
+        stations_deleted = 0
+        for start in range(0, len(stale), DELETE_CHUNK):
+            chunk = stale[start:start + DELETE_CHUNK]
+            stations_deleted += _delete(Station, f"IN ({', '.join(['%s'] * len(chunk))})", chunk, using)
+
+        schedules_deleted = 0
+        if schedules is not None:
+            # A handful of rows, so replaced outright
+            schedules_deleted = _delete(LineSchedule, "IS NOT NULL", [], using)
+            LineSchedule.objects.using(using).bulk_create(schedules)
+
+        # Explicit primary keys leave Postgres sequences behind
+        connection = connections[using]
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), [Station, Route])
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+        if dry_run:
+            transaction.set_rollback(True, using=using)
+        else:
+            bump_graph_version()
+
+    return {
+        'stations': len(stations),
+        'routes': route_count,
+        'stations_deleted': stations_deleted,
+        'routes_deleted': routes_deleted,
+        'schedules': len(schedules) if schedules is not None else None,
+        'schedules_deleted': schedules_deleted,
+    }
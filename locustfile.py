@@ -0,0 +1,254 @@
+"""
+Load scenario for Manzil.
+
+    locust -f locustfile.py --host http://127.0.0.1:8000 \
+        --ratelimits respect --results-json results.json
+
+User types (weighted like real traffic):
+  TripPlanner - home page, debounced /stations/ bursts while typing, then
+                find_route POSTs by station name or by coordinates (CSRF)
+  MapViewer   - /map plus the /api/stations/ + /api/routes/ pair it loads
+  ApiClient   - /api/route/, /api/nearest-stations/ and /api/route/batch/
+
+Origin/destination pairs come from the live /api/stations/ table
+(stations.txt if the server has none yet).
+
+--ratelimits respect paces each endpoint to the server's per-IP limits,
+shared by every user in this process, so nothing is rejected.
+--ratelimits bypass sends as fast as the users go; start the server with
+RATELIMIT_ENABLE=false or the 403s show up as failures.
+
+--results-json writes per-endpoint latency percentiles when the test stops,
+for comparing releases. Locust's own --csv output works too.
+"""
+import csv
+import json
+import os
+import random
+import threading
+import time
+
+import gevent
+import requests
+from locust import HttpUser, between, events, task
+from locust.runners import WorkerRunner
+
+# Server-side limits per client IP, as declared on the views
+RATE_LIMITS = {
+    "find_route": 20,
+    "station_search": 120,
+    "api_stations": 60,
+    "api_routes": 60,
+    "api_route": 60,
+    "api_nearest_stations": 30,
+    "api_route_batch": 10,
+}
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Filled in at test start
+STATIONS = []
+
+
+@events.init_command_line_parser.add_listener
+def _(parser):
+    parser.add_argument("--ratelimits", choices=["respect", "bypass"], default="respect",
+                        help="Pace requests to the server's ratelimits or ignore them")
+    parser.add_argument("--results-json", default="", help="Write per-endpoint percentiles here on stop")
+    parser.add_argument("--stations-file", default=os.path.join(os.path.dirname(__file__), "stations.txt"),
+                        help="Fallback station list when /api/stations/ is empty")
+
+
+class Pacer:
+    """Per-endpoint minimum spacing between requests, shared by all users in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, endpoint):
+        per_minute = RATE_LIMITS[endpoint]
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(endpoint, now))
+            self._next[endpoint] = slot + 60.0 / per_minute
+        if slot > now:
+            time.sleep(slot - now)
+
+
+PACER = Pacer()
+
+
+def _load_stations(environment):
+    try:
+        response = requests.get(f"{environment.host}/api/stations/", timeout=30)
+        response.raise_for_status()
+        stations = [
+            {'name': s['station_name'], 'lat': s['lat'], 'lng': s['lng']}
+            for s in response.json()
+        ]
+        if stations:
+            return stations
+    except (requests.RequestException, ValueError, KeyError):
+        pass
+    with open(environment.parsed_options.stations_file, newline="", encoding="utf-8") as f:
+        return [
+            {'name': row['station_name'], 'lat': float(row['lat']), 'lng': float(row['lng'])}
+            for row in csv.DictReader(f) if row['lat'] and row['lng']
+        ]
+
+
+@events.test_start.add_listener
+def _(environment, **kwargs):
+    STATIONS[:] = _load_stations(environment)
+
+
+@events.test_stop.add_listener
+def _(environment, **kwargs):
+    path = environment.parsed_options.results_json
+    # In distributed runs only the master has the aggregated stats
+    if not path or isinstance(environment.runner, WorkerRunner):
+        return
+    endpoints = []
+    for entry in sorted(environment.stats.entries.values(), key=lambda e: (e.name, e.method)):
+        endpoints.append(_summarize(entry))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            'host': environment.host,
+            'ratelimits': environment.parsed_options.ratelimits,
+            'users': environment.runner.user_count if environment.runner else None,
+            'endpoints': endpoints,
+            'total': _summarize(environment.stats.total),
+        }, f, indent=2)
+
+
+def _summarize(entry):
+    summary = {
+        'name': entry.name,
+        'method': entry.method,
+        'requests': entry.num_requests,
+        'failures': entry.num_failures,
+        'rps': round(entry.total_rps, 3),
+        'avg_ms': round(entry.avg_response_time, 2),
+        'max_ms': round(entry.max_response_time or 0, 2),
+    }
+    for p in PERCENTILES:
+        summary[f"p{int(p * 100)}_ms"] = entry.get_response_time_percentile(p) if entry.num_requests else None
+    return summary
+
+
+class ManzilUser(HttpUser):
+    abstract = True
+    host = "http://127.0.0.1:8000"
+
+    def paced(self, endpoint):
+        if self.environment.parsed_options.ratelimits == "respect":
+            PACER.wait(endpoint)
+
+    def station_pair(self):
+        return random.sample(STATIONS, 2)
+
+    @staticmethod
+    def near(station, spread=0.004):
+        # A point a few hundred metres from a station, like a GPS fix
+        return (station['lat'] + random.uniform(-spread, spread),
+                station['lng'] + random.uniform(-spread, spread))
+
+
+class TripPlanner(ManzilUser):
+    weight = 6
+    wait_time = between(3, 10)
+
+    def on_start(self):
+        # The home page sets the csrftoken cookie find_route checks against
+        self.client.get("/", name="/")
+
+    def type_station(self, name):
+        # Debounced autocomplete: one request per pause while typing
+        for length in sorted(random.sample(range(2, len(name) + 1), min(3, len(name) - 1))):
+            self.paced("station_search")
+            self.client.get("/stations/", params={'q': name[:length]}, name="/stations/?q=")
+            time.sleep(random.uniform(0.4, 0.8))
+
+    def post_route(self, data, name):
+        self.paced("find_route")
+        data['csrfmiddlewaretoken'] = self.client.cookies.get("csrftoken", "")
+        with self.client.post("/find_route", data=data, name=name, catch_response=True,
+                              headers={'Referer': f"{self.host}/"}) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+
+    @task(4)
+    def plan_by_station(self):
+        origin, destination = self.station_pair()
+        self.type_station(origin['name'])
+        self.type_station(destination['name'])
+        self.post_route({'fromStation': origin['name'], 'toStation': destination['name']},
+                        "/find_route [station]")
+
+    @task(2)
+    def plan_by_coordinate(self):
+        origin, destination = self.station_pair()
+        from_lat, from_lng = self.near(origin)
+        to_lat, to_lng = self.near(destination)
+        self.post_route({
+            'fromStation': "Current location", 'from_type': "coordinate",
+            'from_lat': f"{from_lat:.6f}", 'from_lng': f"{from_lng:.6f}",
+            'toStation': "Dropped pin", 'to_type': "coordinate",
+            'to_lat': f"{to_lat:.6f}", 'to_lng': f"{to_lng:.6f}",
+        }, "/find_route [coordinate]")
+
+    @task(1)
+    def revisit_home(self):
+        self.client.get("/", name="/")
+
+
+class MapViewer(ManzilUser):
+    weight = 3
+    wait_time = between(5, 20)
+
+    @task
+    def open_map(self):
+        self.client.get("/map", name="/map")
+        # map.html fetches both at once
+        self.paced("api_stations")
+        self.paced("api_routes")
+        greenlets = [
+            gevent.spawn(self.client.get, "/api/stations/", name="/api/stations/"),
+            gevent.spawn(self.client.get, "/api/routes/", name="/api/routes/"),
+        ]
+        gevent.joinall(greenlets)
+
+
+class ApiClient(ManzilUser):
+    weight = 1
+    wait_time = between(1, 5)
+
+    @task(4)
+    def route(self):
+        origin, destination = self.station_pair()
+        self.paced("api_route")
+        self.client.get("/api/route/", params={'from': origin['name'], 'to': destination['name']},
+                        name="/api/route/")
+
+    @task(2)
+    def nearest(self):
+        points = [list(self.near(random.choice(STATIONS), spread=0.01)) for _ in range(random.randint(1, 50))]
+        self.paced("api_nearest_stations")
+        self.client.post("/api/nearest-stations/", json={'points': points, 'k': 3},
+                         name="/api/nearest-stations/")
+
+    @task(1)
+    def batch(self):
+        pairs = [{'from': a['name'], 'to': b['name']}
+                 for a, b in (self.station_pair() for _ in range(random.randint(10, 200)))]
+        self.paced("api_route_batch")
+        # Not streamed, so the recorded time covers the whole NDJSON body
+        with self.client.post("/api/route/batch/", json={'pairs': pairs}, name="/api/route/batch/",
+                              catch_response=True) as response:
+            lines = len(response.text.splitlines())
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+            elif lines != len(pairs) + 1:
+                response.failure(f"Expected {len(pairs) + 1} lines, got {lines}")
+
@@ -2,6 +2,7 @@
 ASGI config for manzilproject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with gunicorn -k uvicorn.workers.UvicornWorker (see README).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -14,3 +15,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'manzilproject.settings')
 
 application = get_asgi_application()
+
+# Load the prebuilt graph snapshot (if any) now: under gunicorn --preload
+# this runs once in the master and every worker shares the result
+import transit  # noqa: E402
+
+transit.preload_snapshot()
@@ -50,9 +50,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'routefinder.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",  #added
+    "routefinder.middleware.WhiteNoiseMiddleware",  # async-capable whitenoise
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -149,4 +150,14 @@ STATIC_ROOT=os.path.join(BASE_DIR,'staticfiles')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-APPEND_SLASH = True #added
\ No newline at end of file
+APPEND_SLASH = True #added
+
+# django-ratelimit. Load tests that need to bypass the per-IP limits run the
+# server with RATELIMIT_ENABLE=false (see locustfile.py)
+RATELIMIT_ENABLE = os.getenv("RATELIMIT_ENABLE", "true").lower() not in ("0", "false", "no")
+
+# /metrics: shared directory gunicorn workers merge their metrics through,
+# and the bearer token scrapers must present (without one /metrics is only
+# served while DEBUG is on)
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
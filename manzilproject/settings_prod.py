@@ -35,8 +35,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'routefinder.middleware.ServerTimingMiddleware',  # First, so its total covers the whole stack
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Must be after SecurityMiddleware
+    'routefinder.middleware.WhiteNoiseMiddleware',  # async-capable whitenoise, after SecurityMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -146,6 +147,12 @@ SECURE_REFERRER_POLICY = 'same-origin'
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_AGE = 3600  # 1 hour
 
+# /metrics: workers merge their metrics through METRICS_DIR (the default is
+# recreated empty on every deploy). Scrapers must send METRICS_TOKEN as a
+# bearer token; without one /metrics is refused.
+METRICS_DIR = os.environ.get('METRICS_DIR') or str(BASE_DIR / '.metrics')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
 # Admin URL Protection (optional but recommended)
 # Consider changing '/admin/' to something less obvious in urls.py
 
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'manzilproject.settings')
 
 application = get_wsgi_application()
+
+# Load the prebuilt graph snapshot (if any) now: under gunicorn --preload
+# this runs once in the master and every worker shares the result
+import transit  # noqa: E402
+
+transit.preload_snapshot()
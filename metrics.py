@@ -0,0 +1,264 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = getattr(settings, "METRICS_ENABLED", True)
+
+# Directory shared by every gunicorn worker. Each worker dumps its metrics
+# there every METRICS_FLUSH_SECONDS and /metrics merges all the dumps, so a
+# scrape sees the whole server rather than whichever worker answered. Point
+# it at a directory emptied on deploy. None keeps metrics per process.
+METRICS_DIR = getattr(settings, "METRICS_DIR", None)
+METRICS_FLUSH_SECONDS = getattr(settings, "METRICS_FLUSH_SECONDS", 5)
+
+_lock = threading.Lock()
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        _maybe_flush()
+
+
+class Gauge(_Metric):
+    """Merged across workers by taking the most recently written value."""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+        _maybe_flush()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Per-bucket (non-cumulative) counts plus one overflow slot, then sum and count
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+        _maybe_flush()
+
+
+# ============================================
+# Routing engine metrics
+# ============================================
+
+SEARCH_SECONDS = Histogram(
+    "manzil_search_seconds", "Route search latency",
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    labelnames=("engine",))
+STATE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+SEARCH_STATES_EXPANDED = Histogram(
+    "manzil_search_states_expanded", "Search states popped and expanded per search",
+    STATE_BUCKETS, labelnames=("engine",))
+SEARCH_STATES_PUSHED = Histogram(
+    "manzil_search_states_pushed", "Search states pushed onto the heap per search",
+    STATE_BUCKETS, labelnames=("engine",))
+SEARCH_HEAP_MAX = Histogram(
+    "manzil_search_heap_max", "Heap high-water mark per search",
+    STATE_BUCKETS, labelnames=("engine",))
+ROUTE_PATH_STATIONS = Histogram(
+    "manzil_route_path_stations", "Stations on a planned route",
+    (2, 5, 10, 15, 20, 30, 40, 60, 80, 120))
+ROUTE_TRANSFERS = Histogram(
+    "manzil_route_transfers", "Transfers on a planned route",
+    (0, 1, 2, 3, 4, 5, 7, 10))
+CACHE_REQUESTS = Counter(
+    "manzil_cache_requests_total", "Cache lookups by cache and result (hit/miss)",
+    labelnames=("cache", "result"))
+GRAPH_BUILD_SECONDS = Histogram(
+    "manzil_graph_build_seconds", "Time to build a graph snapshot",
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+GRAPH_VERSION = Gauge("manzil_graph_version", "Graph version of the current snapshot")
+GRAPH_STATIONS = Gauge("manzil_graph_stations", "Stations in the current snapshot")
+GRAPH_STATES = Gauge("manzil_graph_search_states", "Search states in the current snapshot")
+REQUEST_PHASE_SECONDS = Histogram(
+    "manzil_request_phase_seconds", "Request time per view and phase (see timing.py)",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    labelnames=("view", "phase"))
+
+
+def observe_search(seconds, stats):
+    """Records one search given the stats dict the search filled in."""
+    if not METRICS_ENABLED:
+        return
+    engine = stats.get('engine', 'unknown')
+    SEARCH_SECONDS.observe(seconds, engine=engine)
+    if 'expanded' in stats:
+        SEARCH_STATES_EXPANDED.observe(stats['expanded'], engine=engine)
+        SEARCH_STATES_PUSHED.observe(stats['pushed'], engine=engine)
+        SEARCH_HEAP_MAX.observe(stats['heap_max'], engine=engine)
+
+
+def observe_cache(cache, hit):
+    if METRICS_ENABLED:
+        CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# ============================================
+# Cross-worker aggregation and exposition
+# ============================================
+
+_last_flush = 0.0
+
+
+def _dump():
+    with _lock:
+        return {
+            'written_at': time.time(),
+            'metrics': {metric.name: [[list(key), value if not isinstance(value, list) else list(value)]
+                                      for key, value in metric.values.items()]
+                        for metric in _registry},
+        }
+
+
+def _path_for(pid):
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def flush():
+    """Writes this process's metrics to METRICS_DIR (atomically)."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not METRICS_DIR:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _path_for(os.getpid())
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_dump(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def _maybe_flush():
+    if METRICS_DIR and time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def _reset_after_fork():
+    # A preloaded master's numbers must not be counted again by every worker
+    global _last_flush
+    for metric in _registry:
+        metric.values = {}
+    _last_flush = 0.0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def collect():
+    """
+    {metric name: {label tuple: value}} merged over every worker's dump
+    (this process included): counters and histograms are summed, gauges
+    come from the most recently written dump.
+    """
+    dumps = []
+    if METRICS_DIR:
+        flush()
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    dumps.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    else:
+        dumps.append(_dump())
+    dumps.sort(key=lambda dump: dump['written_at'])
+
+    merged = {metric.name: {} for metric in _registry}
+    kinds = {metric.name: metric.kind for metric in _registry}
+    for dump in dumps:
+        for name, entries in dump['metrics'].items():
+            if name not in merged:
+                continue
+            values = merged[name]
+            for key, value in entries:
+                key = tuple(key)
+                if kinds[name] == "gauge" or key not in values:
+                    values[key] = value if not isinstance(value, list) else list(value)
+                elif kinds[name] == "histogram":
+                    values[key] = [a + b for a, b in zip(values[key], value)]
+                else:
+                    values[key] += value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """The merged metrics in the Prometheus text exposition format."""
+    merged = collect()
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in sorted(merged[metric.name].items()):
+            if metric.kind != "histogram":
+                lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, ('le', '+Inf'))} {value[-1]}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_number(value[-2])}")
+            lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
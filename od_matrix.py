@@ -0,0 +1,182 @@
+import csv
+from array import array
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ImportError:  # npz output needs numpy; CSV does not
+    np = None
+
+import dijkstras
+from dijkstras import shortest_path_tree
+from routefinder.planner import AVG_SPEED_OF_BUS
+
+# Joins route ids in the route sequence column: "R3>EV1"
+ROUTE_SEPARATOR = ">"
+
+CSV_COLUMNS = ["from_station", "to_station", "distance_km", "transfers", "time_min", "routes"]
+
+
+def od_row(compact_graph, source):
+    """
+    One row of the OD matrix: a single shortest_path_tree() from station
+    index source, summarised per target station.
+
+    Returns (distance, transfers, cost, routes) where distance is km on the
+    bus, cost the search cost (distance plus transfer penalties - the figure
+    travel time is based on), and routes[v] a tuple of route indexes ridden
+    in order. Unreachable targets get inf / -1 / inf / None.
+    """
+    cg = compact_graph
+    station_state, station_cost, parent_state, parent_edge = shortest_path_tree(
+        cg, cg.station_names[source])
+
+    state_route = cg.state_route
+    edge_route = cg.edge_route
+    edge_distance = cg.edge_distance
+
+    # Per-state totals filled in along the tree, so every target costs
+    # O(1) once its ancestors are done instead of a full path walk
+    state_distance = {}
+    state_transfers = {}
+    state_routes = {}
+
+    def resolve(state):
+        pending = []
+        while state not in state_distance:
+            if parent_state[state] < 0:
+                state_distance[state] = 0.0
+                state_transfers[state] = 0
+                state_routes[state] = ()
+                break
+            pending.append(state)
+            state = parent_state[state]
+        for state in reversed(pending):
+            prev = parent_state[state]
+            route = edge_route[parent_edge[state]]
+            prev_route = state_route[prev]
+            state_distance[state] = state_distance[prev] + edge_distance[parent_edge[state]]
+            if route == prev_route:
+                state_transfers[state] = state_transfers[prev]
+                state_routes[state] = state_routes[prev]
+            else:
+                state_transfers[state] = state_transfers[prev] + (prev_route >= 0)
+                state_routes[state] = state_routes[prev] + (route,)
+
+    n = len(cg.station_names)
+    distance = array('d', [float("inf")]) * n
+    transfers = array('i', [-1]) * n
+    routes = [None] * n
+    for v in range(n):
+        found = station_state[v]
+        if found < 0:
+            continue
+        resolve(found)
+        distance[v] = state_distance[found]
+        transfers[v] = state_transfers[found]
+        routes[v] = state_routes[found]
+    return distance, transfers, station_cost, routes
+
+
+# Worker-process state for od_rows()
+_worker_graph = None
+
+
+def _init_worker(compact_graph, transfer_penalty):
+    global _worker_graph
+    _worker_graph = compact_graph
+    dijkstras.TRANSFER_PENALTY = transfer_penalty
+
+
+def _row_for(source):
+    return source, od_row(_worker_graph, source)
+
+
+def od_rows(compact_graph, processes=None):
+    """
+    Yields (source, row) for every station, computed over a process pool
+    (processes=1 stays in-process). Rows arrive in station order.
+    """
+    n = len(compact_graph.station_names)
+    if processes == 1:
+        for source in range(n):
+            yield source, od_row(compact_graph, source)
+        return
+
+    with Pool(processes, initializer=_init_worker,
+              initargs=(compact_graph, dijkstras.TRANSFER_PENALTY)) as pool:
+        yield from pool.imap(_row_for, range(n), chunksize=max(1, n // 256))
+
+
+def travel_time(cost):
+    """Minutes on the bus for a search cost, as the route planner reports it."""
+    return cost / AVG_SPEED_OF_BUS * 60
+
+
+def write_csv(compact_graph, rows, f):
+    """
+    Writes one line per reachable station pair (same-station pairs skipped).
+    Returns the number of pairs written.
+    """
+    cg = compact_graph
+    writer = csv.writer(f)
+    writer.writerow(CSV_COLUMNS)
+    written = 0
+    for source, (distance, transfers, cost, routes) in rows:
+        from_name = cg.station_names[source]
+        for target, sequence in enumerate(routes):
+            if sequence is None or target == source:
+                continue
+            writer.writerow([
+                from_name,
+                cg.station_names[target],
+                f"{distance[target]:.3f}",
+                transfers[target],
+                f"{travel_time(cost[target]):.1f}",
+                ROUTE_SEPARATOR.join(cg.route_ids[r] for r in sequence),
+            ])
+            written += 1
+    return written
+
+
+def build_matrices(compact_graph, rows):
+    """
+    Packs rows into numpy matrices for save_npz(). Route sequences are
+    interned: route_sequence[i, j] indexes into the route_sequences list
+    (-1 if unreachable), which keeps the file compact and pickle-free.
+    """
+    if np is None:
+        raise ImportError("numpy is required for the .npz OD matrix")
+    cg = compact_graph
+    n = len(cg.station_names)
+    distance = np.full((n, n), np.inf, dtype=np.float32)
+    time_min = np.full((n, n), np.inf, dtype=np.float32)
+    transfers = np.full((n, n), -1, dtype=np.int16)
+    route_sequence = np.full((n, n), -1, dtype=np.int32)
+    sequence_ids = {}
+
+    for source, (row_distance, row_transfers, row_cost, routes) in rows:
+        distance[source] = row_distance
+        transfers[source] = row_transfers
+        time_min[source] = np.asarray(row_cost) / AVG_SPEED_OF_BUS * 60
+        route_sequence[source] = [
+            -1 if sequence is None else sequence_ids.setdefault(sequence, len(sequence_ids))
+            for sequence in routes
+        ]
+
+    route_sequences = [ROUTE_SEPARATOR.join(cg.route_ids[r] for r in sequence)
+                       for sequence in sequence_ids]
+    return {
+        'stations': np.array(cg.station_names, dtype=str),
+        'distance_km': distance,
+        'transfers': transfers,
+        'time_min': time_min,
+        'route_sequence': route_sequence,
+        'route_sequences': np.array(route_sequences, dtype=str),
+        'transfer_penalty': np.float64(dijkstras.TRANSFER_PENALTY),
+    }
+
+
+def save_npz(path, matrices, compressed=True):
+    save = np.savez_compressed if compressed else np.savez
+    save(path, **matrices)
@@ -0,0 +1,262 @@
+import hashlib
+import logging
+import os
+import pickle
+from array import array
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from django.conf import settings
+
+import dijkstras
+import metrics
+from dijkstras import _compact_path, shortest_path_tree
+
+logger = logging.getLogger(__name__)
+
+# Where precomputed tables live, one file per graph version
+ROUTE_TABLE_DIR = getattr(settings, "ROUTE_TABLE_DIR", os.path.join(settings.BASE_DIR, "route_tables"))
+
+FORMAT_VERSION = 1
+
+
+class RouteTable:
+    """
+    Precomputed answers for every station-to-station query at one graph
+    version. For each source station it keeps the search tree of
+    shortest_path_tree() as flat arrays, so a lookup is an index into
+    station_cost plus a walk up the parent pointers for the path.
+    """
+
+    def __init__(self, version, fingerprint, transfer_penalty, station_names, num_states,
+                 station_state, station_cost, parent_state, parent_edge):
+        self.version = version
+        self.fingerprint = fingerprint
+        self.transfer_penalty = transfer_penalty
+        self.station_names = station_names
+        self.num_states = num_states
+        # Row-major: [source * num_stations + target]
+        self.station_state = station_state
+        self.station_cost = station_cost
+        # Row-major: [source * num_states + state]
+        self.parent_state = parent_state
+        self.parent_edge = parent_edge
+
+    def matches(self, version, compact_graph):
+        """True if this table answers for the given graph version and layout."""
+        return (
+            self.version == version
+            and self.fingerprint == graph_fingerprint(compact_graph)
+            and self.transfer_penalty == dijkstras.TRANSFER_PENALTY
+            and self.num_states == compact_graph.num_states
+            and self.station_names == compact_graph.station_names
+        )
+
+    def lookup(self, compact_graph, source_node, target_node):
+        """
+        Returns (cost, path_with_routes) like compact_dijkstra(), or None if
+        either station is unknown to the table.
+        """
+        index = compact_graph.station_index
+        if source_node not in index or target_node not in index:
+            return None
+        source = index[source_node]
+        n = len(self.station_names)
+        found = self.station_state[source * n + index[target_node]]
+        if found < 0:
+            return (float("inf"), [])
+
+        path = _compact_path(compact_graph, self.parent_state, self.parent_edge,
+                             found, base=source * self.num_states)
+        return (self.station_cost[source * n + index[target_node]], path)
+
+    def cost(self, compact_graph, source_node, target_node):
+        """Cost only, skipping path reconstruction. Both names must be in the graph."""
+        index = compact_graph.station_index
+        n = len(self.station_names)
+        return self.station_cost[index[source_node] * n + index[target_node]]
+
+    def tree(self, source_node):
+        """
+        The stored search tree of one source, in the shape
+        shortest_path_tree() returns. source_node must be in the table.
+        """
+        source = self.station_names.index(source_node)
+        n = len(self.station_names)
+        m = self.num_states
+        return (self.station_state[source * n:(source + 1) * n],
+                self.station_cost[source * n:(source + 1) * n],
+                self.parent_state[source * m:(source + 1) * m],
+                self.parent_edge[source * m:(source + 1) * m])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                'format': FORMAT_VERSION,
+                'version': self.version,
+                'fingerprint': self.fingerprint,
+                'transfer_penalty': self.transfer_penalty,
+                'station_names': self.station_names,
+                'num_states': self.num_states,
+                'station_state': self.station_state,
+                'station_cost': self.station_cost,
+                'parent_state': self.parent_state,
+                'parent_edge': self.parent_edge,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Atomic swap so a worker never reads a half-written table
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported route table format in {path}")
+        return cls(
+            data['version'], data['fingerprint'], data['transfer_penalty'],
+            data['station_names'], data['num_states'],
+            data['station_state'], data['station_cost'],
+            data['parent_state'], data['parent_edge'],
+        )
+
+
+class SourceTreeCache:
+    """
+    Single-source search trees computed on demand and kept (LRU) for reuse,
+    with the same cost()/lookup() interface as RouteTable. Meant for one
+    batch of queries where many pairs share an origin.
+    """
+
+    def __init__(self, compact_graph, max_trees=256):
+        self.compact = compact_graph
+        self.max_trees = max_trees
+        self._trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, source_node):
+        tree = self._trees.get(source_node)
+        metrics.observe_cache('source_tree', tree is not None)
+        if tree is not None:
+            self._trees.move_to_end(source_node)
+            self.hits += 1
+            return tree
+        self.misses += 1
+        tree = shortest_path_tree(self.compact, source_node)
+        self._trees[source_node] = tree
+        if len(self._trees) > self.max_trees:
+            self._trees.popitem(last=False)
+        return tree
+
+    def cost(self, compact_graph, source_node, target_node):
+        station_state, station_cost, _, _ = self.tree(source_node)
+        return station_cost[compact_graph.station_index[target_node]]
+
+    def lookup(self, compact_graph, source_node, target_node):
+        index = compact_graph.station_index
+        if source_node not in index or target_node not in index:
+            return None
+        station_state, station_cost, parent_state, parent_edge = self.tree(source_node)
+        found = station_state[index[target_node]]
+        if found < 0:
+            return (float("inf"), [])
+        return (station_cost[index[target_node]],
+                _compact_path(compact_graph, parent_state, parent_edge, found))
+
+
+def best_pair(table, compact_graph, sources, targets):
+    """
+    search_multi() answered from a RouteTable or SourceTreeCache: k x k cost
+    lookups, then one path rebuild for the winner. Every name must be in
+    the graph. Returns (total_cost, path_with_routes, source_node, target_node).
+    """
+    total, source_node, target_node = min(
+        (source_cost + table.cost(compact_graph, source_node, target_node) + target_cost,
+         source_node, target_node)
+        for source_node, source_cost in sources.items()
+        for target_node, target_cost in targets.items()
+    )
+    if total == float("inf"):
+        return (total, [], None, None)
+    cost, path = table.lookup(compact_graph, source_node, target_node)
+    return (total, path, source_node, target_node)
+
+
+def graph_fingerprint(compact_graph):
+    """
+    Hash of the compact graph's layout and edges. Guards against loading a
+    table built for the same version number of a different database.
+    """
+    cg = compact_graph
+    digest = hashlib.sha1()
+    digest.update("\n".join(cg.station_names).encode())
+    digest.update("\n".join(cg.route_ids).encode())
+    for arr in (cg.state_offset, cg.edge_offset, cg.edge_state, cg.edge_distance, cg.edge_route):
+        digest.update(arr.tobytes())
+    return digest.hexdigest()
+
+
+def route_table_path(version):
+    return os.path.join(ROUTE_TABLE_DIR, f"route_table_v{version}.pkl")
+
+
+# Worker-process state for build_route_table()
+_worker_graph = None
+
+
+def _init_worker(compact_graph, transfer_penalty):
+    global _worker_graph
+    _worker_graph = compact_graph
+    dijkstras.TRANSFER_PENALTY = transfer_penalty
+
+
+def _tree_for(source):
+    return shortest_path_tree(_worker_graph, _worker_graph.station_names[source])
+
+
+def build_route_table(compact_graph, version, processes=None):
+    """
+    Runs one shortest_path_tree() per station, spread over a process pool
+    (processes=1 stays in-process), and packs the results into a RouteTable.
+    """
+    n = len(compact_graph.station_names)
+    penalty = dijkstras.TRANSFER_PENALTY
+
+    if processes == 1:
+        trees = [shortest_path_tree(compact_graph, name) for name in compact_graph.station_names]
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(compact_graph, penalty)) as pool:
+            trees = pool.map(_tree_for, range(n), chunksize=max(1, n // 64))
+
+    # 32-bit ints halve the table size; state/edge counts stay far below 2**31
+    station_state = array('i')
+    station_cost = array('d')
+    parent_state = array('i')
+    parent_edge = array('i')
+    for tree_state, tree_cost, tree_parent, tree_edge in trees:
+        station_state.extend(array('i', tree_state))
+        station_cost.extend(tree_cost)
+        parent_state.extend(array('i', tree_parent))
+        parent_edge.extend(array('i', tree_edge))
+
+    return RouteTable(version, graph_fingerprint(compact_graph), penalty,
+                      list(compact_graph.station_names), compact_graph.num_states,
+                      station_state, station_cost, parent_state, parent_edge)
+
+
+def load_route_table(version, compact_graph):
+    """Loads the table for this graph version from disk, or None if missing/stale."""
+    path = route_table_path(version)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = RouteTable.load(path)
+    except Exception as e:
+        logger.warning(f"Could not load route table {path}: {e}")
+        return None
+    if not table.matches(version, compact_graph):
+        logger.info(f"Ignoring stale route table {path}")
+        return None
+    return table
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Contact, Contribute, Station, Route, Report
+from .models import Contact, Contribute, LineSchedule, Station, Route, Report
 
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
@@ -24,4 +24,9 @@ class ReportAdmin(admin.ModelAdmin):
 admin.site.register(Contact)
 admin.site.register(Contribute)
 admin.site.register(Station)
-admin.site.register(Route)
\ No newline at end of file
+admin.site.register(Route)
+
+@admin.register(LineSchedule)
+class LineScheduleAdmin(admin.ModelAdmin):
+    list_display = ['route_id', 'headway_minutes', 'first_departure', 'last_departure', 'speed_kmh']
+    ordering = ['route_id']
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RoutefinderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'routefinder'
+
+    def ready(self):
+        # Register graph snapshot invalidation signals
+        from routefinder import signals  # noqa: F401
@@ -0,0 +1,116 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import benchmarks
+from synthetic import grid_network
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark graph building, routing and the find_route view on routes.txt "
+        "and synthetic networks, and fail on regressions against a saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default=",".join(str(n) for n in benchmarks.SYNTHETIC_SIZES),
+            help="Comma-separated synthetic network sizes in stops ('' to skip)",
+        )
+        parser.add_argument("--queries", type=int, default=100, help="Routing queries per network")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for networks and query pairs")
+        parser.add_argument("--no-files", action="store_true", help="Skip the routes.txt network")
+        parser.add_argument("--no-db", action="store_true", help="Skip transit_map() and find_route")
+        parser.add_argument("--contraction-max-stops", type=int, default=benchmarks.CONTRACTION_MAX_STATIONS,
+                            help="Largest network to build a contraction hierarchy for")
+        parser.add_argument("--baseline", default=benchmarks.BENCHMARK_BASELINE,
+                            help="Committed baseline of search counts (required)")
+        parser.add_argument("--timings", default=benchmarks.BENCHMARK_TIMINGS,
+                            help="This machine's timings baseline (compared if present)")
+        parser.add_argument("--save-baseline", action="store_true",
+                            help="Store these results as the new baselines instead of comparing")
+        parser.add_argument("--threshold", type=float, default=benchmarks.REGRESSION_THRESHOLD,
+                            help="Allowed slowdown/growth factor before a case counts as regressed")
+        parser.add_argument("--json", dest="json_path", default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(n) for n in options["sizes"].split(",") if n.strip()]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers")
+
+        networks = []
+        if not options["no_files"]:
+            networks.append(benchmarks.read_network_files(
+                os.path.join(settings.BASE_DIR, "stations.txt"),
+                os.path.join(settings.BASE_DIR, "routes.txt"),
+            ))
+        for size in sizes:
+            stations, routes = grid_network(size, seed=options["seed"])
+            networks.append(benchmarks.Network(f"synthetic-{size}", stations, routes))
+
+        results = {}
+        for network in networks:
+            self.stdout.write(f"Benchmarking {network.name} ({len(network.stations)} stops, "
+                              f"{len(network.routes)} route edges)...")
+            results.update(benchmarks.run_network(network, options["queries"], options["seed"],
+                                                  options["contraction_max_stops"]))
+        if not options["no_db"]:
+            self.stdout.write("Benchmarking database and find_route...")
+            db_results = benchmarks.run_database(options["queries"], options["seed"])
+            if not db_results:
+                self.stdout.write(self.style.WARNING("No stations in the database - skipped"))
+            results.update(db_results)
+
+        self.print_table(results)
+
+        if options["json_path"]:
+            with open(options["json_path"], "w", encoding="utf-8") as f:
+                json.dump({'environment': benchmarks.environment(), 'results': results}, f, indent=2)
+
+        # Counts depend on these; which cases ran does not matter
+        params = {'queries': options["queries"], 'seed': options["seed"]}
+        if options["save_baseline"]:
+            benchmarks.save_baseline(results, params, options["baseline"])
+            benchmarks.save_timings(results, options["timings"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Saved baseline -> {options['baseline']}, timings -> {options['timings']}"))
+            return
+
+        baseline = benchmarks.load_baseline(options["baseline"])
+        if baseline is None:
+            raise CommandError(f"No baseline at {options['baseline']}; run with --save-baseline to create one")
+        if baseline.get('params') != params:
+            recorded = baseline.get('params') or {}
+            raise CommandError(
+                f"{options['baseline']} was recorded with --queries {recorded.get('queries')} "
+                f"--seed {recorded.get('seed')}; run with those to compare")
+
+        regressions = benchmarks.compare(results, baseline, options["threshold"])
+        compared = [options["baseline"]]
+        timings = benchmarks.load_baseline(options["timings"])
+        if timings is None:
+            self.stdout.write(self.style.WARNING(
+                f"No timings at {options['timings']}; only search counts are compared"))
+        else:
+            regressions += benchmarks.compare(results, timings, options["threshold"])
+            compared.append(options["timings"])
+
+        if regressions:
+            for line in regressions:
+                self.stderr.write(self.style.ERROR(f"REGRESSION {line}"))
+            raise CommandError(f"{len(regressions)} benchmark regression(s) against {', '.join(compared)}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {', '.join(compared)}"))
+
+    def print_table(self, results):
+        header = f"{'case':<44}{'calls':>7}{'p50 ms':>11}{'p99 ms':>11}{'alloc KB':>11}{'expanded':>11}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for key, summary in results.items():
+            expanded = summary.get('expanded')
+            self.stdout.write(
+                f"{key:<44}{summary['calls']:>7}{summary['p50_ms']:>11.3f}{summary['p99_ms']:>11.3f}"
+                f"{summary['alloc_kb']:>11.1f}{'-' if expanded is None else f'{expanded:.0f}':>11}"
+            )
@@ -0,0 +1,45 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from transit import (CONTRACTION_HIERARCHY, GRAPH_SNAPSHOT_FILE, build_snapshot, contract_snapshot,
+                     current_graph_version, load_snapshot, save_snapshot)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the graph snapshot from the database and save it for workers to "
+        "load at startup instead of building it themselves"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=GRAPH_SNAPSHOT_FILE,
+                            help=f"Snapshot file (default: {GRAPH_SNAPSHOT_FILE})")
+        parser.add_argument("--force", action="store_true",
+                            help="Rebuild even if the file is already at the current graph version")
+
+    def handle(self, *args, **options):
+        path = options["output"]
+        version = current_graph_version()
+
+        if not options["force"]:
+            existing = load_snapshot(path)
+            if (existing is not None and existing.version == version
+                    and (existing.contraction is not None or not CONTRACTION_HIERARCHY)):
+                self.stdout.write(f"Graph snapshot for version {version} is up to date: {path}")
+                return
+
+        started = time.perf_counter()
+        snapshot = build_snapshot(version)
+        if CONTRACTION_HIERARCHY:
+            # Contracted here so workers never have to
+            contract_snapshot(snapshot)
+        save_snapshot(snapshot, path)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built graph snapshot for version {version}: {len(snapshot.graph)} stations, "
+            f"{snapshot.compact.num_states} search states in {elapsed:.2f}s "
+            f"({os.path.getsize(path) / 1024:.0f} KB) -> {path}"
+        ))
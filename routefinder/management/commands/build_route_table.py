@@ -0,0 +1,50 @@
+import glob
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from route_table import ROUTE_TABLE_DIR, build_route_table, route_table_path
+from transit import build_snapshot
+
+
+class Command(BaseCommand):
+    help = "Precompute every station-to-station route for the current graph version"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=None,
+            help="Worker processes to use (default: one per CPU core)",
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Rebuild even if a table for this graph version already exists",
+        )
+        parser.add_argument(
+            "--keep-old", action="store_true",
+            help="Keep tables built for older graph versions",
+        )
+
+    def handle(self, *args, **options):
+        snapshot = build_snapshot()
+        path = route_table_path(snapshot.version)
+
+        if snapshot.route_table is not None and not options["force"]:
+            self.stdout.write(f"Route table for graph version {snapshot.version} is up to date: {path}")
+            return
+
+        started = time.perf_counter()
+        table = build_route_table(snapshot.compact, snapshot.version, processes=options["processes"])
+        table.save(path)
+        elapsed = time.perf_counter() - started
+
+        if not options["keep_old"]:
+            for old_path in glob.glob(os.path.join(ROUTE_TABLE_DIR, "route_table_v*.pkl")):
+                if old_path != path:
+                    os.remove(old_path)
+
+        n = len(table.station_names)
+        self.stdout.write(self.style.SUCCESS(
+            f"Built route table for graph version {snapshot.version}: "
+            f"{n * n} station pairs in {elapsed:.2f}s ({os.path.getsize(path) / 1024:.0f} KB) -> {path}"
+        ))
@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+import od_matrix
+from transit import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the station x station matrix of distance, transfers, travel time "
+        "and route sequence for the current Route table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Output file (.npz or .csv)")
+        parser.add_argument(
+            "--format", choices=["npz", "csv"], default=None,
+            help="Output format (default: from the file extension, else npz)",
+        )
+        parser.add_argument(
+            "--processes", type=int, default=None,
+            help="Worker processes to use (default: one per CPU core)",
+        )
+        parser.add_argument(
+            "--uncompressed", action="store_true",
+            help="Write the .npz without compression",
+        )
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        fmt = options["format"] or ("csv" if output.lower().endswith(".csv") else "npz")
+        if fmt == "npz" and od_matrix.np is None:
+            raise CommandError("numpy is required for .npz output; install it or use --format csv")
+
+        snapshot = build_snapshot()
+        cg = snapshot.compact
+        n = len(cg.station_names)
+        if n == 0:
+            raise CommandError("No stations found in database")
+
+        started = time.perf_counter()
+        rows = od_matrix.od_rows(cg, processes=options["processes"])
+        if fmt == "csv":
+            with open(output, "w", newline="", encoding="utf-8") as f:
+                pairs = od_matrix.write_csv(cg, rows, f)
+            summary = f"{pairs} reachable pairs"
+        else:
+            matrices = od_matrix.build_matrices(cg, rows)
+            od_matrix.save_npz(output, matrices, compressed=not options["uncompressed"])
+            # np.savez appends .npz when missing
+            if not output.endswith(".npz"):
+                output += ".npz"
+            summary = f"{n} x {n} matrix, {len(matrices['route_sequences'])} distinct route sequences"
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported OD matrix for graph version {snapshot.version}: {summary} "
+            f"in {elapsed:.2f}s ({os.path.getsize(output) / 1024:.0f} KB) -> {output}"
+        ))
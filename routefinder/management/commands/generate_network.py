@@ -0,0 +1,71 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic transit network as stations.txt/routes.txt files "
+        "and/or a Station/Route fixture for `manage.py loaddata`"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", default=None,
+                            help="Write stations.txt and routes.txt into this directory")
+        parser.add_argument("--fixture", default=None,
+                            help="Write a loaddata fixture (.json) to this path")
+        parser.add_argument("--lines", type=int, default=40, help="Number of bus lines")
+        parser.add_argument("--stops-per-line", type=int, default=30, help="Stops on each line")
+        parser.add_argument("--stop-spacing-km", type=float, default=0.8, help="Distance between stops")
+        parser.add_argument("--hubs", type=int, default=None,
+                            help="Transfer hubs lines run through (default: one per six lines)")
+        parser.add_argument("--corridors", type=int, default=3,
+                            help="Shared corridors several lines run along together")
+        parser.add_argument("--lines-per-corridor", type=int, default=3, help="Lines sharing each corridor")
+        parser.add_argument("--corridor-stops", type=int, default=5, help="Shared stops per corridor")
+        parser.add_argument("--layout", choices=synthetic.LAYOUTS, default="radial", help="How hubs are laid out")
+        parser.add_argument("--center", default=f"{synthetic.CENTER_LAT},{synthetic.CENTER_LNG}",
+                            help="City centre as LAT,LNG")
+        parser.add_argument("--radius-km", type=float, default=None,
+                            help="City radius (default: sized to the number of stops)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    def handle(self, *args, **options):
+        if not options["output_dir"] and not options["fixture"]:
+            raise CommandError("Give --output-dir and/or --fixture")
+        try:
+            lat, lng = (float(part) for part in options["center"].split(","))
+        except ValueError:
+            raise CommandError("--center must be LAT,LNG")
+
+        try:
+            stations, routes = synthetic.generate_network(
+                lines=options["lines"],
+                stops_per_line=options["stops_per_line"],
+                stop_spacing_km=options["stop_spacing_km"],
+                hubs=options["hubs"],
+                corridors=options["corridors"],
+                lines_per_corridor=options["lines_per_corridor"],
+                corridor_stops=options["corridor_stops"],
+                layout=options["layout"],
+                center=(lat, lng),
+                radius_km=options["radius_km"],
+                seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        summary = f"{len(stations)} stations, {len(routes)} route edges on {options['lines']} lines"
+        if options["output_dir"]:
+            os.makedirs(options["output_dir"], exist_ok=True)
+            stations_path = os.path.join(options["output_dir"], "stations.txt")
+            routes_path = os.path.join(options["output_dir"], "routes.txt")
+            synthetic.write_network_files(stations, routes, stations_path, routes_path)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {summary} -> {stations_path}, {routes_path}"))
+        if options["fixture"]:
+            synthetic.write_fixture(stations, routes, options["fixture"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {summary} -> {options['fixture']} (load with `manage.py loaddata {options['fixture']}`)"
+            ))
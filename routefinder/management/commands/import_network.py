@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import ingest
+
+
+class Command(BaseCommand):
+    help = (
+        "Load stations.txt/routes.txt into the Station and Route tables. The tables "
+        "end up matching the files exactly, so re-running is safe"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stations", default=str(settings.BASE_DIR / "stations.txt"),
+                            help="Stations CSV (station_id,station_name,lat,lng)")
+        parser.add_argument("--routes", default=str(settings.BASE_DIR / "routes.txt"),
+                            help="Routes CSV (route_id,from_station_id,to_station_id,distance_kms)")
+        parser.add_argument("--schedules",
+                            help="Line schedules CSV (route_id,headway_minutes,first_departure,last_departure"
+                                 "[,speed_kmh]); replaces every LineSchedule row. Left alone if not given")
+        parser.add_argument("--batch-size", type=int, default=ingest.BATCH_SIZE, help="Rows per INSERT")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Validate and run the import, then roll it back")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        started = time.perf_counter()
+        try:
+            counts = ingest.import_network(options["stations"], options["routes"],
+                                           batch_size=options["batch_size"], dry_run=options["dry_run"],
+                                           schedules_path=options["schedules"])
+        except OSError as e:
+            raise CommandError(str(e))
+        except ingest.NetworkImportError as e:
+            raise CommandError(f"{e.total} invalid row(s), nothing imported:\n{e}")
+
+        summary = (
+            f"{counts['stations']} stations and {counts['routes']} routes "
+            f"({counts['stations_deleted']} stale stations and {counts['routes_deleted']} stale routes removed) "
+        )
+        if counts["schedules"] is not None:
+            summary += f"and {counts['schedules']} line schedules ({counts['schedules_deleted']} replaced) "
+        summary += f"in {time.perf_counter() - started:.2f}s"
+        if options["dry_run"]:
+            self.stdout.write(f"Dry run, rolled back: {summary}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Imported {summary}"))
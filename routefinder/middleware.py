@@ -0,0 +1,86 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+import timing
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request and its phases (see timing.phase()) and reports them
+    in a Server-Timing header. Goes first in MIDDLEWARE so "total" covers the
+    whole middleware stack. Runs natively under both WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not timing.SERVER_TIMING_ENABLED:
+            return self.get_response(request)
+
+        timings, token = timing.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.end_request(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        if not timing.SERVER_TIMING_ENABLED:
+            return await self.get_response(request)
+
+        timings, token = timing.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.end_request(token)
+        return self.finish(request, response, timings, started)
+
+    def finish(self, request, response, timings, started):
+        timings.add("total", (time.perf_counter() - started) * 1000)
+        response["Server-Timing"] = timings.header()
+        match = request.resolver_match
+        timing.record(match.url_name if match and match.url_name else "unresolved", timings)
+        return response
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also run as async middleware. The stock one is
+    sync-only, which under ASGI would push every request through a worker
+    thread just to check for a static file.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks at the filesystem - keep it off the event loop
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
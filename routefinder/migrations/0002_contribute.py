@@ -9,15 +9,19 @@ class Migration(migrations.Migration):
         ('routefinder', '0001_initial'),
     ]
 
+    # 0001_initial already creates this table, so on a fresh database (tests
+    # included) only the migration state is updated
     operations = [
-        migrations.CreateModel(
-            name='Contribute',
-            fields=[
-                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
-                ('name', models.CharField(max_length=122)),
-                ('email', models.CharField(max_length=122)),
-                ('desc', models.TextField()),
-                ('date', models.DateField()),
-            ],
-        ),
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='Contribute',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('name', models.CharField(max_length=122)),
+                    ('email', models.CharField(max_length=122)),
+                    ('desc', models.TextField()),
+                    ('date', models.DateField()),
+                ],
+            ),
+        ]),
     ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routefinder', '0005_graphversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoutePopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_station', models.CharField(max_length=200)),
+                ('to_station', models.CharField(max_length=200)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('from_station', 'to_station'), name='unique_route_popularity_pair')],
+            },
+        ),
+    ]
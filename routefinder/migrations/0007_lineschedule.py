@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routefinder', '0006_routepopularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LineSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_id', models.CharField(max_length=10, unique=True)),
+                ('headway_minutes', models.FloatField()),
+                ('first_departure', models.TimeField()),
+                ('last_departure', models.TimeField()),
+                ('speed_kmh', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -28,6 +28,44 @@ class Route(models.Model):
     to_station = models.ForeignKey(Station, related_name="routes_to", on_delete=models.CASCADE)
     distance_kms = models.FloatField()
 
+class GraphVersion(models.Model):
+    # Single row (pk=1) bumped whenever Station/Route data changes so every
+    # worker can tell its in-memory graph snapshot is stale
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Graph version {self.version}"
+
+class RoutePopularity(models.Model):
+    # How often a station pair is asked for, either direction counted
+    # together (from_station < to_station). Picks the pairs the route cache
+    # warms after a deploy or graph change.
+    from_station = models.CharField(max_length=200)
+    to_station = models.CharField(max_length=200)
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['from_station', 'to_station'], name='unique_route_popularity_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.from_station} - {self.to_station}: {self.count}"
+
+class LineSchedule(models.Model):
+    # How often a line (Route.route_id) runs. Buses leave each end every
+    # headway_minutes from first_departure to last_departure; lines
+    # without a row use the timetable defaults.
+    route_id = models.CharField(max_length=10, unique=True)
+    headway_minutes = models.FloatField()
+    first_departure = models.TimeField()
+    last_departure = models.TimeField()
+    speed_kmh = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.route_id} every {self.headway_minutes:g} min"
+
 class Report(models.Model):
     REPORT_TYPES = [
         ('harassment', 'Harassment'),
@@ -0,0 +1,295 @@
+"""
+Trip planning shared by the HTML route finder and the JSON APIs.
+"""
+import time
+
+from django.conf import settings
+
+import dijkstras
+import metrics
+from alternatives import alternative_routes
+from dijkstras import analyze_route_path, pareto_search, path_cost
+from routefinder import route_cache
+from route_table import best_pair
+from timetable import clock, journey_path, raptor
+from timing import phase
+from transit import normalize
+
+AVG_SPEED_OF_BUS = 26  # km/h
+AVG_WALKING_SPEED = 5  # km/h
+
+# Coordinate inputs are routed from/to any of the k nearest stations.
+# A walked km costs as much as the bus km covered in the same time.
+NEAREST_STATIONS_K = getattr(settings, "NEAREST_STATIONS_K", 3)
+
+# Station names offered when a name does not resolve
+STATION_SUGGESTIONS = 3
+WALK_COST_FACTOR = AVG_SPEED_OF_BUS / AVG_WALKING_SPEED
+
+
+class RoutePlanningError(Exception):
+    """A trip could not be planned; the message is safe to show to users."""
+
+
+class NoServiceError(RoutePlanningError):
+    """The stations are connected, but no bus runs at the requested time."""
+
+
+class StationNotFoundError(RoutePlanningError):
+    """A name did not resolve to one station; suggestions lists likely ones."""
+
+    def __init__(self, message, suggestions=()):
+        super().__init__(message)
+        self.suggestions = list(suggestions)
+
+
+def resolve_location(snapshot, name, point=None):
+    """
+    Candidate stations for one end of a trip as {normalized name: walking km}.
+    A (lat, lng) point gives the k nearest stations, otherwise the station
+    name itself with no walk - or, if it is not an exact station name, the
+    best match from the search index. The first key is the closest candidate.
+    """
+    if point is not None:
+        candidates = {}
+        for distance, i in snapshot.spatial.nearest(point[0], point[1], k=NEAREST_STATIONS_K):
+            candidates.setdefault(snapshot.stations[i]['normalized_name'], distance)
+        return candidates
+    key = normalize(name)
+    if key not in snapshot.graph:
+        key = snapshot.search_index.resolve(name) or key
+    return {key: 0}
+
+
+def plan_route(snapshot, from_name, to_name, from_point=None, to_point=None, trees=None, options=False,
+               alternatives=0, depart_at=None):
+    """
+    Plans a trip on the given GraphSnapshot. Each end is a station name or,
+    when from_point/to_point is given, a (lat, lng) to walk from/to.
+    trees (a RouteTable or SourceTreeCache) answers from precomputed search
+    trees instead of searching. Returns a dict with the path, segments and
+    distance/time figures; with options=True also 'options' (see
+    route_options()) and with alternatives=N up to N 'alternatives' (see
+    route_alternatives()).
+
+    depart_at (minutes after midnight) plans the earliest arrival on the
+    line schedules instead of the cheapest path, adding 'departure',
+    'arrival' and the timed 'legs'; NoServiceError if no bus runs then.
+    """
+    if not snapshot.stations:
+        raise RoutePlanningError("No station data available. Please try again later.")
+
+    with phase("resolve"):
+        walk_from = resolve_location(snapshot, from_name, from_point)
+        walk_to = resolve_location(snapshot, to_name, to_point)
+    from_station = next(iter(walk_from))
+    to_station = next(iter(walk_to))
+
+    # Validate stations exist in graph
+    if from_station not in snapshot.graph:
+        raise _not_found(snapshot, "Start", from_station, from_name)
+
+    if to_station not in snapshot.graph:
+        raise _not_found(snapshot, "Destination", to_station, to_name)
+
+    if from_station == to_station and walk_from[from_station] == 0 and walk_to[to_station] == 0:
+        raise RoutePlanningError("Please select different locations.")
+
+    # Dijkstra/A* Routing - one search seeded with every candidate
+    # station at its walking cost
+    sources = {name: distance * WALK_COST_FACTOR for name, distance in walk_from.items()}
+    targets = {name: distance * WALK_COST_FACTOR for name, distance in walk_to.items()}
+    stats = {}
+    started = time.perf_counter()
+    legs = None
+    with phase("search"):
+        if depart_at is not None:
+            stats['engine'] = 'raptor'
+            access = {name: distance / AVG_WALKING_SPEED * 60 for name, distance in walk_from.items()}
+            egress = {name: distance / AVG_WALKING_SPEED * 60 for name, distance in walk_to.items()}
+            arrival, legs, best_from, best_to = raptor(snapshot.timetable, access, egress, depart_at,
+                                                       stats=stats)
+            total_cost = arrival
+            if arrival != float("inf"):
+                path_with_routes = journey_path(best_from, legs)
+        elif trees is not None:
+            stats['engine'] = 'trees'
+            total_cost, path_with_routes, best_from, best_to = best_pair(trees, snapshot.compact, sources, targets)
+        elif from_point is None and to_point is None:
+            # Station to station: the cacheable (and most common) case
+            route_cache.record_query(from_station, to_station)
+            total_cost, path_with_routes = route_cache.search(snapshot, from_station, to_station, stats=stats)
+            best_from, best_to = from_station, to_station
+        else:
+            total_cost, path_with_routes, best_from, best_to = snapshot.search_multi(sources, targets, stats=stats)
+    metrics.observe_search(time.perf_counter() - started, stats)
+    if trees is None and snapshot.route_table is not None and stats.get('engine') not in ('cache', 'raptor'):
+        metrics.observe_cache('route_table', stats.get('table_hit', False))
+
+    if total_cost == float("inf"):
+        if depart_at is not None and snapshot.search_multi(sources, targets)[0] != float("inf"):
+            raise NoServiceError(f"No buses from {from_station} to {to_station} leave after {clock(depart_at)}.")
+        raise RoutePlanningError(f"No route found between {from_station} and {to_station}.")
+
+    from_station, to_station = best_from, best_to
+    walk_start_distance = walk_from[from_station]
+    walk_end_distance = walk_to[to_station]
+
+    # Segments, coordinates and map polylines for the response
+    with phase("segments"):
+        cost = path_cost(path_with_routes)
+
+        route_segments = analyze_route_path(path_with_routes)
+        simple_path = [station_info.station for station_info in path_with_routes]
+
+        transit_travel_time = (cost / AVG_SPEED_OF_BUS) * 60
+        walk_time = ((walk_start_distance + walk_end_distance) / AVG_WALKING_SPEED) * 60
+
+        # Coordinates for map rendering, keyed by normalized name like simple_path
+        coords_dict = {
+            st: snapshot.coords[st] for st in simple_path if st in snapshot.coords
+        }
+        map_segments = _map_segments(snapshot, route_segments)
+
+    if metrics.METRICS_ENABLED:
+        metrics.ROUTE_PATH_STATIONS.observe(len(simple_path))
+        metrics.ROUTE_TRANSFERS.observe(max(0, len(route_segments) - 1))
+
+    plan = {
+        'from_station': from_station,
+        'to_station': to_station,
+        'cost': cost,
+        'path': simple_path,
+        'path_with_routes': path_with_routes,
+        'route_segments': route_segments,
+        'map_segments': map_segments,
+        'coords': coords_dict,
+        'num_transfers': max(0, len(route_segments) - 1),
+        'walk_start_distance': walk_start_distance,
+        'walk_end_distance': walk_end_distance,
+        'walk_start_time': (walk_start_distance / AVG_WALKING_SPEED) * 60,
+        'walk_end_time': (walk_end_distance / AVG_WALKING_SPEED) * 60,
+        'total_time': transit_travel_time + walk_time,
+        # Kilometres travelled; cost also counts TRANSFER_PENALTY per transfer
+        'total_distance': (sum(step.distance_from_prev for step in path_with_routes)
+                           + walk_start_distance + walk_end_distance),
+    }
+    if legs is not None:
+        plan['departure'] = depart_at
+        plan['arrival'] = total_cost
+        plan['total_time'] = total_cost - depart_at
+        plan['legs'] = _timed_legs(legs, depart_at + walk_start_distance / AVG_WALKING_SPEED * 60)
+    if options:
+        with phase("options"):
+            plan['options'] = route_options(snapshot, from_station, to_station,
+                                            walk_start_distance + walk_end_distance)
+    if alternatives:
+        with phase("alternatives"):
+            plan['alternatives'] = route_alternatives(
+                snapshot, from_station, to_station, alternatives,
+                walk_start_distance + walk_end_distance,
+                trees=trees if trees is not None else snapshot.route_table)
+    return plan
+
+
+def _not_found(snapshot, end, station, name):
+    suggestions = snapshot.search_index.search(name, limit=STATION_SUGGESTIONS)
+    message = f"{end} station '{station}' not found in transit network."
+    if suggestions:
+        message += f" Did you mean {', '.join(suggestions)}?"
+    return StationNotFoundError(message, suggestions)
+
+
+def _map_segments(snapshot, route_segments):
+    """Per-segment [lat, lng] polylines for the map."""
+    map_segments = []
+    for segment in route_segments:
+        seg_coords = []
+        for st in segment['stations']:
+            if st in snapshot.coords:
+                seg_coords.append([snapshot.coords[st]['lat'], snapshot.coords[st]['lng']])
+        map_segments.append({
+            'route_id': segment['route_id'],
+            'coords': seg_coords,
+            'stations': segment['stations']
+        })
+    return map_segments
+
+
+def _timed_legs(legs, at_first_stop):
+    """
+    raptor() legs as [{'route_id', 'from', 'to', 'departure', 'arrival',
+    'wait_min', 'ride_min', 'stations'}], times as 'HH:MM'. Waits count
+    from reaching the stop (at_first_stop for the first ride).
+    """
+    timed = []
+    at_stop = at_first_stop
+    for leg in legs:
+        timed.append({
+            'route_id': leg.route,
+            'from': leg.stations[0],
+            'to': leg.stations[-1],
+            'departure': clock(leg.departure),
+            'arrival': clock(leg.arrival),
+            'wait_min': leg.departure - at_stop,
+            'ride_min': leg.arrival - leg.departure,
+            'stations': leg.stations,
+        })
+        at_stop = leg.arrival
+    return timed
+
+
+def _trip_time(transit_cost, walk_distance):
+    """Minutes for a trip: transit cost (km incl. transfer penalties) by bus plus the walk."""
+    return (transit_cost / AVG_SPEED_OF_BUS + walk_distance / AVG_WALKING_SPEED) * 60
+
+
+def route_alternatives(snapshot, from_station, to_station, count, walk_distance=0, trees=None):
+    """
+    Up to count trips between two stations that differ from the best one
+    (see alternatives.alternative_routes): [{'via', 'distance', 'transfers',
+    'time', 'routes', 'path', 'route_segments', 'map_segments'}] by
+    increasing time, figures including walk_distance (km) on foot.
+    """
+    found = alternative_routes(snapshot.compact, from_station, to_station,
+                               max_alternatives=count, trees=trees)
+    result = []
+    for cost, path, via in found[1:]:
+        route_segments = analyze_route_path(path)
+        result.append({
+            'via': via,
+            'distance': sum(step.distance_from_prev for step in path) + walk_distance,
+            'transfers': max(0, len(route_segments) - 1),
+            'time': _trip_time(cost, walk_distance),
+            'routes': [segment['route_id'] for segment in route_segments],
+            'path': [step.station for step in path],
+            'route_segments': route_segments,
+            'map_segments': _map_segments(snapshot, route_segments),
+        })
+    return result
+
+
+def route_options(snapshot, from_station, to_station, walk_distance=0):
+    """
+    The distance/transfers trade-offs between two stations, one Pareto
+    search: [{'label', 'distance', 'transfers', 'time', 'routes'}] by
+    increasing distance, 'time' including walk_distance (km) on foot.
+    The quickest is labelled "Fastest"; the others are "Fewest transfers",
+    "Shortest distance" or "Alternative".
+    """
+    options = []
+    for distance, transfers, path in pareto_search(snapshot.compact, from_station, to_station):
+        routes = [segment['route_id'] for segment in analyze_route_path(path)]
+        options.append({
+            'label': "Alternative",
+            'distance': distance + walk_distance,
+            'transfers': transfers,
+            'time': _trip_time(distance + transfers * dijkstras.TRANSFER_PENALTY, walk_distance),
+            'routes': routes,
+        })
+    if options:
+        # Sorted by distance, so the last has the fewest transfers
+        options[0]['label'] = "Shortest distance"
+        options[-1]['label'] = "Fewest transfers"
+        min(options, key=lambda option: option['time'])['label'] = "Fastest"
+    return options
@@ -0,0 +1,31 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django_ratelimit import ALL
+from django_ratelimit.core import is_ratelimited
+from django_ratelimit.exceptions import Ratelimited
+
+
+def async_ratelimit(group=None, key=None, rate=None, method=ALL, block=True):
+    """
+    django_ratelimit.decorators.ratelimit for async views, which it does
+    not support. Same arguments and behaviour; the cache round-trip runs
+    in a worker thread since cache backends are synchronous. That thread
+    is not the thread-sensitive one Django uses for sync views and
+    middleware, so rate limit checks do not queue behind them.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def _wrapped(request, *args, **kw):
+            old_limited = getattr(request, 'limited', False)
+            ratelimited = await sync_to_async(is_ratelimited, thread_sensitive=False)(
+                request=request, group=group, fn=fn, key=key, rate=rate, method=method, increment=True)
+            request.limited = ratelimited or old_limited
+            if ratelimited and block:
+                cls = getattr(settings, 'RATELIMIT_EXCEPTION_CLASS', Ratelimited)
+                raise (import_string(cls) if isinstance(cls, str) else cls)()
+            return await fn(request, *args, **kw)
+        return _wrapped
+    return decorator
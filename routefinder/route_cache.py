@@ -0,0 +1,229 @@
+"""
+Station-to-station search results, cached per graph version.
+
+Two tiers: an LRU dict in each process, and optionally a shared Django
+cache (ROUTE_CACHE_ALIAS) that every worker reads through. The graph is
+undirected, so A->B and B->A share one entry; the path is stored from the
+lower-sorting station and reversed on the way out.
+
+Requests are also counted per pair (RoutePopularity) so that the most
+popular pairs can be warmed whenever a process sees a new graph version.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import F
+
+import dijkstras
+import metrics
+from dijkstras import reverse_path
+from routefinder.models import RoutePopularity
+
+logger = logging.getLogger(__name__)
+
+# Entries in each process's LRU (0 turns the tier off)
+ROUTE_CACHE_SIZE = getattr(settings, "ROUTE_CACHE_SIZE", 2048)
+
+# CACHES alias shared by all workers, e.g. a Redis or database cache.
+# None keeps results per process.
+ROUTE_CACHE_ALIAS = getattr(settings, "ROUTE_CACHE_ALIAS", None)
+ROUTE_CACHE_TIMEOUT = getattr(settings, "ROUTE_CACHE_TIMEOUT", 24 * 3600)
+
+# Most requested pairs to precompute on a new graph version (0 = no warming
+# and no popularity counting)
+ROUTE_CACHE_WARM_PAIRS = getattr(settings, "ROUTE_CACHE_WARM_PAIRS", 200)
+
+# Popularity counts are batched in memory and written this often
+ROUTE_POPULARITY_FLUSH_SECONDS = getattr(settings, "ROUTE_POPULARITY_FLUSH_SECONDS", 60)
+
+_lock = threading.Lock()
+_local = OrderedDict()
+_local_version = None
+
+
+def _pair(source_node, target_node):
+    """(low, high, reversed) - the undirected key for a query."""
+    if source_node <= target_node:
+        return source_node, target_node, False
+    return target_node, source_node, True
+
+
+def _shared_key(version, low, high):
+    # Hashed: station names may hold characters memcached keys cannot
+    digest = hashlib.sha1(f"{low}\n{high}".encode()).hexdigest()
+    return f"route:{version}:{dijkstras.TRANSFER_PENALTY}:{digest}"
+
+
+def _oriented(result, is_reversed):
+    cost, path = result
+    return (cost, reverse_path(path)) if is_reversed else (cost, path)
+
+
+def get(version, source_node, target_node):
+    """Cached (cost, path_with_routes) for the query, or None."""
+    global _local_version
+    low, high, is_reversed = _pair(source_node, target_node)
+    key = (version, dijkstras.TRANSFER_PENALTY, low, high)
+
+    if ROUTE_CACHE_SIZE:
+        with _lock:
+            if _local_version != version:
+                # Old versions can never be asked for again
+                _local.clear()
+                _local_version = version
+            result = _local.get(key)
+            if result is not None:
+                _local.move_to_end(key)
+        metrics.observe_cache('route_result', result is not None)
+        if result is not None:
+            return _oriented(result, is_reversed)
+
+    if ROUTE_CACHE_ALIAS:
+        try:
+            result = caches[ROUTE_CACHE_ALIAS].get(_shared_key(version, low, high))
+        except Exception as e:
+            logger.warning(f"Shared route cache read failed: {e}")
+            result = None
+        metrics.observe_cache('route_result_shared', result is not None)
+        if result is not None:
+            _put_local(key, result)
+            return _oriented(result, is_reversed)
+    return None
+
+
+def put(version, source_node, target_node, cost, path_with_routes):
+    low, high, is_reversed = _pair(source_node, target_node)
+    result = (cost, reverse_path(path_with_routes) if is_reversed else list(path_with_routes))
+    _put_local((version, dijkstras.TRANSFER_PENALTY, low, high), result)
+    if ROUTE_CACHE_ALIAS:
+        try:
+            caches[ROUTE_CACHE_ALIAS].set(_shared_key(version, low, high), result, ROUTE_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Shared route cache write failed: {e}")
+
+
+def _put_local(key, result):
+    if not ROUTE_CACHE_SIZE:
+        return
+    with _lock:
+        if key[0] != _local_version:
+            return
+        _local[key] = result
+        _local.move_to_end(key)
+        while len(_local) > ROUTE_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def search(snapshot, source_node, target_node, stats=None):
+    """snapshot.search() through the cache. stats['engine'] is 'cache' on a hit."""
+    result = get(snapshot.version, source_node, target_node)
+    if result is not None:
+        if stats is not None:
+            stats['engine'] = 'cache'
+        return result
+    cost, path = snapshot.search(source_node, target_node, stats=stats)
+    put(snapshot.version, source_node, target_node, cost, path)
+    return cost, path
+
+
+def clear():
+    """Empties this process's tier (the shared one expires by version)."""
+    with _lock:
+        _local.clear()
+
+
+# ============================================
+# Popularity and warming
+# ============================================
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_counting = True
+
+
+@contextmanager
+def popularity_paused():
+    """record_query() counts nothing inside the block, e.g. for synthetic load."""
+    global _counting
+    previous = _counting
+    _counting = False
+    try:
+        yield
+    finally:
+        _counting = previous
+
+
+def record_query(source_node, target_node):
+    """Counts one request for the pair; written out every ROUTE_POPULARITY_FLUSH_SECONDS."""
+    global _last_flush
+    if not ROUTE_CACHE_WARM_PAIRS or not _counting:
+        return
+    low, high, _ = _pair(source_node, target_node)
+    with _pending_lock:
+        _pending[(low, high)] += 1
+        if time.monotonic() - _last_flush < ROUTE_POPULARITY_FLUSH_SECONDS:
+            return
+        _last_flush = time.monotonic()
+        counts = dict(_pending)
+        _pending.clear()
+    try:
+        flush_popularity(counts)
+    except Exception as e:
+        logger.error(f"Error saving route popularity: {str(e)}")
+
+
+def flush_popularity(counts):
+    """Adds {(from, to): n} to the RoutePopularity rows."""
+    with transaction.atomic():
+        missing = []
+        for (low, high), n in counts.items():
+            updated = RoutePopularity.objects.filter(from_station=low, to_station=high).update(count=F('count') + n)
+            if not updated:
+                missing.append(RoutePopularity(from_station=low, to_station=high, count=n))
+        # Another worker may insert the same pair first; its count wins
+        RoutePopularity.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+def popular_pairs(limit):
+    return list(RoutePopularity.objects.order_by('-count').values_list('from_station', 'to_station')[:limit])
+
+
+def warm(snapshot, limit=None):
+    """Searches the most popular pairs into the cache. Returns how many were computed."""
+    limit = ROUTE_CACHE_WARM_PAIRS if limit is None else limit
+    computed = 0
+    for low, high in popular_pairs(limit):
+        if low not in snapshot.compact or high not in snapshot.compact:
+            continue
+        if get(snapshot.version, low, high) is None:
+            cost, path = snapshot.search(low, high)
+            put(snapshot.version, low, high, cost, path)
+            computed += 1
+    return computed
+
+
+def _warm_worker(snapshot):
+    started = time.perf_counter()
+    try:
+        computed = warm(snapshot)
+        logger.info(f"Warmed {computed} popular routes for graph version {snapshot.version} "
+                    f"in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Route cache warming failed: {str(e)}", exc_info=True)
+    finally:
+        # This thread's database connection would otherwise stay open
+        connections.close_all()
+
+
+def warm_in_background(snapshot):
+    """Starts warm() on a daemon thread, if warming is on."""
+    if ROUTE_CACHE_WARM_PAIRS and (ROUTE_CACHE_SIZE or ROUTE_CACHE_ALIAS):
+        threading.Thread(target=_warm_worker, args=(snapshot,), daemon=True).start()
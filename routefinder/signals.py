@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from routefinder.models import LineSchedule, Route, Station
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=LineSchedule)
+@receiver(post_delete, sender=LineSchedule)
+def network_changed(sender, **kwargs):
+    """Any Station/Route/LineSchedule change invalidates the graph snapshot everywhere"""
+    # Imported here because transit imports the models module
+    from transit import bump_graph_version
+    bump_graph_version()
@@ -1,3 +1,1010 @@
-from django.test import TestCase
+import csv
+import gc
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+from itertools import permutations
+from unittest import mock, skipIf
 
-# Create your tests here.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django_ratelimit.exceptions import Ratelimited
+
+import benchmarks
+import dijkstras
+import synthetic
+import timing
+import transit
+from alternatives import alternative_routes
+from contraction import build_contraction_hierarchy
+from dijkstras import (astar, compact_dijkstra, dijkstra, multi_source_search, pareto_search, path_cost,
+                       reverse_path)
+from ingest import NetworkImportError, import_network
+from od_matrix import od_rows
+from route_table import RouteTable, build_route_table
+from routefinder import route_cache
+from routefinder.models import LineSchedule, Route, RoutePopularity, Station
+from routefinder.ratelimit import async_ratelimit
+from search_index import StationSearchIndex
+from spatial import KDTree, haversine
+from timetable import raptor
+from transit import (ASTAR_MIN_HEURISTIC_SCALE, build_snapshot, current_graph_version, get_snapshot,
+                     invalidate_snapshot, load_snapshot, normalize, preload_snapshot,
+                     validate_graph_connectivity)
+
+# A small network, about 1 km between neighbours:
+#
+#   Foxtrot --L3-- Golf --L3-- Echo
+#      |                        |
+#     L3                       L2
+#      |                        |
+#    Alpha --L1-- Bravo --L1/L4-- Charlie --L2-- Delta
+#
+# Alpha -> Echo is quickest on L3 alone; Alpha -> Delta needs a change
+# from L1 to L2 at Charlie. Isolated Stop has no routes.
+STATIONS = [
+    (1, "Alpha", 24.900, 67.000),
+    (2, "Bravo", 24.900, 67.010),
+    (3, "Charlie", 24.900, 67.020),
+    (4, "Delta", 24.910, 67.030),
+    (5, "Echo", 24.920, 67.020),
+    (6, "Foxtrot", 24.910, 67.000),
+    (7, "Golf", 24.920, 67.010),
+    (8, "Isolated Stop", 24.950, 67.050),
+]
+ROUTES = [
+    ("L1", 1, 2, 1.2),
+    ("L1", 2, 3, 1.1),
+    ("L4", 2, 3, 1.1),
+    ("L2", 3, 4, 1.3),
+    ("L2", 4, 5, 1.2),
+    ("L3", 1, 6, 1.4),
+    ("L3", 6, 7, 1.5),
+    ("L3", 7, 5, 1.3),
+]
+
+
+def connected_pairs(snapshot):
+    names = sorted(name for name, neighbors in snapshot.graph.items() if neighbors)
+    return list(permutations(names, 2))
+
+
+class NetworkTestCase(TestCase):
+    """The fixture network in the database, with a fresh snapshot per test."""
+
+    @classmethod
+    def setUpTestData(cls):
+        stations = {}
+        for station_id, name, lat, lng in STATIONS:
+            stations[station_id] = Station.objects.create(station_id=station_id, station_name=name, lat=lat, lng=lng)
+        for route_id, from_id, to_id, km in ROUTES:
+            Route.objects.create(route_id=route_id, from_station=stations[from_id],
+                                 to_station=stations[to_id], distance_kms=km)
+
+    def setUp(self):
+        invalidate_snapshot()
+        route_cache.clear()
+
+
+@override_settings(RATELIMIT_ENABLE=False)
+class SnapshotTests(NetworkTestCase):
+    def test_snapshot_reads_network(self):
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot.graph["Alpha"], {"Bravo": 1.2, "Foxtrot": 1.4})
+        self.assertEqual(sorted(snapshot.route_info["Bravo"]["Charlie"]), ["L1", "L4"])
+        self.assertEqual(snapshot.graph["Isolated Stop"], {})
+        self.assertEqual(snapshot.coords["Golf"], {"lat": 24.92, "lng": 67.01})
+        self.assertIs(get_snapshot(), snapshot)
+
+    def test_network_change_bumps_version(self):
+        snapshot = get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            Station.objects.create(station_id=9, station_name="Hotel", lat=24.93, lng=67.0)
+        self.assertEqual(current_graph_version(), snapshot.version + 1)
+        rebuilt = get_snapshot()
+        self.assertEqual(rebuilt.version, snapshot.version + 1)
+        self.assertIn("Hotel", rebuilt.graph)
+        self.assertNotIn("Hotel", snapshot.graph)
+
+    def test_map_apis(self):
+        self.assertEqual(len(self.client.get("/api/stations/").json()), len(STATIONS))
+        self.assertEqual(len(self.client.get("/api/routes/").json()), len(ROUTES))
+
+    def test_station_search(self):
+        self.assertEqual(self.client.get("/stations/", {"q": "ech"}).json(), ["Echo"])
+        self.assertEqual(len(self.client.get("/stations/").json()), len(STATIONS))
+
+    def test_nearest_stations_api(self):
+        body = {"points": [[24.9201, 67.0101], {"lat": 24.9, "lng": 67.0}], "k": 2}
+        response = self.client.post("/api/nearest-stations/", json.dumps(body), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        golf, alpha = response.json()['results']
+        self.assertEqual([match['station_name'] for match in golf], ["Golf", "Echo"])
+        self.assertEqual(alpha[0], {"station_id": 1, "station_name": "Alpha", "distance_km": 0.0})
+
+    def test_nearest_stations_bad_requests(self):
+        for body in ({"points": []}, {"points": [[24.9, 67.0]], "k": 11},
+                     {"points": [[24.9, 67.0]], "max_radius_km": -1}, {"points": [[124.9, 67.0]]},
+                     {"points": [["x", 67.0]]}):
+            response = self.client.post("/api/nearest-stations/", json.dumps(body),
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_find_route_page(self):
+        response = self.client.post("/find_route", {"fromStation": "Alpha", "toStation": "Delta"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['path'], ["Alpha", "Bravo", "Charlie", "Delta"])
+        self.assertEqual(response.context['routes_used'], ["L1", "L2"])
+        self.assertEqual(response.context['total_distance'], 3.6)
+        # Leaving now is opt-in
+        self.assertIsNone(response.context['arrival'])
+        # Nothing to trade off: no other trip has fewer transfers
+        self.assertEqual(response.context['route_options'], [])
+        self.assertEqual([alternative['path'] for alternative in response.context['route_alternatives']],
+                         [["Alpha", "Foxtrot", "Golf", "Echo", "Delta"]])
+
+    def test_find_route_options(self):
+        # A direct but longer line: shortest distance and fewest transfers part ways
+        Route.objects.create(route_id="L5", from_station_id=1, to_station_id=4, distance_kms=5.0)
+        invalidate_snapshot()
+        response = self.client.post("/find_route", {"fromStation": "Alpha", "toStation": "Delta"})
+        options = response.context['route_options']
+        self.assertEqual([(o['distance'], o['transfers'], o['routes']) for o in options],
+                         [(1.2 + 1.1 + 1.3, 1, ["L1", "L2"]), (5.0, 0, ["L5"])])
+        # The transfer penalty outweighs 1.4 km more on the bus
+        self.assertEqual([option['label'] for option in options], ["Shortest distance", "Fastest"])
+
+    def test_find_route_leaves_now(self):
+        with mock.patch("routefinder.views.minutes_now", return_value=8 * 60):
+            response = self.client.post("/find_route", {"fromStation": "Alpha", "toStation": "Echo",
+                                                        "depart": "now"})
+        self.assertEqual(response.context['departure'], "08:00")
+        self.assertEqual([leg['route_id'] for leg in response.context['legs']], ["L3"])
+        self.assertGreater(response.context['arrival'], "08:00")
+        # Distance-model options and alternatives would disagree with the times
+        self.assertEqual((response.context['route_options'], response.context['route_alternatives']), ([], []))
+
+    def test_find_route_after_last_bus(self):
+        with mock.patch("routefinder.views.minutes_now", return_value=23 * 60 + 59):
+            response = self.client.post("/find_route", {"fromStation": "Alpha", "toStation": "Echo",
+                                                        "depart": "now"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['path'], ["Alpha", "Foxtrot", "Golf", "Echo"])
+        self.assertIsNone(response.context['departure'])
+        self.assertEqual(response.context['legs'], [])
+
+    def test_find_route_from_coordinates(self):
+        response = self.client.post("/find_route", {
+            "fromStation": "My location", "from_type": "coordinate", "from_lat": "24.9201", "from_lng": "67.0101",
+            "toStation": "Echo"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['from_station'], "Golf")
+        self.assertGreater(response.context['walk_data']['start_dist'], 0)
+
+
+    def test_prebuilt_snapshot_file(self):
+        version = current_graph_version()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph_snapshot.pkl")
+            call_command("build_graph_snapshot", output=path, stdout=io.StringIO())
+            loaded = load_snapshot(path)
+            self.assertEqual(loaded.version, version)
+            self.assertEqual(loaded.stations_json, build_snapshot(version).stations_json)
+
+            self.addCleanup(gc.unfreeze)
+            with mock.patch("transit.GRAPH_SNAPSHOT_FILE", path):
+                self.assertTrue(preload_snapshot())
+            # Current file: the first poll keeps it instead of rebuilding
+            with mock.patch("transit.build_snapshot") as build:
+                self.assertEqual(get_snapshot().version, version)
+            build.assert_not_called()
+
+    def test_stale_prebuilt_snapshot_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph_snapshot.pkl")
+            call_command("build_graph_snapshot", output=path, stdout=io.StringIO())
+            self.addCleanup(gc.unfreeze)
+            with mock.patch("transit.GRAPH_SNAPSHOT_FILE", path):
+                self.assertTrue(preload_snapshot())
+        version = current_graph_version() + 1
+        with mock.patch("transit.current_graph_version", return_value=version):
+            self.assertEqual(get_snapshot().version, version)
+
+    def test_unreadable_snapshot_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph_snapshot.pkl")
+            self.assertIsNone(load_snapshot(path))
+            with open(path, "wb") as f:
+                f.write(b"not a pickle")
+            with self.assertLogs("transit", "WARNING"):
+                self.assertIsNone(load_snapshot(path))
+
+class SearchTests(NetworkTestCase):
+    """Every search engine against the reference dijkstra() on the fixture network."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.snapshot = build_snapshot()
+        cls.cg = cls.snapshot.compact
+        cls.pairs = connected_pairs(cls.snapshot)
+        cls.expected = {
+            (a, b): dijkstra(cls.snapshot.graph, cls.snapshot.route_info, a, b)[0] for a, b in cls.pairs
+        }
+
+    def assertSameCost(self, engine, cost, path, pair):
+        self.assertAlmostEqual(cost, self.expected[pair], msg=f"{engine} {pair}")
+        self.assertAlmostEqual(path_cost(path), cost, msg=f"{engine} path {pair}")
+        self.assertEqual((path[0].station, path[-1].station), pair)
+
+    def test_known_trip(self):
+        cost, path = compact_dijkstra(self.cg, "Alpha", "Delta")
+        self.assertAlmostEqual(cost, 1.2 + 1.1 + 1.3 + dijkstras.TRANSFER_PENALTY)
+        self.assertEqual([step.station for step in path], ["Alpha", "Bravo", "Charlie", "Delta"])
+        self.assertEqual([step.route for step in path[1:]], ["L1", "L1", "L2"])
+        self.assertEqual(sum(step.is_transfer for step in path), 1)
+
+    def test_dijkstra_path_steps(self):
+        cost, path = dijkstra(self.snapshot.graph, self.snapshot.route_info, "Alpha", "Delta")
+        self.assertEqual([step.station for step in path], ["Alpha", "Bravo", "Charlie", "Delta"])
+        self.assertEqual([step.distance_from_prev for step in path[1:]], [1.2, 1.1, 1.3])
+        self.assertEqual([step.is_transfer for step in path], [False, False, False, True])
+        self.assertAlmostEqual(cost, sum(step.distance_from_prev + step.transfer_penalty for step in path))
+
+    def test_compact_dijkstra_matches_dijkstra(self):
+        for pair in self.pairs:
+            self.assertSameCost("compact_dijkstra", *compact_dijkstra(self.cg, *pair), pair)
+
+    def test_astar_matches_dijkstra(self):
+        for pair in self.pairs:
+            self.assertSameCost("astar", *astar(self.cg, *pair), pair)
+
+    def test_snapshot_search(self):
+        # Fixture distances are close to the straight line, so A* is used
+        self.assertGreaterEqual(self.cg.heuristic_scale, ASTAR_MIN_HEURISTIC_SCALE)
+        for pair in self.pairs:
+            stats = {}
+            self.assertSameCost("search", *self.snapshot.search(*pair, stats=stats), pair)
+            self.assertEqual(stats['engine'], "astar")
+
+    def test_route_table_matches_dijkstra(self):
+        table = build_route_table(self.cg, version=1, processes=1)
+        self.assertTrue(table.matches(1, self.cg))
+        self.assertFalse(table.matches(2, self.cg))
+        for pair in self.pairs:
+            self.assertSameCost("route_table", *table.lookup(self.cg, *pair), pair)
+        self.assertEqual(table.lookup(self.cg, "Alpha", "Isolated Stop"), (float("inf"), []))
+        self.assertIsNone(table.lookup(self.cg, "Alpha", "Nowhere"))
+
+    def test_route_table_round_trip(self):
+        table = build_route_table(self.cg, version=1, processes=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "route_table_v1.pkl")
+            table.save(path)
+            loaded = RouteTable.load(path)
+        self.assertTrue(loaded.matches(1, self.cg))
+        self.assertEqual(loaded.lookup(self.cg, "Alpha", "Delta"), table.lookup(self.cg, "Alpha", "Delta"))
+
+    def test_contraction_hierarchy_matches_dijkstra(self):
+        hierarchy = build_contraction_hierarchy(self.cg)
+        self.assertTrue(hierarchy.matches(self.cg))
+        for pair in self.pairs:
+            self.assertSameCost("contraction", *hierarchy.search(self.cg, *pair), pair)
+        self.assertEqual(hierarchy.search(self.cg, "Alpha", "Isolated Stop")[0], float("inf"))
+
+    def test_contraction_hierarchy_matches_only_its_graph(self):
+        hierarchy = build_contraction_hierarchy(self.cg)
+        # Same layout, one distance changed
+        routes = [(route_id, a, b, km + 0.5 if (a, b) == (3, 4) else km) for route_id, a, b, km in ROUTES]
+        other = benchmarks.Network("changed", STATIONS, routes).snapshot().compact
+        self.assertEqual(other.num_states, self.cg.num_states)
+        self.assertFalse(hierarchy.matches(other))
+        with mock.patch("dijkstras.TRANSFER_PENALTY", dijkstras.TRANSFER_PENALTY + 1):
+            self.assertFalse(hierarchy.matches(self.cg))
+
+    def test_snapshot_search_with_contraction(self):
+        with mock.patch("transit.CONTRACTION_HIERARCHY", True), mock.patch("threading.Thread") as thread:
+            snapshot = get_snapshot()
+        # Contracted off the request path
+        self.assertIsNone(snapshot.contraction)
+        started = [call.kwargs for call in thread.call_args_list
+                   if call.kwargs.get('target') is transit._autobuild_contraction]
+        self.assertEqual(started, [{'target': transit._autobuild_contraction, 'args': (snapshot,), 'daemon': True}])
+        transit._autobuild_contraction(snapshot)
+
+        stats = {}
+        self.assertSameCost("snapshot", *snapshot.search("Alpha", "Delta", stats=stats), ("Alpha", "Delta"))
+        self.assertEqual(stats['engine'], "contraction")
+
+    def test_multi_source_search(self):
+        # Walking to Golf first beats riding all the way from Alpha
+        cost, path, source, target = multi_source_search(self.cg, {"Alpha": 0, "Golf": 0.5}, {"Echo": 0})
+        self.assertEqual((source, target), ("Golf", "Echo"))
+        self.assertAlmostEqual(cost, 0.5 + 1.3)
+        self.assertEqual([step.station for step in path], ["Golf", "Echo"])
+
+    def test_search_multi_with_route_table(self):
+        snapshot = build_snapshot()
+        queries = [({"Alpha": 0, "Golf": 0.5}, {"Echo": 0}),
+                   ({"Bravo": 1.0, "Foxtrot": 0.2}, {"Delta": 0.3, "Echo": 2.0})]
+        expected = [snapshot.search_multi(sources, targets) for sources, targets in queries]
+        snapshot.route_table = build_route_table(snapshot.compact, snapshot.version, processes=1)
+        for (sources, targets), (cost, path, source, target) in zip(queries, expected):
+            stats = {}
+            result = snapshot.search_multi(sources, targets, stats=stats)
+            self.assertTrue(stats['table_hit'])
+            self.assertAlmostEqual(result[0], cost)
+            self.assertEqual(result[2:], (source, target))
+            self.assertEqual([step.station for step in result[1]], [step.station for step in path])
+
+    def test_alternatives(self):
+        # Round by Foxtrot, Golf and Echo instead of via Bravo and Charlie
+        routes = alternative_routes(self.cg, "Alpha", "Delta", max_alternatives=2)
+        best_cost, best_path, via = routes[0]
+        self.assertIsNone(via)
+        self.assertAlmostEqual(best_cost, self.expected["Alpha", "Delta"])
+        self.assertGreater(len(routes), 1)
+        for cost, path, via in routes[1:]:
+            stations = [step.station for step in path]
+            self.assertEqual(len(stations), len(set(stations)))
+            self.assertIn(via, stations)
+            self.assertGreaterEqual(cost, best_cost)
+            self.assertAlmostEqual(path_cost(path), cost)
+
+    def test_alternatives_from_route_table(self):
+        table = build_route_table(self.cg, self.snapshot.version, processes=1)
+        expected = alternative_routes(self.cg, "Alpha", "Delta", max_alternatives=2)
+        routes = alternative_routes(self.cg, "Alpha", "Delta", max_alternatives=2, trees=table)
+        self.assertEqual([(round(cost, 6), [step.station for step in path]) for cost, path, _ in routes],
+                         [(round(cost, 6), [step.station for step in path]) for cost, path, _ in expected])
+
+    def test_raptor(self):
+        eight = 8 * 60
+        arrival, legs, source, target = raptor(self.snapshot.timetable, {"Alpha": 0}, {"Echo": 0}, eight)
+        self.assertEqual((source, target), ("Alpha", "Echo"))
+        self.assertEqual([leg.route for leg in legs], ["L3"])
+        self.assertGreaterEqual(legs[0].departure, eight)
+        self.assertEqual(arrival, legs[-1].arrival)
+
+        arrival, legs, _, _ = raptor(self.snapshot.timetable, {"Alpha": 0}, {"Delta": 0}, eight)
+        self.assertEqual([leg.route for leg in legs], ["L1", "L2"])
+        self.assertGreaterEqual(legs[1].departure, legs[0].arrival)
+
+    def test_raptor_after_last_bus(self):
+        arrival, legs, _, _ = raptor(self.snapshot.timetable, {"Alpha": 0}, {"Echo": 0}, 23 * 60 + 59)
+        self.assertEqual((arrival, legs), (float("inf"), []))
+
+    def test_pareto_options(self):
+        options = pareto_search(self.cg, "Alpha", "Echo")
+        self.assertAlmostEqual(min(d + t * dijkstras.TRANSFER_PENALTY for d, t, _ in options),
+                               self.expected["Alpha", "Echo"])
+        for distance, transfers, path in options:
+            self.assertAlmostEqual(sum(step.distance_from_prev for step in path), distance)
+            self.assertEqual(sum(step.is_transfer for step in path), transfers)
+            # None is dominated by another
+            self.assertFalse(any(d <= distance and t <= transfers and (d, t) != (distance, transfers)
+                                 for d, t, _ in options))
+
+    def test_od_matrix_matches_dijkstra(self):
+        index = self.cg.station_index
+        rows = dict(od_rows(self.cg, processes=1))
+        for a, b in self.pairs:
+            self.assertAlmostEqual(rows[index[a]][2][index[b]], self.expected[a, b], msg=f"od_matrix {a, b}")
+        distance, transfers, cost, routes = rows[index["Alpha"]]
+        self.assertAlmostEqual(distance[index["Delta"]], 1.2 + 1.1 + 1.3)
+        self.assertEqual(transfers[index["Delta"]], 1)
+        self.assertEqual([self.cg.route_ids[r] for r in routes[index["Delta"]]], ["L1", "L2"])
+        self.assertEqual((transfers[index["Isolated Stop"]], routes[index["Isolated Stop"]]), (-1, None))
+
+    def test_od_matrix_processes_agree(self):
+        self.assertEqual(list(od_rows(self.cg, processes=2)), list(od_rows(self.cg, processes=1)))
+
+    def test_export_od_matrix_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "od.csv")
+            call_command("export_od_matrix", path, processes=1, stdout=io.StringIO())
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        # Every ordered pair of the seven connected stations
+        self.assertEqual(len(rows), 7 * 6)
+        row = next(row for row in rows if (row['from_station'], row['to_station']) == ("Alpha", "Delta"))
+        self.assertEqual((row['distance_km'], row['transfers'], row['routes']), ("3.600", "1", "L1>L2"))
+
+    @skipIf(np is None, "numpy is not installed")
+    def test_export_od_matrix_npz(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "od.npz")
+            call_command("export_od_matrix", path, processes=1, stdout=io.StringIO())
+            with np.load(path) as matrices:
+                distance = matrices['distance_km']
+                stations = list(matrices['stations'])
+        self.assertEqual(distance.shape, (len(STATIONS), len(STATIONS)))
+        self.assertAlmostEqual(float(distance[stations.index("Alpha"), stations.index("Delta")]), 3.6, places=5)
+
+    def test_unreachable_station(self):
+        self.assertEqual(compact_dijkstra(self.cg, "Alpha", "Isolated Stop"), (float("inf"), []))
+        self.assertEqual(astar(self.cg, "Alpha", "Isolated Stop")[0], float("inf"))
+
+    def test_unknown_station(self):
+        with self.assertRaises(ValueError):
+            compact_dijkstra(self.cg, "Alpha", "Nowhere")
+
+
+class RouteCacheTests(NetworkTestCase):
+    def test_reverse_path(self):
+        cg = build_snapshot().compact
+        cost, path = compact_dijkstra(cg, "Alpha", "Delta")
+        back_cost, back = compact_dijkstra(cg, "Delta", "Alpha")
+        reversed_path = reverse_path(path)
+        self.assertEqual([(s.station, s.route, s.is_transfer) for s in reversed_path],
+                         [(s.station, s.route, s.is_transfer) for s in back])
+        self.assertAlmostEqual(path_cost(reversed_path), back_cost)
+        self.assertEqual(reverse_path([]), [])
+
+    def test_search_is_cached_both_ways(self):
+        snapshot = get_snapshot()
+        stats = {}
+        cost, path = route_cache.search(snapshot, "Alpha", "Delta", stats=stats)
+        self.assertNotEqual(stats['engine'], "cache")
+
+        stats = {}
+        self.assertEqual(route_cache.search(snapshot, "Alpha", "Delta", stats=stats), (cost, path))
+        self.assertEqual(stats['engine'], "cache")
+
+        stats = {}
+        back_cost, back = route_cache.search(snapshot, "Delta", "Alpha", stats=stats)
+        self.assertEqual(stats['engine'], "cache")
+        self.assertAlmostEqual(back_cost, cost)
+        self.assertEqual([step.station for step in back], [step.station for step in reversed(path)])
+
+    def test_new_version_misses(self):
+        snapshot = get_snapshot()
+        result = route_cache.search(snapshot, "Alpha", "Echo")
+        self.assertEqual(route_cache.get(snapshot.version, "Alpha", "Echo"), result)
+        self.assertIsNone(route_cache.get(snapshot.version + 1, "Alpha", "Echo"))
+        # The old version's entries are gone once a new one is seen
+        self.assertIsNone(route_cache.get(snapshot.version, "Alpha", "Echo"))
+
+    def test_popular_pairs_are_warmed(self):
+        route_cache.flush_popularity({("Alpha", "Delta"): 2})
+        route_cache.flush_popularity({("Alpha", "Delta"): 1})
+        self.assertEqual(list(RoutePopularity.objects.values_list("from_station", "to_station", "count")),
+                         [("Alpha", "Delta", 3)])
+
+        snapshot = build_snapshot()
+        self.assertEqual(route_cache.warm(snapshot), 1)
+        self.assertIsNotNone(route_cache.get(snapshot.version, "Delta", "Alpha"))
+        self.assertEqual(route_cache.warm(snapshot), 0)
+
+
+@override_settings(RATELIMIT_ENABLE=False)
+class RouteApiTests(NetworkTestCase):
+    def test_route(self):
+        response = self.client.get("/api/route/", {"from": "alpha", "to": "delta"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['from_station'], data['to_station']), ("Alpha", "Delta"))
+        # Kilometres travelled; the transfer penalty is not distance
+        self.assertEqual(data['distance_km'], 3.6)
+        self.assertEqual(data['transfers'], 1)
+        self.assertEqual([segment['route_id'] for segment in data['segments']], ["L1", "L2"])
+        self.assertEqual([segment['distance_km'] for segment in data['segments']], [2.3, 1.3])
+        self.assertEqual(data['num_stations'], 4)
+        self.assertIn("public", response["Cache-Control"])
+
+    def test_route_server_timing(self):
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "Delta"})
+        phases = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        for name in ("snapshot", "graph_build", "resolve", "search", "segments", "encode", "total"):
+            self.assertIn(name, phases)
+
+    def test_route_conditional_get(self):
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "Delta"})
+        again = self.client.get("/api/route/", {"from": "Alpha", "to": "Delta"},
+                                HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+    def test_route_resolves_partial_names(self):
+        data = self.client.get("/api/route/", {"from": "alph", "to": "Foxtrott"}).json()
+        self.assertEqual((data['from_station'], data['to_station']), ("Alpha", "Foxtrot"))
+
+    def test_route_departure(self):
+        data = self.client.get("/api/route/", {"from": "Alpha", "to": "Echo", "depart": "08:00"}).json()
+        self.assertEqual(data['departure'], "08:00")
+        self.assertEqual([leg['route_id'] for leg in data['legs']], ["L3"])
+        self.assertNotIn("alternatives", data)
+
+        # L3 not running yet: change at Charlie instead of waiting for it
+        with self.captureOnCommitCallbacks(execute=True):
+            LineSchedule.objects.create(route_id="L3", headway_minutes=10, first_departure="09:00",
+                                        last_departure="22:00")
+        data = self.client.get("/api/route/", {"from": "Alpha", "to": "Echo", "depart": "08:00"}).json()
+        self.assertEqual([leg['route_id'] for leg in data['legs']], ["L1", "L2"])
+
+    def test_route_no_service(self):
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "Echo", "depart": "23:59"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("No buses", response.json()['error'])
+
+    def test_route_alternatives(self):
+        data = self.client.get("/api/route/", {"from": "Alpha", "to": "Delta", "alternatives": 2}).json()
+        self.assertEqual(len(data['alternatives']), 1)
+        alternative = data['alternatives'][0]
+        self.assertAlmostEqual(alternative['distance_km'], 1.4 + 1.5 + 1.3 + 1.2)
+        self.assertEqual(alternative['num_stations'], 5)
+        self.assertEqual([segment['route_id'] for segment in alternative['segments']], ["L3", "L2"])
+        self.assertNotIn("alternatives", self.client.get("/api/route/", {"from": "Alpha", "to": "Delta"}).json())
+
+    def test_route_bad_requests(self):
+        for params in ({"from": "Alpha"}, {"from_lat": "x", "from_lng": "1", "to": "Echo"},
+                       {"from_lat": "91", "from_lng": "67", "to": "Echo"},
+                       {"from": "Alpha", "to": "Echo", "alternatives": 9},
+                       {"from": "Alpha", "to": "Echo", "alternatives": "two"},
+                       {"from": "Alpha", "to": "Echo", "depart": "25:00"}):
+            response = self.client.get("/api/route/", params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn("error", response.json())
+
+    def test_route_not_found(self):
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "Nowhere"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("not found", response.json()['error'])
+
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "Isolated Stop"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("No route found", response.json()['error'])
+
+    def test_route_ambiguous_name_suggests(self):
+        # 'o' could be many stations, so it is not guessed
+        response = self.client.get("/api/route/", {"from": "Alpha", "to": "o"})
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(response.json()['suggestions'])
+
+    def test_route_from_coordinates(self):
+        data = self.client.get("/api/route/", {"from_lat": "24.9201", "from_lng": "67.0101",
+                                               "to": "Echo"}).json()
+        self.assertEqual(data['from_station'], "Golf")
+        self.assertGreater(data['walk']['start']['distance_km'], 0)
+        self.assertEqual(data['walk']['start']['lat'], 24.9201)
+
+    @override_settings(DEBUG=True)
+    def test_metrics(self):
+        self.client.get("/api/route/", {"from": "Alpha", "to": "Delta"})
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('manzil_search_seconds_count{engine="astar"}', body)
+        self.assertIn('manzil_route_transfers_bucket{le="1"}', body)
+        self.assertIn("manzil_graph_stations 8", body)
+
+    def test_metrics_token(self):
+        with mock.patch("routefinder.views.METRICS_TOKEN", "secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+    def test_metrics_closed_without_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    def test_batch(self):
+        body = {"pairs": [{"from": "Alpha", "to": "Delta"}, {"from": "Alpha", "to": "Echo"},
+                          {"from": "Alpha", "to": "Nowhere"}, "bad"],
+                "include_path": True}
+        response = self.client.post("/api/route/batch/", json.dumps(body), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual([row.get('index') for row in rows[:4]], [0, 1, 2, 3])
+        self.assertEqual(rows[0]['routes'], ["L1", "L2"])
+        self.assertEqual(rows[0]['path'], ["Alpha", "Bravo", "Charlie", "Delta"])
+        self.assertEqual(rows[0]['distance_km'], 3.6)
+        self.assertEqual(rows[1]['routes'], ["L3"])
+        self.assertIn("error", rows[2])
+        self.assertIn("suggestions", rows[2])
+        self.assertIn("error", rows[3])
+        # Both trips from Alpha share one search tree
+        self.assertEqual((rows[4]['done'], rows[4]['count'], rows[4]['trees_computed']), (True, 4, 1))
+
+    def test_batch_bad_requests(self):
+        for body in ("not json", json.dumps({"pairs": []}), json.dumps({"pairs": {}})):
+            response = self.client.post("/api/route/batch/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400, body)
+
+
+@override_settings(RATELIMIT_ENABLE=False)
+class AsyncViewTests(NetworkTestCase):
+    async def test_async_views(self):
+        response = await self.async_client.get("/stations/", {"q": "ech"})
+        self.assertEqual(response.json(), ["Echo"])
+        response = await self.async_client.get("/api/stations/")
+        self.assertEqual(len(response.json()), len(STATIONS))
+        response = await self.async_client.get("/api/routes/")
+        self.assertEqual(len(response.json()), len(ROUTES))
+
+    async def test_batch_streams_under_asgi(self):
+        body = {"pairs": [{"from": "Alpha", "to": "Delta"}] * 3}
+        response = await self.async_client.post("/api/route/batch/", json.dumps(body),
+                                                content_type="application/json")
+        self.assertTrue(response.is_async)
+        rows = [json.loads(line) for line in
+                b"".join([chunk async for chunk in response.streaming_content]).splitlines()]
+        self.assertEqual([row.get('routes') for row in rows[:3]], [["L1", "L2"]] * 3)
+        self.assertEqual((rows[3]['done'], rows[3]['count']), (True, 3))
+
+
+class AsyncRatelimitTests(SimpleTestCase):
+    @override_settings(RATELIMIT_ENABLE=True)
+    async def test_blocks_over_the_limit(self):
+        @async_ratelimit(key="ip", rate="2/m", method="GET", block=True)
+        async def view(request):
+            return JsonResponse({})
+
+        factory = RequestFactory()
+        for _ in range(2):
+            response = await view(factory.get("/", REMOTE_ADDR="10.1.2.3"))
+            self.assertEqual(response.status_code, 200)
+        with self.assertRaises(Ratelimited):
+            await view(factory.get("/", REMOTE_ADDR="10.1.2.3"))
+        # Other clients have their own budget
+        self.assertEqual((await view(factory.get("/", REMOTE_ADDR="10.9.9.9"))).status_code, 200)
+
+    async def test_checks_off_the_thread_sensitive_executor(self):
+        threads = []
+
+        def is_ratelimited(**kwargs):
+            threads.append(threading.current_thread())
+            return False
+
+        @async_ratelimit(key="ip", rate="2/m")
+        async def view(request):
+            return JsonResponse({})
+
+        with mock.patch("routefinder.ratelimit.is_ratelimited", is_ratelimited):
+            await view(RequestFactory().get("/"))
+        # Thread-sensitive sync code runs on the main thread here
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+class StationSearchIndexTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        names = ["Malir 15", "Malir Halt", "Drigh Road", "Jehangir Road", "Safoora",
+                 "Numaish Chowrangi", "Nagan Chowrangi", "Tower", "Clock Tower"]
+        cls.index = StationSearchIndex([(name, normalize(name)) for name in names])
+
+    def test_search_ranks_prefixes_first(self):
+        self.assertEqual(self.index.search("malir")[:2], ["Malir 15", "Malir Halt"])
+        self.assertEqual(self.index.search("tower")[:2], ["Tower", "Clock Tower"])
+        self.assertEqual(self.index.search("chowrangi"), ["Nagan Chowrangi", "Numaish Chowrangi"])
+
+    def test_search_finds_typos(self):
+        self.assertEqual(self.index.search("Numaish Chowrangee")[0], "Numaish Chowrangi")
+
+    def test_empty_query_lists_first_stations(self):
+        self.assertEqual(self.index.search("", limit=2), ["Malir 15", "Malir Halt"])
+
+    def test_resolve_exact_and_unique(self):
+        self.assertEqual(self.index.resolve("tower"), "Tower")
+        self.assertEqual(self.index.resolve("drigh"), "Drigh Road")
+        self.assertEqual(self.index.resolve("numaish"), "Numaish Chowrangi")
+        self.assertEqual(self.index.resolve("Safora"), "Safoora")
+        self.assertEqual(self.index.resolve("Numaish Chowrangee"), "Numaish Chowrangi")
+
+    def test_resolve_refuses_ambiguous_or_weak_matches(self):
+        for query in ("malir", "road", "foo", "a", "zzz", ""):
+            self.assertIsNone(self.index.resolve(query), query)
+
+
+class IngestTests(TestCase):
+    def write_files(self, directory, stations=STATIONS, routes=ROUTES):
+        stations_path = os.path.join(directory, "stations.txt")
+        routes_path = os.path.join(directory, "routes.txt")
+        with open(stations_path, "w", encoding="utf-8") as f:
+            f.write("station_id,station_name,lat,lng\n")
+            f.writelines(f"{row[0]},{row[1]},{row[2]},{row[3]}\n" for row in stations)
+        with open(routes_path, "w", encoding="utf-8") as f:
+            f.write("route_id,from_station_id,to_station_id,distance_kms\n")
+            f.writelines(f"{row[0]},{row[1]},{row[2]},{row[3]}\n" for row in routes)
+        return stations_path, routes_path
+
+    def tables(self):
+        return (sorted(Station.objects.values_list("station_id", "station_name", "lat", "lng")),
+                sorted(Route.objects.values_list("route_id", "from_station_id", "to_station_id", "distance_kms")))
+
+    def test_import_is_idempotent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.write_files(directory)
+            counts = import_network(*paths)
+            first = self.tables()
+            again = import_network(*paths)
+        self.assertEqual((counts['stations'], counts['routes']), (len(STATIONS), len(ROUTES)))
+        self.assertEqual((again['stations_deleted'], again['routes_deleted']), (0, 0))
+        self.assertEqual(self.tables(), first)
+        self.assertEqual(len(first[1]), len(ROUTES))
+
+    def test_removed_rows_are_deleted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            import_network(*self.write_files(directory))
+            counts = import_network(*self.write_files(directory, STATIONS[:-1], ROUTES[:-1]))
+        self.assertEqual((counts['stations_deleted'], counts['routes_deleted']), (1, 1))
+        self.assertEqual(Station.objects.count(), len(STATIONS) - 1)
+        self.assertEqual(Route.objects.count(), len(ROUTES) - 1)
+
+    def test_dry_run_writes_nothing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            counts = import_network(*self.write_files(directory), dry_run=True)
+        self.assertEqual(counts['stations'], len(STATIONS))
+        self.assertEqual(Station.objects.count(), 0)
+        self.assertEqual(Route.objects.count(), 0)
+
+    def test_invalid_rows_write_nothing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.write_files(directory, routes=ROUTES + [("L9", 1, 99, 1.0), ("L9", 1, 2, "far")])
+            with self.assertRaises(NetworkImportError) as raised:
+                import_network(*paths)
+        self.assertEqual(raised.exception.total, 2)
+        self.assertEqual(Station.objects.count(), 0)
+        self.assertEqual(Route.objects.count(), 0)
+
+
+class BenchmarkTests(NetworkTestCase):
+    def test_network_snapshot_matches_database(self):
+        snapshot = benchmarks.Network("fixture", STATIONS, ROUTES).snapshot()
+        expected = build_snapshot()
+        self.assertEqual(snapshot.graph, expected.graph)
+        self.assertEqual(snapshot.route_info, expected.route_info)
+        self.assertEqual(snapshot.coords, expected.coords)
+
+    def test_run_network(self):
+        results = benchmarks.run_network(benchmarks.Network("fixture", STATIONS, ROUTES), queries=5)
+        self.assertEqual(sorted(results), ["fixture/analyze_route_path", "fixture/compact_graph",
+                                           "fixture/contraction", "fixture/contraction_build",
+                                           "fixture/dijkstra", "fixture/graph_from_rows", "fixture/raptor",
+                                           "fixture/search"])
+        self.assertEqual(results["fixture/search"]['calls'], 5)
+        self.assertGreater(results["fixture/search"]['expanded'], 0)
+        self.assertGreater(results["fixture/search"]['pushed'], 0)
+        # Counts are deterministic for a seed; timings are not
+        again = benchmarks.run_network(benchmarks.Network("fixture", STATIONS, ROUTES), queries=5)
+        self.assertEqual(benchmarks.counts_only(again), benchmarks.counts_only(results))
+
+    @override_settings(ALLOWED_HOSTS=["manzil.example"], SECURE_SSL_REDIRECT=True)
+    def test_run_database(self):
+        with mock.patch("routefinder.route_cache.ROUTE_POPULARITY_FLUSH_SECONDS", 0):
+            results = benchmarks.run_database(queries=5)
+        self.assertEqual(sorted(results), ["db/find_route", "db/transit_map"])
+        self.assertEqual(results["db/find_route"]['calls'], 5)
+        # Benchmark queries are not counted as demand
+        self.assertEqual(RoutePopularity.objects.count(), 0)
+
+    def test_baseline_holds_counts(self):
+        results = {'x/search': {'p50_ms': 1.0, 'alloc_kb': 10.0, 'expanded': 20, 'pushed': 30},
+                   'x/dijkstra': {'p50_ms': 2.0}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            benchmarks.save_baseline(results, {'queries': 5, 'seed': 0}, path)
+            baseline = benchmarks.load_baseline(path)
+        self.assertEqual(baseline, {'params': {'queries': 5, 'seed': 0},
+                                    'results': {'x/search': {'expanded': 20, 'pushed': 30}}})
+        regressions = benchmarks.compare({'x/search': {'p50_ms': 9.0, 'expanded': 20, 'pushed': 31}}, baseline)
+        self.assertEqual([line.split(":")[0] for line in regressions], ["x/search pushed"])
+
+    def test_command_requires_baseline(self):
+        options = {'sizes': "", 'no_files': True, 'no_db': True, 'stdout': io.StringIO()}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            timings = os.path.join(directory, "timings.json")
+            with self.assertRaises(CommandError):
+                call_command("benchmark_routing", baseline=path, timings=timings, **options)
+            call_command("benchmark_routing", baseline=path, timings=timings, save_baseline=True, **options)
+            call_command("benchmark_routing", baseline=path, timings=timings, **options)
+            with self.assertRaises(CommandError):
+                call_command("benchmark_routing", baseline=path, timings=timings, seed=1, **options)
+
+    def test_committed_baseline(self):
+        baseline = benchmarks.load_baseline()
+        self.assertEqual(baseline['params'], {'queries': 100, 'seed': 0})
+        network = benchmarks.read_network_files(os.path.join(settings.BASE_DIR, "stations.txt"),
+                                                os.path.join(settings.BASE_DIR, "routes.txt"))
+        counts = benchmarks.counts_only(benchmarks.run_network(network, queries=100))
+        self.assertEqual(counts, {key: value for key, value in baseline['results'].items()
+                                  if key.startswith("routes.txt/")})
+
+    def test_compare(self):
+        baseline = {'results': {'x/search': {'p50_ms': 1.0, 'alloc_kb': 10.0, 'expanded': 20}}}
+        self.assertEqual(benchmarks.compare({'x/search': {'p50_ms': 1.2, 'alloc_kb': 10.0, 'expanded': 20}},
+                                            baseline), [])
+        regressions = benchmarks.compare({'x/search': {'p50_ms': 2.0, 'alloc_kb': 10.0, 'expanded': 21},
+                                          'y/search': {'p50_ms': 9.0}}, baseline)
+        self.assertEqual([line.split(":")[0] for line in regressions], ["x/search p50_ms", "x/search expanded"])
+        # Sub-MIN_REGRESSION_MS differences are noise
+        self.assertEqual(benchmarks.compare({'x/search': {'p50_ms': 0.04}},
+                                            {'results': {'x/search': {'p50_ms': 0.01}}}), [])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((benchmarks.percentile(values, 50), benchmarks.percentile(values, 99)), (50, 99))
+
+
+class SyntheticNetworkTests(TestCase):
+    SMALL = {"lines": 8, "stops_per_line": 10, "hubs": 3, "corridors": 1, "corridor_stops": 3}
+
+    def test_generate_network_is_seeded(self):
+        first = synthetic.generate_network(**self.SMALL, seed=1)
+        self.assertEqual(synthetic.generate_network(**self.SMALL, seed=1), first)
+        self.assertNotEqual(synthetic.generate_network(**self.SMALL, seed=2), first)
+
+    def test_generated_lines_are_chains(self):
+        for layout in synthetic.LAYOUTS:
+            stations, routes = synthetic.generate_network(**self.SMALL, layout=layout)
+            station_ids = {station_id for station_id, _, _, _ in stations}
+            self.assertEqual(len(station_ids), len(stations), layout)
+            lines = {}
+            for route_id, from_id, to_id, km in routes:
+                self.assertTrue({from_id, to_id} <= station_ids, layout)
+                self.assertGreater(km, 0, layout)
+                lines.setdefault(route_id, []).append((from_id, to_id))
+            self.assertEqual(len(lines), self.SMALL["lines"], layout)
+            for edges in lines.values():
+                # Each line runs terminus to terminus, stop after stop
+                self.assertTrue(all(a[1] == b[0] for a, b in zip(edges, edges[1:])), layout)
+
+    def test_grid_network(self):
+        stations, routes = synthetic.grid_network(400, seed=0)
+        self.assertEqual(len(stations), 400)
+        snapshot = benchmarks.Network("grid", stations, routes).snapshot()
+        self.assertEqual(validate_graph_connectivity(snapshot.graph), [])
+
+    def test_generate_network_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fixture = os.path.join(directory, "network.json")
+            call_command("generate_network", "--output-dir", directory, "--fixture", fixture, "--lines", "6",
+                         "--stops-per-line", "8", "--corridors", "1", stdout=io.StringIO())
+            network = benchmarks.read_network_files(os.path.join(directory, "stations.txt"),
+                                                    os.path.join(directory, "routes.txt"))
+            call_command("loaddata", fixture, verbosity=0)
+        self.assertEqual(Station.objects.count(), len(network.stations))
+        self.assertEqual(Route.objects.count(), len(network.routes))
+
+
+class GridAstarTests(SimpleTestCase):
+    """
+    A* on a synthetic grid, where recorded distances follow the coordinates
+    closely enough for GraphSnapshot.search to pick it (routes.txt does not).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        stations, routes = synthetic.grid_network(400, seed=0)
+        cls.snapshot = benchmarks.Network("grid", stations, routes).snapshot()
+        cls.cg = cls.snapshot.compact
+        names = sorted(cls.snapshot.graph)
+        cls.pairs = [(names[i], names[-1 - i]) for i in range(0, 60, 6)]
+
+    def test_snapshot_uses_astar(self):
+        self.assertGreaterEqual(self.cg.heuristic_scale, ASTAR_MIN_HEURISTIC_SCALE)
+        stats = {}
+        self.snapshot.search(*self.pairs[0], stats=stats)
+        self.assertEqual(stats['engine'], "astar")
+
+    def test_astar_matches_dijkstra_with_fewer_expansions(self):
+        astar_expanded = dijkstra_expanded = 0
+        for pair in self.pairs:
+            astar_stats, dijkstra_stats = {}, {}
+            cost, path = astar(self.cg, *pair, stats=astar_stats)
+            expected, _ = compact_dijkstra(self.cg, *pair, stats=dijkstra_stats)
+            self.assertAlmostEqual(cost, expected, msg=str(pair))
+            self.assertAlmostEqual(path_cost(path), cost, msg=str(pair))
+            astar_expanded += astar_stats['expanded']
+            dijkstra_expanded += dijkstra_stats['expanded']
+        self.assertLess(astar_expanded, dijkstra_expanded)
+
+
+class MissingCoordinatesTests(SimpleTestCase):
+    """
+    A station without coordinates lets the best path beat the straight-line
+    bound: A -> X -> W -> T is 56.2 km, though T is about 111 km from X.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        stations = [(1, "A", 0.0, 0.0), (2, "X", 0.0, -0.5), (3, "W", None, None), (4, "T", 0.0, 1.0)]
+        routes = [("L1", 1, 4, 120.0), ("L2", 1, 2, 56.0), ("L2", 2, 3, 0.1), ("L2", 3, 4, 0.1)]
+        cls.snapshot = benchmarks.Network("missing", stations, routes).snapshot()
+        cls.cg = cls.snapshot.compact
+        cls.source, cls.target = normalize("A"), normalize("T")
+
+    def test_no_heuristic(self):
+        self.assertEqual(self.cg.heuristic_scale, 0)
+        stats = {}
+        cost, path = self.snapshot.search(self.source, self.target, stats=stats)
+        self.assertNotEqual(stats['engine'], "astar")
+        self.assertAlmostEqual(cost, 56.2)
+
+    def test_searches_find_the_short_path(self):
+        expected, _ = compact_dijkstra(self.cg, self.source, self.target)
+        self.assertAlmostEqual(expected, 56.2)
+        self.assertAlmostEqual(astar(self.cg, self.source, self.target)[0], expected)
+        self.assertAlmostEqual(alternative_routes(self.cg, self.source, self.target)[0][0], expected)
+        _, legs, _, _ = raptor(self.snapshot.timetable, {self.source: 0}, {self.target: 0}, 8 * 60)
+        self.assertEqual([leg.route for leg in legs], ["L2"])
+
+
+class TimingTests(SimpleTestCase):
+    def test_phases_outside_a_request_are_no_ops(self):
+        with timing.phase("search") as phase:
+            pass
+        self.assertIs(phase, timing._NULL_PHASE)
+
+    def test_phases_add_up_per_name(self):
+        timings, token = timing.start_request()
+        try:
+            with timing.phase("search"):
+                pass
+            with timing.phase("render"):
+                pass
+            with timing.phase("search"):
+                pass
+        finally:
+            timing.end_request(token)
+        self.assertEqual(list(timings.phases), ["search", "render"])
+        self.assertRegex(timings.header(), r"^search;dur=\d+\.\d\d, render;dur=\d+\.\d\d$")
+        self.assertIs(timing.phase("search"), timing._NULL_PHASE)
+
+
+class KDTreeTests(SimpleTestCase):
+    """Nearest-station queries against a brute-force haversine scan."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(0)
+        cls.points = [(24.8 + rng.random() * 0.3, 66.9 + rng.random() * 0.3) for _ in range(300)]
+        cls.tree = KDTree(cls.points)
+        cls.queries = [(24.8 + rng.random() * 0.3, 66.9 + rng.random() * 0.3) for _ in range(50)]
+
+    def brute_force(self, lat, lng):
+        return sorted((haversine(lat, lng, p_lat, p_lng), i) for i, (p_lat, p_lng) in enumerate(self.points))
+
+    def assertSameMatches(self, found, expected):
+        self.assertEqual([i for _, i in found], [i for _, i in expected])
+        for (distance, _), (expected_distance, _) in zip(found, expected):
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_nearest_matches_brute_force(self):
+        for lat, lng in self.queries:
+            expected = self.brute_force(lat, lng)[:5]
+            self.assertSameMatches(self.tree.nearest(lat, lng, k=5), expected)
+
+    def test_within_radius(self):
+        for lat, lng in self.queries:
+            expected = [i for distance, i in self.brute_force(lat, lng) if distance <= 2.0]
+            self.assertEqual([i for _, i in self.tree.within(lat, lng, 2.0)], expected)
+
+    def test_nearest_many_matches_nearest(self):
+        for k, max_km in ((1, None), (5, None), (300, 2.0)):
+            expected = [self.tree.nearest(lat, lng, k=k, max_km=max_km) for lat, lng in self.queries]
+            for found, want in zip(self.tree.nearest_many(self.queries, k=k, max_km=max_km, chunk_size=16),
+                                   expected):
+                self.assertSameMatches(found, want)
+            # Without numpy it falls back to one KD-tree query per point
+            with mock.patch("spatial.np", None):
+                self.assertEqual(self.tree.nearest_many(self.queries, k=k, max_km=max_km), expected)
+
+    def test_empty_tree(self):
+        self.assertEqual(KDTree([]).nearest(24.9, 67.0), [])
+        self.assertEqual(KDTree([]).nearest_many([(24.9, 67.0)]), [[]])
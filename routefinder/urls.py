@@ -14,6 +14,10 @@ urlpatterns=[
     path('map',views.map_view,name='map'),
     path('api/stations/',views.api_stations,name='api_stations'),
     path('api/routes/',views.api_routes,name='api_routes'),
+    path('api/route/',views.api_route,name='api_route'),
+    path('api/route/batch/',views.api_route_batch,name='api_route_batch'),
+    path('api/nearest-stations/',views.api_nearest_stations,name='api_nearest_stations'),
+    path('metrics',views.metrics_endpoint,name='metrics'),
     
     # Admin routes
     path('manzil-admin/reports', views.admin_reports, name='admin_reports'),
@@ -1,31 +1,55 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime
 from django.contrib import messages
-from routefinder.models import Contact, Contribute, Report, Station, Route
-from dijkstras import dijkstra, analyze_route_path
-from transit import transit_map, normalize
+from routefinder.models import Contact, Contribute, Report
+from transit import aget_snapshot, get_snapshot, normalize
+from timetable import clock, minutes_now
+from route_table import SourceTreeCache
+from timing import phase
+import metrics
+from routefinder.planner import NoServiceError, RoutePlanningError, StationNotFoundError, plan_route
+from routefinder.templatetags.route_properties import get_route_name
 from django_ratelimit.decorators import ratelimit
+from routefinder.ratelimit import async_ratelimit
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_http_methods
-from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import etag, require_http_methods
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from itertools import islice
+import hashlib
+import json
 import re
-import math
 
-# Haversine formula to calculate distance between two lat/lng coordinates in km
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in kilometers
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    lat1 = math.radians(lat1)
-    lat2 = math.radians(lat2)
-    a = math.sin(dLat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dLon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
+# Limits for the batch nearest-station API
+MAX_BATCH_POINTS = getattr(settings, "MAX_BATCH_POINTS", 10000)
+MAX_NEAREST_K = 10
+
+# Limit for the batch routing API
+MAX_BATCH_PAIRS = getattr(settings, "MAX_BATCH_PAIRS", 5000)
+# Under ASGI the batch stream is produced this many lines per thread hop
+BATCH_STREAM_CHUNK = 20
+
+# Most alternative routes /api/route/ returns; find_route shows ROUTE_PAGE_ALTERNATIVES
+MAX_ROUTE_ALTERNATIVES = 3
+ROUTE_PAGE_ALTERNATIVES = getattr(settings, "ROUTE_PAGE_ALTERNATIVES", 2)
+
+# Bearer token Prometheus must send to /metrics. Without one, /metrics is
+# only served while DEBUG is on.
+METRICS_TOKEN = getattr(settings, "METRICS_TOKEN", None)
+
+# How long clients/CDNs may reuse a JSON route answer (seconds). The ETag
+# changes with the graph version, so revalidation is cheap either way.
+ROUTE_API_MAX_AGE = getattr(settings, "ROUTE_API_MAX_AGE", 300)
+# ... except depart=now answers, which change every minute
+ROUTE_API_NOW_MAX_AGE = 60
 
 
 # Input sanitization helper
@@ -156,18 +180,13 @@ def map(request):
     return render(request, 'map.html')
 
 
-@ratelimit(key='ip', rate='30/m', method='GET', block=True)
-def station_search(request):
+@async_ratelimit(key='ip', rate='120/m', method='GET', block=True)
+async def station_search(request):
     """Station search with rate limiting"""
     query = sanitize_input(request.GET.get("q", ""), 100)
     
-    if query:
-        # Use parameterized query to prevent SQL injection
-        stations = Station.objects.filter(station_name__icontains=query)[:10]
-    else:
-        stations = Station.objects.all()[:10]
-
-    results = [s.station_name for s in stations]
+    # Served from the in-memory index - no database query per keystroke
+    results = (await aget_snapshot()).search_index.search(query, limit=10)
     return JsonResponse(results, safe=False)
 
 
@@ -190,140 +209,100 @@ def find_route(request):
         if not from_station_raw or not to_station_raw:
             messages.error(request, "Please enter both start and destination locations.")
             return render(request, "home.html")
+
+        try:
+            depart = _parse_depart(request.POST)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return render(request, "home.html")
             
-        walk_start_distance = 0
-        walk_end_distance = 0
-        from_station = None
-        to_station = None
+        from_point = None
+        to_point = None
         
         try:
-            graph, route_info, routes_per_station = transit_map(debug=False)
-            all_stations = list(Station.objects.filter(lat__isnull=False, lng__isnull=False))
-            
-            if not all_stations:
-                messages.error(request, "No station data available. Please try again later.")
-                return render(request, "home.html")
-
             # --- Resolve FROM Location ---
             if from_type == "coordinate" and from_lat and from_lng:
                 try:
-                    from_lat_f = float(from_lat)
-                    from_lng_f = float(from_lng)
+                    from_point = (float(from_lat), float(from_lng))
                 except ValueError:
                     messages.error(request, "Invalid coordinates for start location.")
                     return render(request, "home.html")
-                closest_start = min(all_stations, key=lambda s: haversine(from_lat_f, from_lng_f, s.lat, s.lng))
-                from_station = normalize(closest_start.station_name)
-                walk_start_distance = haversine(from_lat_f, from_lng_f, closest_start.lat, closest_start.lng)
-            else:
-                from_station = normalize(from_station_raw)
 
             # --- Resolve TO Location ---
             if to_type == "coordinate" and to_lat and to_lng:
                 try:
-                    to_lat_f = float(to_lat)
-                    to_lng_f = float(to_lng)
+                    to_point = (float(to_lat), float(to_lng))
                 except ValueError:
                     messages.error(request, "Invalid coordinates for destination.")
                     return render(request, "home.html")
-                closest_end = min(all_stations, key=lambda s: haversine(to_lat_f, to_lng_f, s.lat, s.lng))
-                to_station = normalize(closest_end.station_name)
-                walk_end_distance = haversine(to_lat_f, to_lng_f, closest_end.lat, closest_end.lng)
-            else:
-                to_station = normalize(to_station_raw)
 
-            # Validate stations exist in graph
-            if from_station not in graph:
-                messages.error(request, f"Start station '{from_station}' not found in transit network.")
+            snapshot = get_snapshot()
+            try:
+                plan = None
+                if depart is not None:
+                    try:
+                        # Timed on the line schedules. The options and
+                        # alternatives come from the distance model and
+                        # would disagree with its times, so none are shown.
+                        plan = plan_route(snapshot, from_station_raw, to_station_raw, from_point, to_point,
+                                          depart_at=depart)
+                    except NoServiceError as e:
+                        messages.info(request, f"{e} Showing the shortest route instead.")
+                if plan is None:
+                    plan = plan_route(snapshot, from_station_raw, to_station_raw, from_point, to_point,
+                                      options=True, alternatives=ROUTE_PAGE_ALTERNATIVES)
+            except RoutePlanningError as e:
+                messages.error(request, str(e))
                 return render(request, "home.html")
             
-            if to_station not in graph:
-                messages.error(request, f"Destination station '{to_station}' not found in transit network.")
-                return render(request, "home.html")
-                
-            if from_station == to_station and walk_start_distance == 0 and walk_end_distance == 0:
-                messages.error(request, "Please select different locations.")
-                return render(request, "home.html")
+            route_segments = plan['route_segments']
+            simple_path = plan['path']
             
-            # Dijkstra Routing
-            cost, path_with_routes = dijkstra(graph, route_info, from_station, to_station, debug=False)
-            
-            if cost == float("inf"):
-                messages.error(request, f"No route found between {from_station} and {to_station}.")
-                return render(request, "home.html")
-            
-            route_segments = analyze_route_path(path_with_routes)
-            num_transfers = max(0, len(route_segments) - 1)
-            simple_path = [station_info['station'] for station_info in path_with_routes]
-            
-            avg_speed_of_bus = 26  # km/h
-            transit_travel_time = (cost / avg_speed_of_bus) * 60
-            
-            avg_walking_speed = 5  # km/h
-            walk_time = ((walk_start_distance + walk_end_distance) / avg_walking_speed) * 60
-            
-            total_time = transit_travel_time + walk_time
-            total_distance = cost + walk_start_distance + walk_end_distance
-            
-            # Fetch coordinates for map rendering
-            # NEW - normalize DB names to match simple_path
-            all_station_objs = Station.objects.filter(lat__isnull=False, lng__isnull=False)
-            coords_dict = {}
-            for s in all_station_objs:
-                normalized = normalize(s.station_name)
-                if normalized in simple_path:
-                   coords_dict[normalized] = {'lat': s.lat, 'lng': s.lng}
-            
-            map_segments = []
-            for segment in route_segments:
-                seg_coords = []
-                for st in segment['stations']:
-                    if st in coords_dict:
-                        seg_coords.append([coords_dict[st]['lat'], coords_dict[st]['lng']])
-                map_segments.append({
-                    'route_id': segment['route_id'],
-                    'coords': seg_coords,
-                    'stations': segment['stations']
-                })
-            
-            import json
-            map_segments_json = json.dumps(map_segments)
-            coords_dict_json = json.dumps(coords_dict)
+            with phase("encode"):
+                map_segments_json = json.dumps(plan['map_segments'])
+                coords_dict_json = json.dumps(plan['coords'])
             
             walk_data = {
-                'start_dist': round(walk_start_distance, 2),
-                'start_time': round((walk_start_distance / avg_walking_speed) * 60),
-                'start_lat': float(from_lat) if from_type == 'coordinate' else None,
-                'start_lng': float(from_lng) if from_type == 'coordinate' else None,
-                'end_dist': round(walk_end_distance, 2),
-                'end_time': round((walk_end_distance / avg_walking_speed) * 60),
-                'end_lat': float(to_lat) if to_type == 'coordinate' else None,
-                'end_lng': float(to_lng) if to_type == 'coordinate' else None,
+                'start_dist': round(plan['walk_start_distance'], 2),
+                'start_time': round(plan['walk_start_time']),
+                'start_lat': from_point[0] if from_point else None,
+                'start_lng': from_point[1] if from_point else None,
+                'end_dist': round(plan['walk_end_distance'], 2),
+                'end_time': round(plan['walk_end_time']),
+                'end_lat': to_point[0] if to_point else None,
+                'end_lng': to_point[1] if to_point else None,
             }
             walk_data_json = json.dumps(walk_data)
             
-            return render(
-                request,
-                "routes.html",
-                {
-                    "from_location_name": from_station_raw,
-                    "to_location_name": to_station_raw,
-                    "from_station": from_station,
-                    "to_station": to_station,
-                    "path": simple_path,
-                    "path_with_routes": path_with_routes,
-                    "route_segments": route_segments,
-                    "total_distance": round(total_distance, 2),
-                    "num_stations": len(simple_path),
-                    "num_transfers": num_transfers,
-                    "travel_time": round(total_time),
-                    "routes_used": [seg['route_id'] for seg in route_segments],
-                    "map_segments_json": map_segments_json,
-                    "coords_dict_json": coords_dict_json,
-                    "walk_data": walk_data,
-                    "walk_data_json": walk_data_json
-                },
-            )
+            with phase("render"):
+                return render(
+                    request,
+                    "routes.html",
+                    {
+                        "from_location_name": from_station_raw,
+                        "to_location_name": to_station_raw,
+                        "from_station": plan['from_station'],
+                        "to_station": plan['to_station'],
+                        "path": simple_path,
+                        "path_with_routes": plan['path_with_routes'],
+                        "route_segments": route_segments,
+                        "total_distance": round(plan['total_distance'], 2),
+                        "num_stations": len(simple_path),
+                        "num_transfers": plan['num_transfers'],
+                        "travel_time": round(plan['total_time']),
+                        "routes_used": [seg['route_id'] for seg in route_segments],
+                        "map_segments_json": map_segments_json,
+                        "coords_dict_json": coords_dict_json,
+                        "walk_data": walk_data,
+                        "walk_data_json": walk_data_json,
+                        # Only worth showing when there is a real trade-off
+                        "route_options": plan['options'] if len(plan.get('options', [])) > 1 else [],
+                        "route_alternatives": plan.get('alternatives', []),
+                        "departure": clock(plan['departure']) if 'legs' in plan else None,
+                        "arrival": clock(plan['arrival']) if 'legs' in plan else None,
+                        "legs": plan.get('legs', []),
+                    },
+                )
             
         except Exception as e:
             import logging
@@ -424,20 +403,15 @@ def admin_reports(request):
 
 
 @require_http_methods(["GET"])
-@ratelimit(key='ip', rate='60/m', method='GET', block=True)
-def api_stations(request):
+@async_ratelimit(key='ip', rate='60/m', method='GET', block=True)
+async def api_stations(request):
     """API endpoint to get all stations with coordinates"""
     try:
-        stations = Station.objects.filter(lat__isnull=False, lng__isnull=False)
-        
-        data = [{
-            'station_id': station.station_id,
-            'station_name': station.station_name,
-            'lat': float(station.lat),
-            'lng': float(station.lng)
-        } for station in stations]
+        snapshot = await aget_snapshot()
         
-        return JsonResponse(data, safe=False)
+        # Encoded once per snapshot, not per request
+        with phase("encode"):
+            return HttpResponse(snapshot.stations_json, content_type="application/json")
     except Exception as e:
         import logging
         logging.error(f"Error in api_stations: {str(e)}")
@@ -445,34 +419,341 @@ def api_stations(request):
 
 
 @require_http_methods(["GET"])
-@ratelimit(key='ip', rate='60/m', method='GET', block=True)
-def api_routes(request):
+@async_ratelimit(key='ip', rate='60/m', method='GET', block=True)
+async def api_routes(request):
     """API endpoint to get all route segments"""
     try:
-        routes = Route.objects.select_related('from_station', 'to_station').filter(
-            from_station__lat__isnull=False,
-            from_station__lng__isnull=False,
-            to_station__lat__isnull=False,
-            to_station__lng__isnull=False
-        )
-        
-        data = [{
-            'route_id': route.route_id,
-            'from_station_id': route.from_station.station_id,
-            'to_station_id': route.to_station.station_id,
-            'from_lat': float(route.from_station.lat),
-            'from_lng': float(route.from_station.lng),
-            'to_lat': float(route.to_station.lat),
-            'to_lng': float(route.to_station.lng)
-        } for route in routes]
+        snapshot = await aget_snapshot()
         
-        return JsonResponse(data, safe=False)
+        with phase("encode"):
+            return HttpResponse(snapshot.route_edges_json, content_type="application/json")
     except Exception as e:
         import logging
         logging.error(f"Error in api_routes: {str(e)}")
         return JsonResponse({'error': 'An error occurred'}, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+@ratelimit(key='ip', rate='30/m', method='POST', block=True)
+def api_nearest_stations(request):
+    """
+    Snap a batch of GPS points to their nearest stations.
+    Body: {"points": [[lat, lng], ...], "k": 1, "max_radius_km": null}
+    Returns the k closest stations (within the radius) for every point.
+    """
+    try:
+        payload = json.loads(request.body)
+        points = payload.get('points')
+        k = int(payload.get('k', 1))
+        max_radius_km = payload.get('max_radius_km')
+        if max_radius_km is not None:
+            max_radius_km = float(max_radius_km)
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    if not isinstance(points, list) or not points:
+        return JsonResponse({'error': 'points must be a non-empty list of [lat, lng] pairs'}, status=400)
+    if len(points) > MAX_BATCH_POINTS:
+        return JsonResponse({'error': f'At most {MAX_BATCH_POINTS} points per request'}, status=400)
+    if not 1 <= k <= MAX_NEAREST_K:
+        return JsonResponse({'error': f'k must be between 1 and {MAX_NEAREST_K}'}, status=400)
+    if max_radius_km is not None and max_radius_km <= 0:
+        return JsonResponse({'error': 'max_radius_km must be positive'}, status=400)
+
+    coordinates = []
+    for point in points:
+        try:
+            lat, lng = (point['lat'], point['lng']) if isinstance(point, dict) else point
+            lat, lng = float(lat), float(lng)
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error': f'Invalid point: {point!r}'[:200]}, status=400)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return JsonResponse({'error': f'Point out of range: {point!r}'[:200]}, status=400)
+        coordinates.append((lat, lng))
+
+    try:
+        snapshot = get_snapshot()
+        stations = snapshot.stations
+        matches = snapshot.spatial.nearest_many(coordinates, k=k, max_km=max_radius_km)
+        data = [[{
+            'station_id': stations[i]['station_id'],
+            'station_name': stations[i]['station_name'],
+            'distance_km': round(distance, 4)
+        } for distance, i in point_matches] for point_matches in matches]
+
+        return JsonResponse({'results': data})
+    except Exception as e:
+        import logging
+        logging.error(f"Error in api_nearest_stations: {str(e)}")
+        return JsonResponse({'error': 'An error occurred'}, status=500)
+
+
+def _parse_route_query(params):
+    """
+    Origin/destination from GET params: from/to station names, or
+    from_lat/from_lng and to_lat/to_lng. Returns (from_name, to_name,
+    from_point, to_point) or raises ValueError with a client-facing message.
+    """
+    points = []
+    for end in ('from', 'to'):
+        lat = params.get(f'{end}_lat', '')
+        lng = params.get(f'{end}_lng', '')
+        if lat or lng:
+            try:
+                point = (float(lat), float(lng))
+            except ValueError:
+                raise ValueError(f"Invalid coordinates for '{end}'")
+            if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+                raise ValueError(f"Coordinates out of range for '{end}'")
+            points.append(point)
+        else:
+            points.append(None)
+
+    from_name = sanitize_input(params.get('from', ''), 200)
+    to_name = sanitize_input(params.get('to', ''), 200)
+    if not (from_name or points[0]) or not (to_name or points[1]):
+        raise ValueError("Both 'from' and 'to' (station name or coordinates) are required")
+    return from_name, to_name, points[0], points[1]
+
+
+def _parse_alternatives(params):
+    """The alternatives=N GET param (default 0), or ValueError."""
+    try:
+        count = int(params.get('alternatives', 0))
+    except ValueError:
+        raise ValueError("alternatives must be an integer")
+    if not 0 <= count <= MAX_ROUTE_ALTERNATIVES:
+        raise ValueError(f"alternatives must be between 0 and {MAX_ROUTE_ALTERNATIVES}")
+    return count
+
+
+def _parse_depart(params):
+    """
+    The depart=now|HH:MM GET param as minutes after midnight (None when
+    absent), or ValueError.
+    """
+    value = params.get('depart', '').strip()
+    if not value:
+        return None
+    if value == 'now':
+        return minutes_now()
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value)
+    if not match or int(match[1]) > 23 or int(match[2]) > 59:
+        raise ValueError("depart must be 'now' or HH:MM")
+    return int(match[1]) * 60 + int(match[2])
+
+
+def _api_segments(map_segments, route_segments):
+    return [{
+        'route_id': segment['route_id'],
+        'route_name': get_route_name(segment['route_id']),
+        'distance_km': round(route_segment['distance'], 2),
+        'stations': segment['stations'],
+        'coords': segment['coords'],
+    } for segment, route_segment in zip(map_segments, route_segments)]
+
+
+def _route_etag(request):
+    """ETag for /api/route/: graph version plus the normalized query"""
+    try:
+        from_name, to_name, from_point, to_point = _parse_route_query(request.GET)
+        alternatives = _parse_alternatives(request.GET)
+        depart = _parse_depart(request.GET)
+    except ValueError:
+        return None
+    key = (
+        f"{get_snapshot().version}|{normalize(from_name)}|{normalize(to_name)}|"
+        f"{from_point}|{to_point}|{alternatives}|{depart}"
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+@require_http_methods(["GET"])
+@ratelimit(key='ip', rate='60/m', method='GET', block=True)
+@etag(_route_etag)
+def api_route(request):
+    """
+    JSON trip planner: GET /api/route/?from=..&to=.. (or from_lat/from_lng,
+    to_lat/to_lng). Same answer as find_route without template rendering.
+    alternatives=N (up to 3) adds that many different routes, if there are.
+    depart=now or depart=HH:MM plans the earliest arrival on the line
+    schedules and adds departure/arrival times and timed 'legs'.
+    """
+    try:
+        from_name, to_name, from_point, to_point = _parse_route_query(request.GET)
+        alternatives = _parse_alternatives(request.GET)
+        depart = _parse_depart(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        snapshot = get_snapshot()
+        plan = plan_route(snapshot, from_name, to_name, from_point, to_point, alternatives=alternatives,
+                          depart_at=depart)
+    except StationNotFoundError as e:
+        return JsonResponse({'error': str(e), 'suggestions': e.suggestions}, status=404)
+    except RoutePlanningError as e:
+        return JsonResponse({'error': str(e)}, status=404)
+    except Exception as e:
+        import logging
+        logging.error(f"Error in api_route: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'An error occurred'}, status=500)
+
+    data = {
+        'graph_version': snapshot.version,
+        'from_station': plan['from_station'],
+        'to_station': plan['to_station'],
+        'distance_km': round(plan['total_distance'], 2),
+        'time_min': round(plan['total_time']),
+        'transfers': plan['num_transfers'],
+        'num_stations': len(plan['path']),
+        'segments': _api_segments(plan['map_segments'], plan['route_segments']),
+        'walk': {
+            'start': {
+                'distance_km': round(plan['walk_start_distance'], 2),
+                'time_min': round(plan['walk_start_time']),
+                'lat': from_point[0] if from_point else None,
+                'lng': from_point[1] if from_point else None,
+            },
+            'end': {
+                'distance_km': round(plan['walk_end_distance'], 2),
+                'time_min': round(plan['walk_end_time']),
+                'lat': to_point[0] if to_point else None,
+                'lng': to_point[1] if to_point else None,
+            },
+        },
+    }
+    if alternatives:
+        data['alternatives'] = [{
+            'via': alternative['via'],
+            'distance_km': round(alternative['distance'], 2),
+            'time_min': round(alternative['time']),
+            'transfers': alternative['transfers'],
+            'num_stations': len(alternative['path']),
+            'segments': _api_segments(alternative['map_segments'], alternative['route_segments']),
+        } for alternative in plan['alternatives']]
+    if depart is not None:
+        data['departure'] = clock(plan['departure'])
+        data['arrival'] = clock(plan['arrival'])
+        data['legs'] = [{
+            'route_id': leg['route_id'],
+            'route_name': get_route_name(leg['route_id']),
+            'from': leg['from'],
+            'to': leg['to'],
+            'departure': leg['departure'],
+            'arrival': leg['arrival'],
+            'wait_min': round(leg['wait_min']),
+            'ride_min': round(leg['ride_min']),
+            'num_stations': len(leg['stations']),
+        } for leg in plan['legs']]
+    with phase("encode"):
+        response = JsonResponse(data)
+    now = request.GET.get('depart', '').strip() == 'now'
+    patch_cache_control(response, public=True, max_age=ROUTE_API_NOW_MAX_AGE if now else ROUTE_API_MAX_AGE)
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@ratelimit(key='ip', rate='10/m', method='POST', block=True)
+def api_route_batch(request):
+    """
+    Batch origin/destination routing, streamed back as NDJSON.
+    Body: {"pairs": [{"from": .., "to": ..} or {"from_lat": .., "from_lng": ..,
+    "to_lat": .., "to_lng": ..}, ...], "include_path": false}
+    One line per pair in input order, then a {"done": true, ...} summary line.
+    distance_km is the distance travelled, walks included; time_min also
+    allows for transfers.
+    """
+    try:
+        payload = json.loads(request.body)
+        pairs = payload.get('pairs')
+        include_path = bool(payload.get('include_path', False))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+    if not isinstance(pairs, list) or not pairs:
+        return JsonResponse({'error': 'pairs must be a non-empty list'}, status=400)
+    if len(pairs) > MAX_BATCH_PAIRS:
+        return JsonResponse({'error': f'At most {MAX_BATCH_PAIRS} pairs per request'}, status=400)
+
+    # Every pair runs against the same snapshot, even if the graph changes mid-stream
+    snapshot = get_snapshot()
+    # Pairs sharing an origin station reuse its search tree
+    trees = snapshot.route_table or SourceTreeCache(snapshot.compact)
+
+    def results():
+        for index, pair in enumerate(pairs):
+            row = {'index': index}
+            try:
+                if not isinstance(pair, dict):
+                    raise ValueError("Each pair must be an object")
+                from_name, to_name, from_point, to_point = _parse_route_query(pair)
+                plan = plan_route(snapshot, from_name, to_name, from_point, to_point, trees=trees)
+                row.update({
+                    'from_station': plan['from_station'],
+                    'to_station': plan['to_station'],
+                    'distance_km': round(plan['total_distance'], 2),
+                    'time_min': round(plan['total_time']),
+                    'transfers': plan['num_transfers'],
+                    'routes': [segment['route_id'] for segment in plan['route_segments']],
+                    'walk_start_km': round(plan['walk_start_distance'], 2),
+                    'walk_end_km': round(plan['walk_end_distance'], 2),
+                })
+                if include_path:
+                    row['path'] = plan['path']
+            except StationNotFoundError as e:
+                row['error'] = str(e)
+                row['suggestions'] = e.suggestions
+            except (ValueError, RoutePlanningError) as e:
+                row['error'] = str(e)
+            except Exception as e:
+                import logging
+                logging.error(f"Error in api_route_batch: {str(e)}", exc_info=True)
+                row['error'] = 'An error occurred'
+            yield json.dumps(row) + "\n"
+
+        yield json.dumps({
+            'done': True,
+            'count': len(pairs),
+            'graph_version': snapshot.version,
+            'trees_computed': getattr(trees, 'misses', 0),
+        }) + "\n"
+
+    return StreamingHttpResponse(_streamed(request, results()), content_type='application/x-ndjson')
+
+
+def _streamed(request, lines):
+    """
+    lines as a streaming body. Under ASGI Django would read a sync iterator
+    to the end before sending anything, so there it is wrapped in an async
+    one that produces BATCH_STREAM_CHUNK lines at a time in the sync thread.
+    """
+    if not isinstance(request, ASGIRequest):
+        return lines
+
+    async def chunks():
+        while True:
+            chunk = await sync_to_async(list)(islice(lines, BATCH_STREAM_CHUNK))
+            if not chunk:
+                return
+            yield "".join(chunk)
+
+    return chunks()
+
+
+@require_http_methods(["GET"])
+def metrics_endpoint(request):
+    """Routing engine metrics in the Prometheus text format, merged across workers."""
+    if METRICS_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+    elif not settings.DEBUG:
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 def map_view(request):
     """Render the map page"""
     return render(request, 'map.html')
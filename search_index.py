@@ -0,0 +1,153 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+# Minimum trigram similarity for a fuzzy match to be listed / trusted
+FUZZY_MIN_SIMILARITY = 0.3
+RESOLVE_MIN_SIMILARITY = 0.5
+# ... and how far a trusted fuzzy match must be ahead of the next one
+RESOLVE_MIN_MARGIN = 0.15
+# Shorter queries only resolve when they are a station's whole name
+RESOLVE_MIN_PREFIX = 3
+
+# Rank buckets, best first
+EXACT, NAME_PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+
+
+def fold(text):
+    """Lowercase and strip punctuation: 'Nazimabad No.7' -> 'nazimabad no 7'"""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.lower()).split())
+
+
+def trigrams(folded):
+    # Pad each word so short words and word starts still produce trigrams
+    grams = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class StationSearchIndex:
+    """
+    In-memory autocomplete over station names: ranked exact, prefix,
+    word-prefix and substring matches, then trigram fuzzy matches for
+    typos and alternate spellings.
+
+    entries is a list of (display_name, key) pairs; search() returns display
+    names and resolve() returns keys (normalized graph names).
+    """
+
+    def __init__(self, entries):
+        self.names = []
+        self.keys = []
+        self.folded = []
+        seen = set()
+        for display_name, key in entries:
+            if key in seen:
+                continue
+            seen.add(key)
+            self.names.append(display_name)
+            self.keys.append(key)
+            self.folded.append(fold(display_name))
+
+        # Sorted (text, id) lists for bisecting prefixes of whole names and words
+        self._name_prefixes = sorted((f, i) for i, f in enumerate(self.folded))
+        self._word_prefixes = sorted(
+            (word, i) for i, f in enumerate(self.folded) for word in set(f.split())
+        )
+
+        self._trigram_counts = []
+        self._postings = defaultdict(list)
+        for i, f in enumerate(self.folded):
+            grams = trigrams(f)
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefixed(self, sorted_pairs, prefix):
+        start = bisect_left(sorted_pairs, (prefix,))
+        for text, i in sorted_pairs[start:]:
+            if not text.startswith(prefix):
+                break
+            yield i
+
+    def ranked(self, query, limit=10):
+        """[(rank, -similarity, id)] for the best matches, best first."""
+        q = fold(query)
+        if not q:
+            return []
+
+        found = {}
+
+        def add(i, rank, similarity=1.0):
+            current = found.get(i)
+            if current is None or (rank, -similarity) < current[:2]:
+                found[i] = (rank, -similarity, i)
+
+        for i in self._prefixed(self._name_prefixes, q):
+            add(i, EXACT if self.folded[i] == q else NAME_PREFIX)
+        for i in self._prefixed(self._word_prefixes, q):
+            add(i, WORD_PREFIX)
+
+        # Too short to share an inner trigram - plain scan for substrings
+        if len(q) < 3:
+            for i, f in enumerate(self.folded):
+                if i not in found and q in f:
+                    add(i, SUBSTRING)
+            return sorted(found.values(), key=lambda m: (m[0], m[1], self.folded[m[2]]))[:limit]
+
+        # Shared-trigram counts give both substring candidates and fuzzy scores
+        q_grams = trigrams(q)
+        shared = defaultdict(int)
+        for gram in q_grams:
+            for i in self._postings.get(gram, ()):
+                shared[i] += 1
+        for i, count in shared.items():
+            if i in found:
+                continue
+            if q in self.folded[i]:
+                add(i, SUBSTRING)
+                continue
+            similarity = count / (len(q_grams) + self._trigram_counts[i] - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                add(i, FUZZY, similarity)
+
+        # Ties within a bucket fall back to alphabetical order
+        return sorted(found.values(), key=lambda m: (m[0], m[1], self.folded[m[2]]))[:limit]
+
+    def search(self, query, limit=10):
+        """Display names matching query, best first; the first stations if empty."""
+        if not fold(query):
+            return self.names[:limit]
+        return [self.names[i] for _, _, i in self.ranked(query, limit)]
+
+    def resolve(self, query):
+        """
+        Key for free text that is not an exact station name, or None unless
+        one station is clearly meant: an exact match, the only station with
+        a name or word starting with the query, or a fuzzy match that is
+        good enough and well ahead of the next. A match inside a word
+        ('foo' in Safoora) is never trusted.
+        """
+        matches = self.ranked(query, limit=2)
+        if not matches:
+            return None
+        rank, negative_similarity, i = matches[0]
+        runner_up = matches[1] if len(matches) > 1 else None
+        if rank == EXACT:
+            return self.keys[i]
+        if rank in (NAME_PREFIX, WORD_PREFIX):
+            if len(fold(query)) < RESOLVE_MIN_PREFIX:
+                return None
+            if runner_up is not None and runner_up[0] in (NAME_PREFIX, WORD_PREFIX):
+                return None
+            return self.keys[i]
+        if rank == FUZZY and -negative_similarity >= RESOLVE_MIN_SIMILARITY:
+            if runner_up is None or runner_up[1] - negative_similarity >= RESOLVE_MIN_MARGIN:
+                return self.keys[i]
+        return None
@@ -0,0 +1,162 @@
+import heapq
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional - batch queries fall back to the KD-tree
+    np = None
+
+# Earth radius in kilometers
+EARTH_RADIUS_KM = 6371
+
+
+# Haversine formula to calculate distance between two lat/lng coordinates in km
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    a = math.sin(dLat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dLon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return R * c
+
+
+def _unit_vector(lat, lng):
+    lat = math.radians(lat)
+    lng = math.radians(lng)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lng), cos_lat * math.sin(lng), math.sin(lat))
+
+
+def _chord_to_km(chord_sq):
+    # Straight-line distance through the unit sphere -> great-circle km
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+def _km_to_chord_sq(km):
+    chord = 2 * math.sin(min(math.pi / 2, km / (2 * EARTH_RADIUS_KM)))
+    return chord * chord
+
+
+class KDTree:
+    """
+    KD-tree over (lat, lng) points, stored as 3D unit vectors so that
+    Euclidean nearest-neighbour search gives exact great-circle answers.
+    Results are (distance_km, index) pairs, index being the position of the
+    point in the list the tree was built from.
+    """
+
+    def __init__(self, points):
+        self.size = len(points)
+        self._xyz = [_unit_vector(lat, lng) for lat, lng in points]
+        # Flat node arrays; node i holds point _point[i] split on _axis[i]
+        self._point = []
+        self._axis = []
+        self._left = []
+        self._right = []
+        self._root = self._build(list(range(self.size)))
+        # numpy copy of _xyz, made on the first nearest_many() call
+        self._matrix = None
+
+    def _build(self, indices):
+        if not indices:
+            return -1
+        xyz = self._xyz
+        # Split on the axis with the widest spread
+        spreads = [
+            max(xyz[i][axis] for i in indices) - min(xyz[i][axis] for i in indices)
+            for axis in range(3)
+        ]
+        axis = spreads.index(max(spreads))
+        indices.sort(key=lambda i: xyz[i][axis])
+        mid = len(indices) // 2
+
+        node = len(self._point)
+        self._point.append(indices[mid])
+        self._axis.append(axis)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._left[node] = self._build(indices[:mid])
+        self._right[node] = self._build(indices[mid + 1:])
+        return node
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """Up to k closest points, nearest first, optionally within max_km."""
+        if self.size == 0 or k <= 0:
+            return []
+        query = _unit_vector(lat, lng)
+        limit = _km_to_chord_sq(max_km) if max_km is not None else float("inf")
+        # Max-heap of the best k so far as (-chord_sq, -index)
+        found = []
+        self._search(self._root, query, k, limit, found)
+        return sorted((_chord_to_km(-d), -i) for d, i in found)
+
+    def within(self, lat, lng, radius_km):
+        """Every point within radius_km, nearest first."""
+        return self.nearest(lat, lng, k=self.size, max_km=radius_km)
+
+    def nearest_many(self, points, k=1, max_km=None, chunk_size=4096):
+        """
+        nearest() for a batch of (lat, lng) points, one result list per point.
+        With numpy installed the distances are computed as matrix products
+        against every indexed point, chunk_size queries at a time.
+        """
+        if np is None or self.size == 0:
+            return [self.nearest(lat, lng, k=k, max_km=max_km) for lat, lng in points]
+
+        k = min(k, self.size)
+        if k <= 0:
+            return [[] for _ in points]
+        if self._matrix is None:
+            self._matrix = np.array(self._xyz, dtype=np.float64)
+        matrix = self._matrix
+        limit = _km_to_chord_sq(max_km) if max_km is not None else np.inf
+
+        results = []
+        coords = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        for start in range(0, len(coords), chunk_size):
+            lat = coords[start:start + chunk_size, 0]
+            lng = coords[start:start + chunk_size, 1]
+            cos_lat = np.cos(lat)
+            queries = np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+            # |a - b|^2 = 2 - 2 a.b for unit vectors
+            chord_sq = np.maximum(2.0 - 2.0 * (queries @ matrix.T), 0.0)
+
+            if k < self.size:
+                candidates = np.argpartition(chord_sq, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(self.size), chord_sq.shape)
+            candidate_sq = np.take_along_axis(chord_sq, candidates, axis=1)
+            order = np.argsort(candidate_sq, axis=1, kind="stable")
+            candidates = np.take_along_axis(candidates, order, axis=1)
+            candidate_sq = np.take_along_axis(candidate_sq, order, axis=1)
+            km = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(candidate_sq) / 2))
+
+            for row_km, row_index, row_sq in zip(km.tolist(), candidates.tolist(), candidate_sq.tolist()):
+                results.append([
+                    (d, i) for d, i, sq in zip(row_km, row_index, row_sq) if sq <= limit
+                ])
+        return results
+
+    def _search(self, node, query, k, limit, found):
+        xyz = self._xyz
+        while node >= 0:
+            index = self._point[node]
+            p = xyz[index]
+            d = (p[0] - query[0]) ** 2 + (p[1] - query[1]) ** 2 + (p[2] - query[2]) ** 2
+            if d <= limit:
+                if len(found) < k:
+                    heapq.heappush(found, (-d, -index))
+                elif d < -found[0][0]:
+                    heapq.heapreplace(found, (-d, -index))
+
+            axis = self._axis[node]
+            diff = query[axis] - p[axis]
+            near, far = (self._left[node], self._right[node]) if diff < 0 else (self._right[node], self._left[node])
+
+            # Visit the far side only if it could hold something closer
+            worst = -found[0][0] if len(found) == k else limit
+            if far >= 0 and diff * diff <= min(worst, limit):
+                self._search(far, query, k, limit, found)
+            node = near
@@ -0,0 +1,278 @@
+import csv
+import json
+import math
+import random
+
+from spatial import haversine
+
+# Synthetic networks are laid out around central Karachi
+CENTER_LAT = 24.90
+CENTER_LNG = 67.08
+
+# Straight-line km between stations is stretched by this much to give a
+# road distance, roughly what routes.txt shows for neighbouring stops
+ROAD_FACTOR = 1.25
+
+LAYOUTS = ("radial", "grid", "random")
+
+# Column headers of the repo's stations.txt/routes.txt
+STATION_COLUMNS = ["station_id", "station_name", "lat", "lng"]
+ROUTE_COLUMNS = ["route_id", "from_station_id", "to_station_id", "distance_kms"]
+
+
+def grid_network(num_stops, stops_per_line=25, spacing_km=0.6, seed=0):
+    """
+    A square grid of num_stops jittered stops with one bus line along every
+    row and every column, cut into lines of stops_per_line stops. Every stop
+    is served by two lines, so any trip needs at most a few transfers.
+
+    Returns (stations, routes) as rows in the stations.txt/routes.txt
+    layout: (station_id, station_name, lat, lng) and
+    (route_id, from_station_id, to_station_id, distance_kms).
+    """
+    rng = random.Random(seed)
+    side = math.ceil(math.sqrt(num_stops))
+    lat_step = spacing_km / 111.0
+    lng_step = spacing_km / (111.0 * math.cos(math.radians(CENTER_LAT)))
+
+    stations = []
+    cell_station = {}
+    for i in range(num_stops):
+        row, col = divmod(i, side)
+        lat = CENTER_LAT + (row - side / 2 + rng.uniform(-0.3, 0.3)) * lat_step
+        lng = CENTER_LNG + (col - side / 2 + rng.uniform(-0.3, 0.3)) * lng_step
+        station_id = i + 1
+        stations.append((station_id, f"Stop {station_id}", round(lat, 6), round(lng, 6)))
+        cell_station[row, col] = station_id
+
+    coords = {station_id: (lat, lng) for station_id, _, lat, lng in stations}
+    routes = []
+    line_count = 0
+
+    def add_line(stops):
+        nonlocal line_count
+        for start in range(0, len(stops) - 1, stops_per_line - 1):
+            chunk = stops[start:start + stops_per_line]
+            if len(chunk) < 2:
+                continue
+            line_count += 1
+            route_id = f"S{line_count}"
+            for a, b in zip(chunk, chunk[1:]):
+                km = haversine(*coords[a], *coords[b]) * ROAD_FACTOR
+                routes.append((route_id, a, b, round(km, 2)))
+
+    for row in range(side):
+        add_line([cell_station[row, col] for col in range(side) if (row, col) in cell_station])
+    for col in range(side):
+        add_line([cell_station[row, col] for row in range(side) if (row, col) in cell_station])
+
+    return stations, routes
+
+
+def _offset(lat, lng, north_km, east_km):
+    return (lat + north_km / 111.0,
+            lng + east_km / (111.0 * math.cos(math.radians(lat))))
+
+
+def _hub_positions(count, layout, radius_km, rng):
+    """(north_km, east_km) offsets from the centre for each transfer hub."""
+    if count <= 0:
+        return []
+    if layout == "grid":
+        side = math.ceil(math.sqrt(count))
+        step = 2 * radius_km / (side + 1)
+        return [(-radius_km + step * (1 + i // side), -radius_km + step * (1 + i % side))
+                for i in range(count)]
+    if layout == "radial":
+        # A central hub, then evenly spaced rings like the spokes of
+        # Karachi's network; ring r holds 6r hubs
+        rings = 0
+        while 1 + 3 * rings * (rings + 1) < count:
+            rings += 1
+        positions = [(0.0, 0.0)]
+        for ring in range(1, rings + 1):
+            ring_radius = radius_km * ring / rings
+            slots = 6 * ring
+            for k in range(slots):
+                angle = 2 * math.pi * (k + rng.random() * 0.3) / slots
+                positions.append((ring_radius * math.sin(angle), ring_radius * math.cos(angle)))
+        return positions[:count]
+    return [_random_point(radius_km * 0.7, rng) for _ in range(count)]
+
+
+def _random_point(radius_km, rng):
+    r = radius_km * math.sqrt(rng.random())
+    angle = rng.uniform(0, 2 * math.pi)
+    return (r * math.sin(angle), r * math.cos(angle))
+
+
+class _StopRegistry:
+    """Stations placed so far, snapping stops that land close together into one."""
+
+    def __init__(self, center_lat, center_lng, merge_km):
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.merge_km = merge_km
+        self.stations = []
+        self.positions = []
+        self._cells = {}
+
+    def _cell(self, north_km, east_km):
+        return (math.floor(north_km / self.merge_km), math.floor(east_km / self.merge_km))
+
+    def find(self, north_km, east_km):
+        row, col = self._cell(north_km, east_km)
+        for cell in ((row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)):
+            for station_id in self._cells.get(cell, ()):
+                n, e = self.positions[station_id - 1]
+                if math.hypot(n - north_km, e - east_km) <= self.merge_km:
+                    return station_id
+        return None
+
+    def add(self, north_km, east_km, name=None, merge=True):
+        if merge:
+            station_id = self.find(north_km, east_km)
+            if station_id is not None:
+                return station_id
+        station_id = len(self.stations) + 1
+        lat, lng = _offset(self.center_lat, self.center_lng, north_km, east_km)
+        self.stations.append((station_id, name or f"Stop {station_id}", round(lat, 6), round(lng, 6)))
+        self.positions.append((north_km, east_km))
+        self._cells.setdefault(self._cell(north_km, east_km), []).append(station_id)
+        return station_id
+
+    def km_between(self, a, b):
+        _, _, lat1, lng1 = self.stations[a - 1]
+        _, _, lat2, lng2 = self.stations[b - 1]
+        return max(0.05, round(haversine(lat1, lng1, lat2, lng2) * ROAD_FACTOR, 2))
+
+
+def generate_network(lines=40, stops_per_line=30, stop_spacing_km=0.8, hubs=None,
+                     corridors=3, lines_per_corridor=3, corridor_stops=5,
+                     layout="radial", center=(CENTER_LAT, CENTER_LNG), radius_km=None, seed=0):
+    """
+    A city-like network of bus lines for scale testing.
+
+    Every line runs from a random outer terminus through one transfer hub to
+    a second terminus, with a stop every stop_spacing_km. Each of the
+    corridors is a fixed run of corridor_stops shared stations that
+    lines_per_corridor lines ride together before branching off, like the
+    EV2/EV4/EV5 overlap in routes.txt. Stops of different lines that land
+    within a third of the spacing of each other become one station, which
+    gives the incidental transfers a real street grid has.
+
+    layout places the hubs: "radial" (a centre plus rings), "grid" or
+    "random". hubs defaults to one per six lines and radius_km to a city
+    big enough for the stops, so neighbouring hubs stay within reach of
+    each other's lines.
+    Returns (stations, routes) rows like grid_network().
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}")
+    if stops_per_line < 2:
+        raise ValueError("stops_per_line must be at least 2")
+
+    rng = random.Random(seed)
+    if hubs is None:
+        hubs = max(1, lines // 6)
+    if radius_km is None:
+        line_km = stops_per_line * stop_spacing_km
+        radius_km = max(line_km / 2, math.sqrt(lines * stops_per_line / math.pi) * stop_spacing_km * 0.6)
+    registry = _StopRegistry(center[0], center[1], stop_spacing_km / 3)
+
+    hub_ids = [registry.add(north, east, name=f"Hub {i + 1}", merge=False)
+               for i, (north, east) in enumerate(_hub_positions(hubs, layout, radius_km, rng))]
+
+    corridor_ids = []
+    for i in range(corridors):
+        north, east = _random_point(radius_km * 0.6, rng)
+        heading = rng.uniform(0, 2 * math.pi)
+        corridor_ids.append([
+            registry.add(north + k * stop_spacing_km * math.sin(heading),
+                         east + k * stop_spacing_km * math.cos(heading),
+                         name=f"Corridor {i + 1} Stop {k + 1}", merge=False)
+            for k in range(corridor_stops)
+        ])
+
+    def branch(origin, heading, count):
+        """count stops heading away from origin, nearest first, gently curving."""
+        stops = []
+        north, east = origin
+        for _ in range(count):
+            heading += rng.gauss(0, 0.15)
+            north += stop_spacing_km * math.sin(heading)
+            east += stop_spacing_km * math.cos(heading)
+            stops.append(registry.add(north, east))
+        return stops
+
+    routes = []
+    for line in range(lines):
+        corridor = None
+        if line < corridors * lines_per_corridor:
+            corridor = corridor_ids[line // lines_per_corridor]
+
+        if corridor:
+            middle = corridor if rng.random() < 0.5 else corridor[::-1]
+        elif hub_ids:
+            middle = [rng.choice(hub_ids)]
+        else:
+            middle = [registry.add(*_random_point(radius_km * 0.5, rng))]
+
+        # Branches leave either end of the hub/corridor in roughly opposite
+        # directions, splitting the rest of the line's stops between them
+        first = registry.positions[middle[0] - 1]
+        last = registry.positions[middle[-1] - 1]
+        if len(middle) > 1:
+            heading = math.atan2(last[0] - first[0], last[1] - first[1])
+        else:
+            heading = rng.uniform(0, 2 * math.pi)
+        remaining = max(0, stops_per_line - len(middle))
+        before = remaining // 2
+        after = remaining - before
+
+        stops = branch(first, heading + math.pi + rng.uniform(-0.6, 0.6), before)
+        stops.reverse()
+        stops.extend(middle)
+        stops.extend(branch(last, heading + rng.uniform(-0.6, 0.6), after))
+
+        # Snapping can repeat a stop back to back; a line never stays put
+        sequence = [stop for i, stop in enumerate(stops) if i == 0 or stop != stops[i - 1]]
+        route_id = f"L{line + 1}"
+        for a, b in zip(sequence, sequence[1:]):
+            routes.append((route_id, a, b, registry.km_between(a, b)))
+
+    # Hubs/corridor stops that no line ended up using are dropped
+    used = {station_id for _, a, b, _ in routes for station_id in (a, b)}
+    stations = [station for station in registry.stations if station[0] in used]
+    return stations, routes
+
+
+def write_network_files(stations, routes, stations_path, routes_path):
+    """Writes stations.txt/routes.txt-format CSVs."""
+    with open(stations_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(STATION_COLUMNS)
+        writer.writerows(stations)
+    with open(routes_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(ROUTE_COLUMNS)
+        writer.writerows(routes)
+
+
+def write_fixture(stations, routes, path):
+    """
+    Writes a Station/Route fixture for `manage.py loaddata`. Station primary
+    keys are the station ids, so route rows point at them directly.
+    """
+    objects = [{
+        'model': 'routefinder.station',
+        'pk': station_id,
+        'fields': {'station_id': station_id, 'station_name': station_name, 'lat': lat, 'lng': lng},
+    } for station_id, station_name, lat, lng in stations]
+    objects.extend({
+        'model': 'routefinder.route',
+        'pk': pk,
+        'fields': {'route_id': route_id, 'from_station': from_id, 'to_station': to_id, 'distance_kms': km},
+    } for pk, (route_id, from_id, to_id, km) in enumerate(routes, 1))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(objects, f)
@@ -0,0 +1,337 @@
+"""
+Bus line schedules and round-based (RAPTOR) routing for "leave at" trips.
+
+routes.txt only lists edges, so every route id is turned into stop
+patterns here: its edges are chained into runs of stops between line ends
+and branch points, and each run is ridden in both directions. A line's
+schedule (a LineSchedule row, or the defaults below) gives its headway
+and service window: buses leave the first stop of each pattern at
+first_departure, first_departure + headway, ... until last_departure and
+run at speed_kmh.
+
+raptor() finds the earliest arrival. Round k settles every station
+reachable with k rides by scanning, once and stop by stop, each pattern
+serving a station improved in round k - 1 - no (station, route) heap.
+Times are minutes after midnight.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+
+from dijkstras import TRANSFER_PENALTY, PathStep
+from spatial import EARTH_RADIUS_KM
+
+# Lines without a LineSchedule row: a bus every DEFAULT_HEADWAY_MINUTES
+# from each end between these times (minutes after midnight)
+DEFAULT_HEADWAY_MINUTES = getattr(settings, "DEFAULT_HEADWAY_MINUTES", 10)
+DEFAULT_FIRST_DEPARTURE = getattr(settings, "DEFAULT_FIRST_DEPARTURE", 6 * 60)
+DEFAULT_LAST_DEPARTURE = getattr(settings, "DEFAULT_LAST_DEPARTURE", 23 * 60)
+
+# Running speed of lines without their own, as planner.AVG_SPEED_OF_BUS
+DEFAULT_SPEED_KMH = getattr(settings, "DEFAULT_LINE_SPEED_KMH", 26)
+
+# Time to change buses at a station, on top of waiting for the next one
+MIN_TRANSFER_MINUTES = getattr(settings, "MIN_TRANSFER_MINUTES", 2)
+
+# Most rides in one trip (rounds of the search)
+RAPTOR_MAX_ROUNDS = getattr(settings, "RAPTOR_MAX_ROUNDS", 8)
+
+# Schedules are in the network's local time, whatever TIME_ZONE says
+SERVICE_TIME_ZONE = getattr(settings, "SERVICE_TIME_ZONE", "Asia/Karachi")
+
+# One ride: route id, the stations from boarding to alighting with the km
+# from the previous one (0 for the first), and when the bus leaves/arrives
+Leg = namedtuple('Leg', ['route', 'stations', 'kms', 'departure', 'arrival'])
+
+
+def _runs(adjacency):
+    """
+    Splits one line's {station: {neighbor: km}} edges into runs of stops
+    [(stations, kms)] that only end at line ends and branch points. Loops
+    without either come out as one run back to their first stop.
+    """
+    used = set()
+    runs = []
+    ends = [u for u, neighbors in adjacency.items() if len(neighbors) != 2]
+    for start in ends + list(adjacency):
+        for first in adjacency[start]:
+            if frozenset((start, first)) in used:
+                continue
+            stations, kms = [start], [0.0]
+            prev, u = start, first
+            while True:
+                used.add(frozenset((prev, u)))
+                stations.append(u)
+                kms.append(adjacency[prev][u])
+                if len(adjacency[u]) != 2 or u == start:
+                    break
+                prev, u = u, next(v for v in adjacency[u] if v != prev)
+                if frozenset((stations[-1], u)) in used:
+                    break
+            runs.append((stations, kms))
+    return runs
+
+
+class Timetable:
+    """
+    Stop patterns of every line in a CompactGraph, with their schedules.
+    schedules maps route ids to (headway_minutes, first_departure,
+    last_departure, speed_kmh); missing lines and None fields get the
+    defaults above.
+    """
+
+    def __init__(self, compact_graph, schedules=None):
+        cg = compact_graph
+        schedules = schedules or {}
+        self.station_names = cg.station_names
+        self.station_index = cg.station_index
+        # For raptor()'s straight-line lower bound, as in dijkstras.astar()
+        self.station_lat = cg.station_lat
+        self.station_lng = cg.station_lng
+        self.heuristic_scale = cg.heuristic_scale
+        self.max_speed = DEFAULT_SPEED_KMH
+        self.pattern_route = []
+        self.pattern_stations = []
+        self.pattern_kms = []
+        # Ride minutes from the pattern's first stop to each of its stops
+        self.pattern_minutes = []
+        # (first_departure, last_departure, headway) from the first stop
+        self.pattern_service = []
+        # station -> [(pattern, position)]
+        self.station_patterns = [[] for _ in cg.station_names]
+
+        # Each route's edges, from the compact adjacency
+        lines = [{} for _ in cg.route_ids]
+        for u in range(len(cg.station_names)):
+            for e in range(cg.edge_offset[u], cg.edge_offset[u + 1]):
+                v = cg.state_station[cg.edge_state[e]]
+                lines[cg.edge_route[e]].setdefault(u, {})[v] = cg.edge_distance[e]
+
+        for r, route_id in enumerate(cg.route_ids):
+            headway, first, last, speed = schedules.get(route_id, (None, None, None, None))
+            headway = headway or DEFAULT_HEADWAY_MINUTES
+            first = DEFAULT_FIRST_DEPARTURE if first is None else first
+            last = DEFAULT_LAST_DEPARTURE if last is None else last
+            speed = speed or DEFAULT_SPEED_KMH
+            self.max_speed = max(self.max_speed, speed)
+            for stations, kms in _runs(lines[r]):
+                backward_kms = [0.0] + kms[:0:-1]
+                for pattern_stations, pattern_kms in ((stations, kms), (stations[::-1], backward_kms)):
+                    self._add_pattern(route_id, pattern_stations, pattern_kms, (first, last, headway), speed)
+
+    def _add_pattern(self, route_id, stations, kms, service, speed):
+        p = len(self.pattern_route)
+        minutes = []
+        total = 0.0
+        for km in kms:
+            total += km
+            minutes.append(total / speed * 60)
+        self.pattern_route.append(route_id)
+        self.pattern_stations.append(stations)
+        self.pattern_kms.append(kms)
+        self.pattern_minutes.append(minutes)
+        self.pattern_service.append(service)
+        for i, u in enumerate(stations[:-1]):
+            self.station_patterns[u].append((p, i))
+
+    @property
+    def num_patterns(self):
+        return len(self.pattern_route)
+
+    def _goal_estimate(self, goals):
+        """
+        A function giving, per station, the fewest minutes any bus could
+        take to the nearest of goals (station ints) - the straight line at
+        the fastest line's speed - or None without coordinates to go by.
+        """
+        if self.heuristic_scale <= 0 or any(math.isnan(self.station_lat[g]) for g in goals):
+            return None
+        minutes_per_radian = self.heuristic_scale * EARTH_RADIUS_KM * 2 / self.max_speed * 60
+        points = [(math.radians(self.station_lat[g]), math.radians(self.station_lng[g])) for g in goals]
+        station_lat = self.station_lat
+        station_lng = self.station_lng
+
+        def estimate(s):
+            lat = station_lat[s]
+            if math.isnan(lat):
+                return 0.0
+            lat = math.radians(lat)
+            lng = math.radians(station_lng[s])
+            a = min(math.sin((lat - goal_lat) / 2) ** 2
+                    + math.cos(lat) * math.cos(goal_lat) * math.sin((lng - goal_lng) / 2) ** 2
+                    for goal_lat, goal_lng in points)
+            return minutes_per_radian * math.asin(math.sqrt(min(1.0, a)))
+        return estimate
+
+
+def next_departure(service, offset, ready):
+    """
+    When the first bus that reaches a stop offset minutes down the pattern
+    at or after ready left the first stop, or None if service is over.
+    """
+    first, last, headway = service
+    wanted = ready - offset
+    if wanted <= first:
+        return first
+    departure = first + math.ceil((wanted - first) / headway - 1e-9) * headway
+    return departure if departure <= last else None
+
+
+def raptor(timetable, sources, targets, depart, max_rounds=None, stats=None):
+    """
+    Earliest arrival leaving at depart from any of sources to any of
+    targets, both {station name: walking minutes}. Ties go to the trip
+    with fewer rides. Returns (arrival, legs, source_node, target_node),
+    arrival including the walk at the end, or (inf, [], None, None) if no
+    bus gets there. stats receives the 'rounds' run and 'patterns' scanned.
+    """
+    tt = timetable
+    inf = float("inf")
+    num_stations = len(tt.station_names)
+    max_rounds = RAPTOR_MAX_ROUNDS if max_rounds is None else max_rounds
+    station_patterns = tt.station_patterns
+    pattern_stations = tt.pattern_stations
+    pattern_minutes = tt.pattern_minutes
+    pattern_service = tt.pattern_service
+    ceil = math.ceil
+
+    best = [inf] * num_stations
+    # When a bus can be boarded, as of the previous round
+    ready = [inf] * num_stations
+    for name, walk in sources.items():
+        s = tt.station_index[name]
+        ready[s] = best[s] = min(best[s], depart + walk)
+    egress = {}
+    for name, walk in targets.items():
+        t = tt.station_index[name]
+        egress[t] = min(egress.get(t, inf), walk)
+
+    # Walking only, when an origin station is also a destination
+    found = (inf, 0, None)
+    for t, walk in egress.items():
+        if best[t] + walk < found[0]:
+            found = (best[t] + walk, 0, t)
+    bound = found[0]
+
+    # Stations whose arrival plus the straight-line bound cannot beat the
+    # best trip found so far are not labelled (filled in lazily, -1 = not yet)
+    goal_estimate = tt._goal_estimate(list(egress))
+    estimate = [-1.0] * num_stations
+
+    # labels[k - 1][station] = (pattern, board, alight, departure) of round k
+    labels = []
+    marked = [s for s in range(num_stations) if ready[s] < inf]
+    scanned = 0
+    while marked and len(labels) < max_rounds:
+        # Scan each pattern from the first stop improved last round. Only
+        # those stops can offer an earlier bus than the last round had.
+        is_marked = bytearray(num_stations)
+        queue = {}
+        for s in marked:
+            is_marked[s] = 1
+            for p, i in station_patterns[s]:
+                if i < queue.get(p, inf):
+                    queue[p] = i
+        scanned += len(queue)
+
+        improved = {}
+        for p, start in queue.items():
+            stations = pattern_stations[p]
+            minutes = pattern_minutes[p]
+            first, last, headway = pattern_service[p]
+            departure = None
+            board = start
+            for i in range(start, len(stations)):
+                s = stations[i]
+                if departure is not None:
+                    arrival = departure + minutes[i]
+                    if arrival < best[s] and arrival < bound:
+                        if goal_estimate is not None and bound < inf:
+                            h = estimate[s]
+                            if h < 0:
+                                h = estimate[s] = goal_estimate(s)
+                        else:
+                            h = 0
+                        if arrival + h < bound:
+                            best[s] = arrival
+                            improved[s] = (p, board, i, departure)
+                            if s in egress and arrival + egress[s] < bound:
+                                bound = arrival + egress[s]
+                # An earlier bus can be caught here
+                if is_marked[s] and (departure is None or ready[s] < departure + minutes[i]):
+                    # next_departure(), inlined
+                    wanted = ready[s] - minutes[i]
+                    if wanted <= first:
+                        earlier = first
+                    else:
+                        earlier = first + ceil((wanted - first) / headway - 1e-9) * headway
+                    if earlier <= last and (departure is None or earlier < departure):
+                        departure = earlier
+                        board = i
+
+        if not improved:
+            break
+        labels.append(improved)
+        for s in improved:
+            ready[s] = best[s] + MIN_TRANSFER_MINUTES
+            if s in egress and best[s] + egress[s] < found[0]:
+                found = (best[s] + egress[s], len(labels), s)
+        marked = list(improved)
+
+    if stats is not None:
+        stats['rounds'] = len(labels)
+        stats['patterns'] = scanned
+
+    arrival, rounds, target = found
+    if target is None:
+        return (inf, [], None, None)
+
+    # Walk the labels back: each ride boarded where an earlier round arrived
+    legs = []
+    s = target
+    k = rounds
+    while k > 0:
+        p, board, alight, departure = labels[k - 1][s]
+        stations = pattern_stations[p]
+        minutes = pattern_minutes[p]
+        legs.append(Leg(
+            tt.pattern_route[p],
+            [tt.station_names[u] for u in stations[board:alight + 1]],
+            [0.0] + tt.pattern_kms[p][board + 1:alight + 1],
+            departure + minutes[board],
+            departure + minutes[alight],
+        ))
+        s = stations[board]
+        k -= 1
+        while k > 0 and s not in labels[k - 1]:
+            k -= 1
+    legs.reverse()
+    return (arrival, legs, tt.station_names[s], tt.station_names[target])
+
+
+def journey_path(source_node, legs):
+    """The legs of a raptor() trip as a path_with_routes (see dijkstras.PathStep)."""
+    steps = [PathStep(source_node, None, False)]
+    prev_route = None
+    for leg in legs:
+        for station, km in zip(leg.stations[1:], leg.kms[1:]):
+            is_transfer = prev_route is not None and leg.route != prev_route
+            steps.append(PathStep(station, leg.route, is_transfer, km,
+                                  TRANSFER_PENALTY if is_transfer else 0))
+            prev_route = leg.route
+    return steps
+
+
+def minutes_now():
+    """The current minute in SERVICE_TIME_ZONE, as minutes after midnight."""
+    now = datetime.now(ZoneInfo(SERVICE_TIME_ZONE))
+    return now.hour * 60 + now.minute
+
+
+def clock(minutes):
+    """'HH:MM' for minutes after midnight (past 24:00 for the next day)."""
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
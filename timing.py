@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-phase request timing, sent back in a Server-Timing header by
+# routefinder.middleware.ServerTimingMiddleware. When disabled phase() is a
+# ContextVar lookup returning a shared no-op.
+SERVER_TIMING_ENABLED = getattr(settings, "SERVER_TIMING_ENABLED", True)
+
+# Fraction of timed requests whose phases are logged one by one
+SERVER_TIMING_LOG_SAMPLE_RATE = getattr(settings, "SERVER_TIMING_LOG_SAMPLE_RATE", 0.0)
+
+# Log the in-process aggregate every N timed requests (0 = never)
+SERVER_TIMING_LOG_EVERY = getattr(settings, "SERVER_TIMING_LOG_EVERY", 1000)
+
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Phase durations (ms) of one request, summed per phase name in first-seen order."""
+
+    __slots__ = ('phases',)
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, ms):
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def header(self):
+        return ", ".join(f"{name};dur={ms:.2f}" for name, ms in self.phases.items())
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name):
+    """
+    Context manager timing one phase of the current request:
+
+        with phase("search"):
+            ...
+
+    A no-op outside a timed request (management commands, disabled timing,
+    generators that outlive the view).
+    """
+    timings = _current.get()
+    if timings is None:
+        return _NULL_PHASE
+    return _Phase(timings, name)
+
+
+def start_request():
+    """Starts timing for the current request; pass the token to end_request()."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+# In-process aggregate: (view, phase) -> [count, total_ms, max_ms]
+_stats = {}
+_stats_lock = threading.Lock()
+_requests = 0
+
+
+def record(view, timings):
+    """Folds one request's timings into the aggregate and samples it to the log."""
+    global _requests
+    with _stats_lock:
+        for name, ms in timings.phases.items():
+            entry = _stats.get((view, name))
+            if entry is None:
+                _stats[(view, name)] = [1, ms, ms]
+            else:
+                entry[0] += 1
+                entry[1] += ms
+                if ms > entry[2]:
+                    entry[2] = ms
+        _requests += 1
+        log_summary = SERVER_TIMING_LOG_EVERY and _requests % SERVER_TIMING_LOG_EVERY == 0
+
+    if metrics.METRICS_ENABLED:
+        for name, ms in timings.phases.items():
+            metrics.REQUEST_PHASE_SECONDS.observe(ms / 1000, view=view, phase=name)
+
+    if SERVER_TIMING_LOG_SAMPLE_RATE and random.random() < SERVER_TIMING_LOG_SAMPLE_RATE:
+        logger.info(f"timing view={view} {timings.header()}")
+    if log_summary:
+        for (view_name, name), entry in sorted(summary_items()):
+            logger.info(f"timing summary view={view_name} phase={name} count={entry['count']} "
+                        f"mean_ms={entry['mean_ms']:.2f} max_ms={entry['max_ms']:.2f}")
+
+
+def summary_items():
+    """[((view, phase), {'count', 'total_ms', 'mean_ms', 'max_ms'})] since start/reset."""
+    with _stats_lock:
+        items = [(key, list(entry)) for key, entry in _stats.items()]
+    return [(key, {
+        'count': count,
+        'total_ms': total,
+        'mean_ms': total / count,
+        'max_ms': maximum,
+    }) for key, (count, total, maximum) in items]
+
+
+def reset():
+    global _requests
+    with _stats_lock:
+        _stats.clear()
+        _requests = 0
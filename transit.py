@@ -1,9 +1,32 @@
 from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from routefinder.models import Station
 from routefinder.models import Route
-from dijkstras import get_connected_component
+from routefinder.models import GraphVersion
+from routefinder.models import LineSchedule
+import dijkstras
+from dijkstras import CompactGraph, astar, compact_dijkstra, get_connected_component, multi_source_search
+from route_table import best_pair, build_route_table, load_route_table, route_table_path
+from contraction import build_contraction_hierarchy
+from spatial import KDTree
+from search_index import StationSearchIndex
+from timetable import Timetable
+import metrics
+from timing import phase
 
+import gc
+import json
+import logging
+import os
+import pickle
 import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 def normalize(name: str) -> str:
     if not name:
@@ -28,27 +51,39 @@ def normalize(name: str) -> str:
     return result
 
 def transit_map(debug=False):
-    
+    routes = Route.objects.select_related("from_station", "to_station")
+    return graph_from_rows(
+        (station.station_name for station in Station.objects.all()),
+        ((route.route_id, route.from_station.station_name, route.to_station.station_name, route.distance_kms)
+         for route in routes),
+        debug=debug,
+    )
+
+
+def graph_from_rows(station_names, route_rows, debug=False):
+    """
+    Builds (graph, route_info, routes_per_station) from raw station names and
+    (route_id, from_name, to_name, distance_kms) rows. Shared by transit_map()
+    and anything that loads a network without the database.
+    """
     graph = defaultdict(dict)
     route_info = defaultdict(lambda: defaultdict(list))  # Now stores LISTS of routes
     routes_per_station = defaultdict(set)
-    routes = Route.objects.select_related("from_station", "to_station")
     
-    station_names = set()
-    for station in Station.objects.all():
-        normalized_name = normalize(station.station_name)
+    normalized_names = set()
+    for station_name in station_names:
+        normalized_name = normalize(station_name)
         graph[normalized_name]
-        station_names.add(normalized_name)
+        normalized_names.add(normalized_name)
     
     if debug:
-        print(f"Total stations loaded: {len(station_names)}")
+        print(f"Total stations loaded: {len(normalized_names)}")
     
     route_count = 0
-    for route in routes:
-        from_name = normalize(route.from_station.station_name)
-        to_name = normalize(route.to_station.station_name)
-        distance = float(route.distance_kms)
-        route_id = route.route_id
+    for route_id, from_station_name, to_station_name, distance_kms in route_rows:
+        from_name = normalize(from_station_name)
+        to_name = normalize(to_station_name)
+        distance = float(distance_kms)
         
         # Store the edge
         graph[from_name][to_name] = distance
@@ -72,6 +107,401 @@ def transit_map(debug=False):
     return dict(graph), dict(route_info), dict(routes_per_station)
 
 
+# ============================================
+# Process-wide graph snapshot
+# ============================================
+
+# How often (seconds) a worker re-reads the GraphVersion row to notice
+# changes made by other processes
+GRAPH_VERSION_POLL_SECONDS = getattr(settings, "GRAPH_VERSION_POLL_SECONDS", 5)
+
+# A* only pays for its trig when the heuristic is a reasonably tight bound.
+# The scale drops when recorded distances are much shorter than the straight
+# line between stations, which is why it is checked per snapshot.
+ASTAR_MIN_HEURISTIC_SCALE = getattr(settings, "ASTAR_MIN_HEURISTIC_SCALE", 0.5)
+
+# Compute the all-pairs route table in a background thread when a snapshot
+# is built and no table for its version exists on disk yet
+ROUTE_TABLE_AUTOBUILD = getattr(settings, "ROUTE_TABLE_AUTOBUILD", False)
+
+# Searches the route table cannot answer climb a contraction hierarchy
+# instead of running A* or Dijkstra. `build_graph_snapshot` contracts the
+# graph into the prebuilt snapshot file; otherwise each process contracts
+# it on a background thread and searches as usual until it is done. That
+# takes 0.16s on routes.txt but 5.7s at 500 synthetic stops, 21s at 1,000
+# and 96s at 2,000. Queries only win on routes.txt, where A* is off (0.24
+# against 0.69 ms); on synthetic networks they are no faster than A*.
+CONTRACTION_HIERARCHY = getattr(settings, "CONTRACTION_HIERARCHY", False)
+
+# Prebuilt snapshot written by `manage.py build_graph_snapshot` (build.sh).
+# wsgi.py/asgi.py load it at import time, so a gunicorn --preload master
+# reads it once and forked workers share its pages instead of each
+# building the graph from the database. Used only while its graph version
+# is current; otherwise the first poll rebuilds from the database.
+GRAPH_SNAPSHOT_FILE = getattr(settings, "GRAPH_SNAPSHOT_FILE",
+                              os.path.join(settings.BASE_DIR, "graph_snapshot.pkl"))
+
+SNAPSHOT_FORMAT_VERSION = 4
+
+
+class GraphSnapshot:
+    """
+    Immutable view of the transit network at one graph version.
+    Never mutate the dicts held here - they are shared by every request.
+    """
+
+    def __init__(self, version, graph, route_info, routes_per_station, stations, route_edges,
+                 station_names=(), schedules=None):
+        self.version = version
+        self.graph = graph
+        self.route_info = route_info
+        self.routes_per_station = routes_per_station
+        # Payloads for the map APIs (stations/routes with coordinates only)
+        self.stations = stations
+        self.route_edges = route_edges
+        # normalized name -> {'lat': .., 'lng': ..}
+        self.coords = {}
+        for s in stations:
+            self.coords[s['normalized_name']] = {'lat': s['lat'], 'lng': s['lng']}
+        # Nearest-station lookups; results index into self.stations
+        self.spatial = KDTree([(s['lat'], s['lng']) for s in stations])
+        # Autocomplete and free-text resolution over every station name
+        self.search_index = StationSearchIndex([(name, normalize(name)) for name in station_names])
+        # Integer-indexed copy of graph/route_info used by the search
+        self.compact = CompactGraph(graph, route_info, self.coords)
+        # Line patterns and headways for departure-time queries
+        self.timetable = Timetable(self.compact, schedules)
+        # Precomputed all-pairs answers, attached once loaded/built
+        self.route_table = None
+        # Shortcut graph for searches, when CONTRACTION_HIERARCHY is on
+        self.contraction = None
+        self.built_at = time.time()
+        self._stations_json = None
+        self._route_edges_json = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Route tables are stored (and validated) separately per version
+        state['route_table'] = None
+        return state
+
+    @property
+    def stations_json(self):
+        """The /api/stations/ body, encoded once per snapshot."""
+        if self._stations_json is None:
+            self._stations_json = json.dumps([{
+                'station_id': station['station_id'],
+                'station_name': station['station_name'],
+                'lat': station['lat'],
+                'lng': station['lng']
+            } for station in self.stations]).encode()
+        return self._stations_json
+
+    @property
+    def route_edges_json(self):
+        """The /api/routes/ body, encoded once per snapshot."""
+        if self._route_edges_json is None:
+            self._route_edges_json = json.dumps(self.route_edges).encode()
+        return self._route_edges_json
+
+    def search(self, source_node, target_node, stats=None):
+        """
+        Cheapest path between two normalized station names.
+        Uses A* when station coordinates give a useful bound, else Dijkstra;
+        both return identical costs. Served from the precomputed route
+        table when one is attached, then from the contraction hierarchy.
+        stats also gets the 'engine' used.
+        """
+        table = self.route_table
+        if table is not None:
+            result = table.lookup(self.compact, source_node, target_node)
+            if result is not None:
+                if stats is not None:
+                    stats['table_hit'] = True
+                    stats['engine'] = 'table'
+                return result
+        contraction = self.contraction
+        # Attached only once matched against this graph; the penalty is a
+        # module setting and may still change
+        if contraction is not None and contraction.transfer_penalty == dijkstras.TRANSFER_PENALTY:
+            if stats is not None:
+                stats['engine'] = 'contraction'
+            return contraction.search(self.compact, source_node, target_node, stats=stats)
+        if self.compact.heuristic_scale >= ASTAR_MIN_HEURISTIC_SCALE:
+            if stats is not None:
+                stats['engine'] = 'astar'
+            return astar(self.compact, source_node, target_node, stats=stats)
+        if stats is not None:
+            stats['engine'] = 'dijkstra'
+        return compact_dijkstra(self.compact, source_node, target_node, stats=stats)
+
+    def search_multi(self, sources, targets, stats=None):
+        """
+        Best trip from any of several origin stations to any of several
+        destination stations; sources/targets map names to access costs.
+        Returns (total_cost, path_with_routes, source_node, target_node).
+        """
+        if len(sources) == 1 and len(targets) == 1:
+            (source_node, source_cost), = sources.items()
+            (target_node, target_cost), = targets.items()
+            cost, path = self.search(source_node, target_node, stats=stats)
+            if cost == float("inf"):
+                return (cost, [], None, None)
+            return (source_cost + cost + target_cost, path, source_node, target_node)
+
+        table = self.route_table
+        names = list(sources) + list(targets)
+        if table is not None and all(name in self.compact for name in names):
+            # k x k cost lookups instead of a search, then one path rebuild
+            if stats is not None:
+                stats['table_hit'] = True
+                stats['engine'] = 'table'
+            return best_pair(table, self.compact, sources, targets)
+
+        if stats is not None:
+            stats['engine'] = 'multi_source'
+        return multi_source_search(self.compact, sources, targets, stats=stats)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_last_version_check = 0.0
+# Graph version this process last warmed the route cache for
+_warmed_version = None
+# ... and started contracting, when CONTRACTION_HIERARCHY is on
+_contracted_version = None
+
+
+def current_graph_version():
+    """Returns the version stored in the database (0 if never bumped)."""
+    version = GraphVersion.objects.filter(pk=1).values_list("version", flat=True).first()
+    return version or 0
+
+
+def bump_graph_version():
+    """
+    Increments the shared graph version so every worker rebuilds its
+    snapshot on the next poll. Call after any change to Station/Route data.
+    """
+    updated = GraphVersion.objects.filter(pk=1).update(version=F("version") + 1)
+    if not updated:
+        GraphVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+    transaction.on_commit(invalidate_snapshot)
+
+
+def invalidate_snapshot():
+    """Drops this process's snapshot; the next get_snapshot() rebuilds it."""
+    global _snapshot, _last_version_check
+    _snapshot = None
+    _last_version_check = 0.0
+
+
+def build_snapshot(version=None, debug=False):
+    """Walks Station and Route once and returns a new GraphSnapshot."""
+    # Read the version before the data so a concurrent change is picked up
+    # by the next poll instead of being masked
+    if version is None:
+        version = current_graph_version()
+
+    started = time.perf_counter()
+    graph, route_info, routes_per_station = transit_map(debug=debug)
+
+    stations = []
+    for station in Station.objects.filter(lat__isnull=False, lng__isnull=False):
+        stations.append({
+            'station_id': station.station_id,
+            'station_name': station.station_name,
+            'normalized_name': normalize(station.station_name),
+            'lat': float(station.lat),
+            'lng': float(station.lng),
+        })
+
+    routes = Route.objects.select_related('from_station', 'to_station').filter(
+        from_station__lat__isnull=False,
+        from_station__lng__isnull=False,
+        to_station__lat__isnull=False,
+        to_station__lng__isnull=False
+    )
+    route_edges = [{
+        'route_id': route.route_id,
+        'from_station_id': route.from_station.station_id,
+        'to_station_id': route.to_station.station_id,
+        'from_lat': float(route.from_station.lat),
+        'from_lng': float(route.from_station.lng),
+        'to_lat': float(route.to_station.lat),
+        'to_lng': float(route.to_station.lng)
+    } for route in routes]
+
+    station_names = list(Station.objects.order_by('id').values_list('station_name', flat=True))
+
+    schedules = {
+        schedule.route_id: (schedule.headway_minutes,
+                            schedule.first_departure.hour * 60 + schedule.first_departure.minute,
+                            schedule.last_departure.hour * 60 + schedule.last_departure.minute,
+                            schedule.speed_kmh)
+        for schedule in LineSchedule.objects.all()
+    }
+
+    snapshot = GraphSnapshot(version, graph, route_info, routes_per_station, stations, route_edges,
+                             station_names, schedules)
+    snapshot.route_table = load_route_table(version, snapshot.compact)
+
+    if metrics.METRICS_ENABLED:
+        metrics.GRAPH_BUILD_SECONDS.observe(time.perf_counter() - started)
+    if snapshot.route_table is None and ROUTE_TABLE_AUTOBUILD:
+        threading.Thread(target=_autobuild_route_table, args=(snapshot,), daemon=True).start()
+    return snapshot
+
+
+def save_snapshot(snapshot, path=None):
+    """Writes snapshot to the prebuilt snapshot file (atomically)."""
+    path = path or GRAPH_SNAPSHOT_FILE
+    # Encode the map API payloads now rather than in every worker
+    snapshot.stations_json
+    snapshot.route_edges_json
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({
+            'format': SNAPSHOT_FORMAT_VERSION,
+            'version': snapshot.version,
+            'snapshot': snapshot,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path=None):
+    """
+    Reads a prebuilt snapshot, or returns None if the file is missing or
+    unreadable. Its graph version is not checked against the database here.
+    """
+    path = path or GRAPH_SNAPSHOT_FILE
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get('format') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported format {data.get('format')!r}")
+        snapshot = data['snapshot']
+    except Exception as e:
+        logger.warning(f"Could not load graph snapshot {path}: {e}")
+        return None
+    snapshot.route_table = load_route_table(snapshot.version, snapshot.compact)
+    if snapshot.contraction is not None and not snapshot.contraction.matches(snapshot.compact):
+        logger.info(f"Ignoring stale contraction hierarchy in {path}")
+        snapshot.contraction = None
+    return snapshot
+
+
+def contract_snapshot(snapshot):
+    """Builds and attaches snapshot.contraction. Slow: minutes on large networks."""
+    started = time.perf_counter()
+    snapshot.contraction = build_contraction_hierarchy(snapshot.compact)
+    logger.info(f"Built contraction hierarchy for graph version {snapshot.version} "
+                f"in {time.perf_counter() - started:.2f}s")
+
+
+def preload_snapshot():
+    """
+    Installs the prebuilt snapshot as this process's snapshot without
+    touching the database. The first get_snapshot() still polls the graph
+    version and rebuilds if the file was stale. Returns True if loaded.
+    """
+    global _snapshot, _last_version_check
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return False
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = snapshot
+            _last_version_check = 0.0
+    # Keep the collector from writing to these objects' headers, which
+    # would copy their pages into every forked worker
+    gc.freeze()
+    logger.info(f"Loaded graph snapshot for version {snapshot.version} from {GRAPH_SNAPSHOT_FILE}")
+    return True
+
+
+def _autobuild_route_table(snapshot):
+    """Startup hook: fills in snapshot.route_table without blocking requests."""
+    try:
+        table = build_route_table(snapshot.compact, snapshot.version, processes=1)
+        table.save(route_table_path(snapshot.version))
+        snapshot.route_table = table
+        logger.info(f"Built route table for graph version {snapshot.version}")
+    except Exception as e:
+        logger.error(f"Route table build failed: {str(e)}", exc_info=True)
+
+
+def _autobuild_contraction(snapshot):
+    """Fills in snapshot.contraction without blocking requests."""
+    try:
+        contract_snapshot(snapshot)
+    except Exception as e:
+        logger.error(f"Contraction hierarchy build failed: {str(e)}", exc_info=True)
+
+
+def get_snapshot():
+    """
+    Returns the current GraphSnapshot, building it on first use and
+    rebuilding it when the GraphVersion row has moved on.
+    """
+    global _snapshot, _last_version_check, _warmed_version, _contracted_version
+
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _last_version_check < GRAPH_VERSION_POLL_SECONDS:
+        return snapshot
+
+    with _snapshot_lock, phase("snapshot"):
+        snapshot = _snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - _last_version_check < GRAPH_VERSION_POLL_SECONDS:
+            return snapshot
+
+        version = current_graph_version()
+        if snapshot is None or snapshot.version != version:
+            with phase("graph_build"):
+                snapshot = build_snapshot(version)
+            # Single reference assignment - readers see the old or the new
+            # snapshot, never a half-built one
+            _snapshot = snapshot
+        _last_version_check = now
+        if metrics.METRICS_ENABLED:
+            # Set on every poll: a preloaded snapshot was installed before
+            # the fork wiped the master's metrics
+            metrics.GRAPH_VERSION.set(snapshot.version)
+            metrics.GRAPH_STATIONS.set(len(snapshot.graph))
+            metrics.GRAPH_STATES.set(snapshot.compact.num_states)
+        if _warmed_version != snapshot.version:
+            # First snapshot in this process (a deploy) or a graph change
+            _warmed_version = snapshot.version
+            from routefinder import route_cache
+            route_cache.warm_in_background(snapshot)
+        if CONTRACTION_HIERARCHY and snapshot.contraction is None and _contracted_version != snapshot.version:
+            # Here rather than in build_snapshot(): a preloaded snapshot may
+            # lack one too, and a thread started before the fork would not
+            # survive into the workers
+            _contracted_version = snapshot.version
+            threading.Thread(target=_autobuild_contraction, args=(snapshot,), daemon=True).start()
+
+    return snapshot
+
+
+async def aget_snapshot():
+    """
+    get_snapshot() for async views. Returns the cached snapshot directly
+    while it is fresh; the version poll and any rebuild touch the database,
+    so those run in a worker thread.
+    """
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _last_version_check < GRAPH_VERSION_POLL_SECONDS:
+        return snapshot
+    return await sync_to_async(get_snapshot)()
+
+
 def find_station_by_partial_name(partial_name):
     normalized_partial = normalize(partial_name)
     matches = []
@@ -122,7 +552,10 @@ def diagnose_graph_issues():
         print("ERROR: No routes found in database!")
         return
     
-    graph, route_info, routes_per_station = transit_map(debug=True)
+    snapshot = get_snapshot()
+    graph, route_info = snapshot.graph, snapshot.route_info
+    print(f"Graph version: {snapshot.version}")
+    print(f"Graph has {len(graph)} nodes")
     issues = validate_graph_connectivity(graph)
     
     if not issues: